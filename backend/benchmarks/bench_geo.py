@@ -0,0 +1,62 @@
+"""
+Benchmark: scalar Haversine loop vs the vectorized utils.geo paths.
+
+Run from the backend directory:
+    python -m benchmarks.bench_geo
+"""
+import random
+import time
+
+from utils import geo
+from utils.helpers import calculate_distance
+
+SIZES = [10, 1_000, 100_000]
+ORIGIN = (33.5138, 36.2765)
+
+
+def random_points(n, seed=1):
+    rng = random.Random(seed)
+    return [(ORIGIN[0] + rng.uniform(-1, 1), ORIGIN[1] + rng.uniform(-1, 1)) for _ in range(n)]
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scalar_k_nearest(points, k):
+    distances = [calculate_distance(ORIGIN[0], ORIGIN[1], lat, lng) for lat, lng in points]
+    return sorted(range(len(points)), key=distances.__getitem__)[:k]
+
+
+def main():
+    print(f"numpy available: {geo.HAS_NUMPY}")
+    print(f"{'points':>8} | {'one-to-many scalar':>18} | {'vectorized':>10} | {'speedup':>7} | "
+          f"{'k=10 nearest scalar':>19} | {'vectorized':>10} | {'speedup':>7}")
+    for n in SIZES:
+        points = random_points(n)
+        repeat = 3 if n >= 100_000 else 20
+
+        scalar = best_of(lambda: [calculate_distance(ORIGIN[0], ORIGIN[1], lat, lng) for lat, lng in points], repeat)
+        vector = best_of(lambda: geo.distances_from(ORIGIN[0], ORIGIN[1], points), repeat)
+        knn_scalar = best_of(lambda: scalar_k_nearest(points, 10), repeat)
+        knn_vector = best_of(lambda: geo.k_nearest(ORIGIN[0], ORIGIN[1], points, k=10), repeat)
+        print(f"{n:>8} | {scalar * 1000:>15.3f} ms | {vector * 1000:>7.3f} ms | {scalar / vector:>6.1f}x | "
+              f"{knn_scalar * 1000:>16.3f} ms | {knn_vector * 1000:>7.3f} ms | {knn_scalar / knn_vector:>6.1f}x")
+
+    # Many-to-many: orders x drivers as used by the dispatcher
+    print()
+    print(f"{'matrix':>12} | {'scalar':>12} | {'vectorized':>10} | {'speedup':>7}")
+    for rows, cols in [(10, 10), (100, 1_000), (300, 3_000)]:
+        sources, targets = random_points(rows, 2), random_points(cols, 3)
+        scalar = best_of(lambda: [[calculate_distance(a, b, c, d) for c, d in targets] for a, b in sources], 3)
+        vector = best_of(lambda: geo.distance_matrix(sources, targets), 3)
+        print(f"{rows:>5}x{cols:<6} | {scalar * 1000:>9.3f} ms | {vector * 1000:>7.3f} ms | {scalar / vector:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
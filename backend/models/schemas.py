@@ -209,6 +209,7 @@ class OrderCreate(BaseModel):
     notes: Optional[str] = None
     recipient_name: Optional[str] = None
     recipient_phone: Optional[str] = None
+    coupon_code: Optional[str] = None
 
 class OrderItem(BaseModel):
     menu_item_id: str
@@ -240,6 +241,15 @@ class Order(BaseModel):
     order_status: str = "pending"
     address: dict
     notes: Optional[str] = None
+    city_id: Optional[str] = None
+    restaurant_address: Optional[str] = None
+    restaurant_lat: Optional[float] = None
+    restaurant_lng: Optional[float] = None
+    delivery_lat: Optional[float] = None
+    delivery_lng: Optional[float] = None
+    coupon_code: Optional[str] = None
+    coupon_id: Optional[str] = None
+    discount: float = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -299,7 +309,10 @@ class DriverOffer(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     order_id: str
     driver_id: str
+    city_id: Optional[str] = None
+    distance_km: Optional[float] = None
     status: str = "offered"
+    expires_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
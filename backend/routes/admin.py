@@ -1,4 +1,5 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
 from routes.deps import *
 from models.schemas import (
     UpdateUserStatusRequest, UpdateUserInfoRequest, ResetPasswordRequest,
@@ -8,6 +9,13 @@ from models.schemas import (
     ComplaintCreate, Complaint,
 )
 from typing import List, Optional
+from datetime import timezone
+from utils.order_state import ORDER_STAGES, stage_duration_fields
+from utils.idempotency import run_idempotent, request_fingerprint
+from utils.driver_presence import stale_driver_query, get_sweep_stats
+from utils.menu_snapshot import drop_menu_snapshots
+from utils.home_feed import invalidate_home_section
+from utils.admin_export import EXPORT_BATCH_SIZE, export_projection, stream_export
 
 router = APIRouter()
 
@@ -108,20 +116,31 @@ async def get_all_users(
 @router.get("/admin/users/{user_id}")
 async def get_user_details(user_id: str, admin: dict = Depends(require_admin_or_moderator)):
     """Get detailed user info"""
-    user = await db.users.find_one({"id": user_id})
-    if not user:
+    # User and their latest orders in one query
+    pipeline = [
+        {"$match": {"id": user_id}},
+        {"$limit": 1},
+        {"$project": {"_id": 0, "password": 0}},
+        # localField/foreignField together with a pipeline needs MongoDB 5.0+ (deployments run 8.0);
+        # the equality match uses the orders (user_id, created_at) index instead of scanning
+        {"$lookup": {
+            "from": "orders",
+            "localField": "id",
+            "foreignField": "user_id",
+            "pipeline": [
+                {"$sort": {"created_at": -1}},
+                {"$limit": 10},
+                {"$project": {"_id": 0}},
+            ],
+            "as": "recent_orders",
+        }},
+    ]
+    users = await db.users.aggregate(pipeline).to_list(1)
+    if not users:
         raise HTTPException(status_code=404, detail="المستخدم غير موجود")
     
-    user.pop("password", None)
-    user.pop("_id", None)
-    
-    # Get user orders
-    orders = await db.orders.find({"user_id": user_id}).sort("created_at", -1).limit(10).to_list(10)
-    
-    # Clean orders from MongoDB ObjectIds
-    for order in orders:
-        order.pop("_id", None)
-    
+    user = users[0]
+    orders = user.pop("recent_orders")
     return {"user": user, "recent_orders": orders}
 
 @router.put("/admin/users/{user_id}/status")
@@ -201,15 +220,14 @@ async def request_password_reset(request: PasswordResetRequestCreate):
     await db.password_reset_requests.insert_one(reset_request)
     
     # Notify admins
-    admins = await db.users.find({"role": {"$in": ["admin", "moderator"]}}).to_list(10)
-    for admin in admins:
-        await create_notification(
-            admin["id"],
-            "طلب إعادة تعيين كلمة مرور",
-            f"{user.get('name', 'مستخدم')} ({request.phone}) يطلب إعادة تعيين كلمة المرور",
-            "password_reset",
-            {"request_id": reset_request["id"], "phone": request.phone}
-        )
+    admins = await db.users.find({"role": {"$in": ["admin", "moderator"]}}, {"_id": 0, "id": 1}).to_list(10)
+    await create_notifications_bulk(
+        [admin["id"] for admin in admins],
+        "طلب إعادة تعيين كلمة مرور",
+        f"{user.get('name', 'مستخدم')} ({request.phone}) يطلب إعادة تعيين كلمة المرور",
+        "password_reset",
+        {"request_id": reset_request["id"], "phone": request.phone}
+    )
     
     return {"message": "تم إرسال طلبك للإدارة، سيتم التواصل معك قريباً"}
 
@@ -423,6 +441,7 @@ async def delete_user(user_id: str, admin: dict = Depends(require_admin)):
             {"owner_id": user_id},
             {"$set": {"is_active": False, "deleted_at": datetime.utcnow()}}
         )
+        invalidate_restaurant(owner_id=user_id)
     
     return {"message": "تم حذف المستخدم بنجاح"}
 
@@ -472,6 +491,7 @@ async def approve_restaurant(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="المطعم غير موجود")
+    invalidate_restaurant(restaurant_id)
     
     return {"message": "تم تحديث حالة المطعم", "is_approved": is_approved}
 
@@ -495,16 +515,26 @@ async def delete_restaurant(restaurant_id: str, admin: dict = Depends(require_ad
     
     # Delete restaurant's addon groups
     await db.addon_groups.delete_many({"restaurant_id": restaurant_id})
+    await drop_menu_snapshots([restaurant_id])
     
     # Delete restaurant's drivers
     await db.restaurant_drivers.delete_many({"restaurant_id": restaurant_id})
     
     # Delete the restaurant
     await db.restaurants.delete_one({"id": restaurant_id})
+    invalidate_restaurant(restaurant_id)
     
     return {"message": "تم حذف المطعم بنجاح"}
 
 
+@router.get("/admin/drivers/presence")
+async def get_driver_presence(admin: dict = Depends(require_admin_or_moderator)):
+    """Online driver counts and the offline sweeper's metrics (this worker)"""
+    online = await db.users.count_documents({"role": "driver", "is_online": True})
+    stale = await db.users.count_documents(stale_driver_query(datetime.utcnow()))
+    return {"online": online, "stale_online": stale, "sweeper": get_sweep_stats()}
+
+
 @router.get("/admin/drivers")
 async def get_all_drivers(
     status: str = None,
@@ -559,9 +589,18 @@ async def approve_driver(
 @router.post("/complaints")
 async def create_complaint(
     complaint_data: ComplaintCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     """Create a new complaint"""
+    return await run_idempotent(
+        current_user["id"], idempotency_key, "complaints.create",
+        lambda: _create_complaint(complaint_data, current_user),
+        fingerprint=request_fingerprint(complaint_data),
+    )
+
+
+async def _create_complaint(complaint_data: ComplaintCreate, current_user: dict):
     complaint = Complaint(
         user_id=current_user["id"],
         user_name=current_user.get("name", "مستخدم"),
@@ -589,15 +628,8 @@ async def get_my_complaints(current_user: dict = Depends(get_current_user)):
     return complaints
 
 @router.get("/restaurant/complaints")
-async def get_restaurant_complaints(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_complaints(restaurant: dict = Depends(get_current_restaurant)):
     """Get complaints directed at the restaurant"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     complaints = await db.complaints.find({
         "restaurant_id": restaurant["id"]
     }).sort("created_at", -1).to_list(50)
@@ -611,16 +643,9 @@ async def get_restaurant_complaints(current_user: dict = Depends(get_current_use
 async def respond_to_restaurant_complaint(
     complaint_id: str,
     response_data: ComplaintResponse,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Restaurant responds to a complaint"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     complaint = await db.complaints.find_one({"id": complaint_id, "restaurant_id": restaurant["id"]})
     if not complaint:
         raise HTTPException(status_code=404, detail="الشكوى غير موجودة")
@@ -678,20 +703,30 @@ async def get_all_complaints(
 @router.get("/admin/complaints/{complaint_id}")
 async def get_complaint_details(complaint_id: str, admin: dict = Depends(require_admin_or_moderator)):
     """Get complaint details"""
-    complaint = await db.complaints.find_one({"id": complaint_id})
-    if not complaint:
+    # Complaint and its related order (if any) in one query
+    pipeline = [
+        {"$match": {"id": complaint_id}},
+        {"$limit": 1},
+        {"$project": {"_id": 0}},
+        # Indexed equality match on orders.id (localField with a pipeline needs MongoDB 5.0+)
+        {"$lookup": {
+            "from": "orders",
+            "localField": "order_id",
+            "foreignField": "id",
+            "pipeline": [
+                {"$limit": 1},
+                {"$project": {"_id": 0}},
+            ],
+            "as": "related_order",
+        }},
+    ]
+    complaints = await db.complaints.aggregate(pipeline).to_list(1)
+    if not complaints:
         raise HTTPException(status_code=404, detail="الشكوى غير موجودة")
     
-    complaint.pop("_id", None)
-    
-    # Get related order if exists
-    order = None
-    if complaint.get("order_id"):
-        order = await db.orders.find_one({"id": complaint["order_id"]})
-        if order:
-            order.pop("_id", None)
-    
-    return {"complaint": complaint, "order": order}
+    complaint = complaints[0]
+    related = complaint.pop("related_order")
+    return {"complaint": complaint, "order": related[0] if related else None}
 
 @router.put("/admin/complaints/{complaint_id}/respond")
 async def respond_to_complaint(
@@ -742,7 +777,9 @@ async def clear_test_data(admin: dict = Depends(require_admin)):
     """Clear all test/seed data from the database (admin only)"""
     try:
         # Delete seeded restaurants (those with id starting with 'rest-')
+        seeded_ids = await db.restaurants.distinct("id", {"id": {"$regex": "^rest-"}})
         restaurants_result = await db.restaurants.delete_many({"id": {"$regex": "^rest-"}})
+        await drop_menu_snapshots(seeded_ids)
         
         # Delete seeded menu items
         menu_result = await db.menu_items.delete_many({"id": {"$regex": "^menu-"}})
@@ -766,6 +803,7 @@ async def clear_test_data(admin: dict = Depends(require_admin)):
         
         # Delete all notifications
         notifications_result = await db.notifications.delete_many({})
+        await db.notification_counters.delete_many({})
         
         # Delete all reviews
         reviews_result = await db.reviews.delete_many({})
@@ -825,6 +863,7 @@ async def update_app_settings(
         {"$set": update_data},
         upsert=True
     )
+    invalidate_home_section("settings")
     
     return {"message": "تم تحديث الإعدادات بنجاح"}
 
@@ -871,15 +910,14 @@ async def create_role_request(
     await db.role_requests.insert_one(role_request.dict())
     
     # Create notification for admins
-    admins = await db.users.find({"role": {"$in": ["admin", "moderator"]}}).to_list(50)
-    for admin in admins:
-        await create_notification(
-            admin["id"],
-            "طلب تغيير دور جديد 📋",
-            f"{current_user.get('name', 'مستخدم')} يريد التقدم كـ {'سائق' if request_data.requested_role == 'driver' else 'صاحب مطعم'}",
-            "role_request",
-            {"request_id": role_request.id}
-        )
+    admins = await db.users.find({"role": {"$in": ["admin", "moderator"]}}, {"_id": 0, "id": 1}).to_list(50)
+    await create_notifications_bulk(
+        [admin["id"] for admin in admins],
+        "طلب تغيير دور جديد 📋",
+        f"{current_user.get('name', 'مستخدم')} يريد التقدم كـ {'سائق' if request_data.requested_role == 'driver' else 'صاحب مطعم'}",
+        "role_request",
+        {"request_id": role_request.id}
+    )
     
     return {"message": "تم إرسال طلبك بنجاح، سيتم مراجعته من قبل الإدارة", "request_id": role_request.id}
 
@@ -1056,6 +1094,7 @@ async def create_advertisement(
         order=ad_data.order
     )
     await db.advertisements.insert_one(ad.dict())
+    invalidate_home_section("advertisements")
     return {"message": "تم إنشاء الإعلان بنجاح", "id": ad.id}
 
 @router.put("/admin/advertisements/{ad_id}")
@@ -1078,6 +1117,7 @@ async def update_advertisement(
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="الإعلان غير موجود")
+    invalidate_home_section("advertisements")
     return {"message": "تم تحديث الإعلان بنجاح"}
 
 @router.delete("/admin/advertisements/{ad_id}")
@@ -1089,6 +1129,7 @@ async def delete_advertisement(
     result = await db.advertisements.delete_one({"id": ad_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="الإعلان غير موجود")
+    invalidate_home_section("advertisements")
     return {"message": "تم حذف الإعلان بنجاح"}
 
 # ==================== Restaurant Featured (تمييز المطاعم) ====================
@@ -1106,17 +1147,28 @@ async def toggle_restaurant_featured(
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="المطعم غير موجود")
+    invalidate_home_section("restaurants")
+    invalidate_restaurant(restaurant_id)
     status = "تم تمييز" if is_featured else "تم إلغاء تمييز"
     return {"message": f"{status} المطعم بنجاح"}
 
 # ==================== Admin Statistics (إحصائيات الأدمن) ====================
 
+# Output fields for a row with the restaurant joined in as "restaurant"
+RESTAURANT_FIELDS = {
+    "restaurant_name": {"$ifNull": ["$restaurant.name", "غير معروف"]},
+    "restaurant_image": {"$ifNull": ["$restaurant.image", None]},
+    "is_featured": {"$ifNull": ["$restaurant.is_featured", False]},
+}
+
 @router.get("/admin/statistics/restaurants")
 async def get_restaurant_statistics(
+    limit: int = 100,
     admin: dict = Depends(require_admin_or_moderator)
 ):
     """Get order statistics per restaurant (admin)"""
-    # Aggregate orders by restaurant
+    limit = max(1, min(limit, 1000))
+    # Aggregate orders by restaurant and attach each restaurant's name in the same query
     pipeline = [
         {"$group": {
             "_id": "$restaurant_id",
@@ -1129,28 +1181,97 @@ async def get_restaurant_statistics(
                 "$sum": {"$cond": [{"$eq": ["$order_status", "cancelled"]}, 1, 0]}
             }
         }},
-        {"$sort": {"total_orders": -1}}
+        {"$sort": {"total_orders": -1}},
+        # Look up only the top rows; over-fetch so deleted restaurants rarely cost a slot
+        {"$limit": limit * 2},
+        {"$lookup": {
+            "from": "restaurants",
+            "localField": "_id",
+            "foreignField": "id",
+            "as": "restaurant",
+        }},
+        # Orders of deleted restaurants are left out
+        {"$unwind": "$restaurant"},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "restaurant_id": "$_id",
+            **RESTAURANT_FIELDS,
+            "total_orders": 1,
+            "completed_orders": 1,
+            "cancelled_orders": 1,
+            "total_revenue": 1,
+        }},
     ]
     
-    stats = await db.orders.aggregate(pipeline).to_list(100)
+    return await db.orders.aggregate(pipeline).to_list(limit)
+
+@router.get("/admin/statistics/stage-durations")
+async def get_stage_duration_statistics(
+    days: int = 7,
+    group_by: str = "restaurant",
+    city_id: Optional[str] = None,
+    restaurant_id: Optional[str] = None,
+    admin: dict = Depends(require_admin_or_moderator)
+):
+    """Percentiles (minutes) of accept/prep/driver/pickup/delivery times of delivered orders"""
+    if group_by not in ["restaurant", "city", "all"]:
+        raise HTTPException(status_code=400, detail="قيمة group_by غير صالحة")
+    
+    since = datetime.utcnow() - timedelta(days=max(1, min(days, 90)))
+    query = {"stage_timestamps.delivered": {"$gte": since}}
+    if city_id:
+        query["city_id"] = city_id
+    if restaurant_id:
+        query["restaurant_id"] = restaurant_id
+    
+    # Durations and percentiles are computed by the server; only one row per group comes back.
+    # $percentile needs MongoDB 7.0+ (deployments run 8.0); "approximate" is its t-digest method.
+    if group_by == "restaurant":
+        key, name = "$restaurant_id", "$restaurant_name"
+    elif group_by == "city":
+        key, name = "$city_id", "$city_id"
+    else:
+        key, name = "all", "all"
+    stage_names = [s[0] for s in ORDER_STAGES]
+    group = {"_id": key, "name": {"$first": name}, "orders": {"$sum": 1}}
+    for stage in stage_names:
+        group[stage] = {"$percentile": {"input": f"${stage}", "p": [0.5, 0.9, 0.95], "method": "approximate"}}
+        group[f"{stage}_count"] = {"$sum": {"$cond": [{"$eq": [{"$type": f"${stage}"}, "double"]}, 1, 0]}}
+    pipeline = [
+        {"$match": query},
+        {"$project": {"_id": 0, "restaurant_id": 1, "restaurant_name": 1, "city_id": 1, **stage_duration_fields()}},
+        {"$group": group},
+        {"$sort": {"orders": -1}},
+    ]
     
-    # Get restaurant names
     result = []
-    for stat in stats:
-        restaurant = await db.restaurants.find_one({"id": stat["_id"]})
-        if restaurant:
-            result.append({
-                "restaurant_id": stat["_id"],
-                "restaurant_name": restaurant.get("name", "غير معروف"),
-                "restaurant_image": restaurant.get("image"),
-                "is_featured": restaurant.get("is_featured", False),
-                "total_orders": stat["total_orders"],
-                "completed_orders": stat["completed_orders"],
-                "cancelled_orders": stat["cancelled_orders"],
-                "total_revenue": stat["total_revenue"]
-            })
-    
-    return result
+    async for row in db.orders.aggregate(pipeline):
+        stages = {}
+        for stage in stage_names:
+            # $percentile skips orders without the stage and gives nulls when none had it
+            p50, p90, p95 = (round(v, 1) if v is not None else None for v in row[stage])
+            stages[stage] = {"count": row[f"{stage}_count"], "p50": p50, "p90": p90, "p95": p95}
+        result.append({"id": row["_id"], "name": row.get("name") or "", "orders": row["orders"], "stages": stages})
+    
+    return {"since": since.isoformat(), "group_by": group_by, "groups": result}
+
+@router.get("/admin/statistics/push-delivery")
+async def get_push_delivery_statistics(days: int = 7, admin: dict = Depends(require_admin_or_moderator)):
+    """Push delivery per channel from Expo tickets and receipts"""
+    since = (datetime.utcnow() - timedelta(days=max(1, min(days, 90)))).strftime("%Y-%m-%d")
+    rows = await db.push_delivery_stats.find({"day": {"$gte": since}}, {"_id": 0}).to_list(None)
+    
+    channels = {}
+    for row in rows:
+        channel = channels.setdefault(row["channel_id"], {"sent": 0, "ticket_errors": 0, "delivered": 0, "failed": 0})
+        for field in channel:
+            channel[field] += row.get(field, 0)
+    for channel in channels.values():
+        receipted = channel["delivered"] + channel["failed"]
+        channel["delivery_rate"] = round(channel["delivered"] / receipted, 3) if receipted else None
+    dead_tokens = await db.push_tokens.count_documents({"deactivated_reason": "DeviceNotRegistered"})
+    return {"since": since, "channels": channels, "dead_tokens": dead_tokens}
 
 @router.get("/admin/statistics/restaurants/monthly")
 async def get_restaurant_monthly_statistics(
@@ -1188,20 +1309,30 @@ async def get_restaurant_monthly_statistics(
                 }
             }
         },
-        {"$sort": {"_id.month": 1, "total_orders": -1}}
+        {"$lookup": {
+            "from": "restaurants",
+            "localField": "_id.restaurant_id",
+            "foreignField": "id",
+            "as": "restaurant",
+        }},
+        {"$unwind": {"path": "$restaurant", "preserveNullAndEmptyArrays": True}},
+        {"$sort": {"total_orders": -1}},
+        # One row per month with its restaurants, busiest first
+        {"$group": {
+            "_id": "$_id.month",
+            "restaurants": {"$push": {
+                "restaurant_id": "$_id.restaurant_id",
+                **RESTAURANT_FIELDS,
+                "total_orders": "$total_orders",
+                "completed_orders": "$completed_orders",
+                "cancelled_orders": "$cancelled_orders",
+                "total_revenue": "$total_revenue",
+            }},
+        }},
+        {"$sort": {"_id": -1}},  # Most recent first
     ]
     
-    stats = await db.orders.aggregate(pipeline).to_list(500)
-    
-    # Get all restaurants
-    restaurants = {}
-    all_restaurants = await db.restaurants.find().to_list(100)
-    for r in all_restaurants:
-        restaurants[r["id"]] = {
-            "name": r.get("name", "غير معروف"),
-            "image": r.get("image"),
-            "is_featured": r.get("is_featured", False)
-        }
+    months = await db.orders.aggregate(pipeline).to_list(12)
     
     # Month names in Arabic
     month_names = {
@@ -1210,40 +1341,17 @@ async def get_restaurant_monthly_statistics(
         9: "سبتمبر", 10: "أكتوبر", 11: "نوفمبر", 12: "ديسمبر"
     }
     
-    # Organize data by month
-    monthly_data = {}
-    for stat in stats:
-        month = stat["_id"]["month"]
-        restaurant_id = stat["_id"]["restaurant_id"]
-        
-        if month not in monthly_data:
-            monthly_data[month] = {
-                "month": month,
-                "month_name": month_names.get(month, str(month)),
-                "year": year,
-                "restaurants": []
-            }
-        
-        restaurant_info = restaurants.get(restaurant_id, {"name": "غير معروف"})
-        monthly_data[month]["restaurants"].append({
-            "restaurant_id": restaurant_id,
-            "restaurant_name": restaurant_info.get("name"),
-            "restaurant_image": restaurant_info.get("image"),
-            "is_featured": restaurant_info.get("is_featured", False),
-            "total_orders": stat["total_orders"],
-            "completed_orders": stat["completed_orders"],
-            "cancelled_orders": stat["cancelled_orders"],
-            "total_revenue": stat["total_revenue"]
+    result = []
+    for row in months:
+        restaurants = row["restaurants"]
+        restaurants.sort(key=lambda x: x["total_orders"], reverse=True)
+        result.append({
+            "month": row["_id"],
+            "month_name": month_names.get(row["_id"], str(row["_id"])),
+            "year": year,
+            "restaurants": restaurants,
         })
     
-    # Sort restaurants within each month by total_orders
-    for month in monthly_data:
-        monthly_data[month]["restaurants"].sort(key=lambda x: x["total_orders"], reverse=True)
-    
-    # Convert to list and sort by month
-    result = list(monthly_data.values())
-    result.sort(key=lambda x: x["month"], reverse=True)  # Most recent first
-    
     return {"year": year, "months": result}
 
 @router.get("/admin/statistics/overview")
@@ -1283,3 +1391,100 @@ async def get_admin_overview_statistics(
         "pending_role_requests": pending_role_requests
     }
 
+# ==================== Data Exports (تصدير البيانات) ====================
+
+def _export_range(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    """created_at filter from ISO dates/datetimes (UTC); a plain date_to includes that whole day"""
+    created_at = {}
+    for key, value in [("$gte", date_from), ("$lt", date_to)]:
+        if not value:
+            continue
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"تاريخ غير صالح: {value}")
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        if key == "$lt" and len(value) == 10:
+            parsed += timedelta(days=1)
+        created_at[key] = parsed
+    return {"created_at": created_at} if created_at else {}
+
+
+def _export_response(kind: str, query: dict, format: str, gzip: bool):
+    if format not in ["csv", "ndjson"]:
+        raise HTTPException(status_code=400, detail="صيغة غير مدعومة، استخدم csv أو ndjson")
+    
+    # Oldest first so an interrupted export can be resumed with date_from
+    cursor = db[kind].find(query, export_projection(kind)).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+    if gzip:
+        media_type = "application/gzip"
+    else:
+        media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{format}{'.gz' if gzip else ''}"
+    logger.info(f"Export of {kind} started: {query}")
+    return StreamingResponse(
+        stream_export(kind, cursor, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/admin/export/orders")
+async def export_orders(
+    format: str = "csv",
+    gzip: bool = False,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    city_id: Optional[str] = None,
+    status: Optional[str] = None,
+    restaurant_id: Optional[str] = None,
+    admin: dict = Depends(require_admin_or_moderator)
+):
+    """Stream orders as CSV or NDJSON (optionally gzip), filtered by creation date, city, status and restaurant"""
+    query = _export_range(date_from, date_to)
+    if city_id:
+        query["city_id"] = city_id
+    if status:
+        query["order_status"] = status
+    if restaurant_id:
+        query["restaurant_id"] = restaurant_id
+    return _export_response("orders", query, format, gzip)
+
+@router.get("/admin/export/users")
+async def export_users(
+    format: str = "csv",
+    gzip: bool = False,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    city_id: Optional[str] = None,
+    role: Optional[str] = None,
+    admin: dict = Depends(require_admin_or_moderator)
+):
+    """Stream users (without credentials) as CSV or NDJSON, filtered by sign-up date, city and role"""
+    query = _export_range(date_from, date_to)
+    if city_id:
+        query["city_id"] = city_id
+    if role:
+        query["role"] = role
+    return _export_response("users", query, format, gzip)
+
+@router.get("/admin/export/complaints")
+async def export_complaints(
+    format: str = "csv",
+    gzip: bool = False,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    city_id: Optional[str] = None,
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    admin: dict = Depends(require_admin_or_moderator)
+):
+    """Stream complaints as CSV or NDJSON; the city filter matches complaints about that city's restaurants"""
+    query = _export_range(date_from, date_to)
+    if city_id:
+        query["restaurant_id"] = {"$in": await db.restaurants.distinct("id", {"city_id": city_id})}
+    if status:
+        query["status"] = status
+    if type:
+        query["type"] = type
+    return _export_response("complaints", query, format, gzip)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from database import db
 from utils.auth import get_current_user
+from utils.home_feed import invalidate_home_section
 from datetime import datetime
 import uuid
 
@@ -56,6 +57,7 @@ async def create_category(data: dict, current_user: dict = Depends(get_current_u
         "created_at": datetime.utcnow(),
     }
     await db.categories.insert_one(category)
+    invalidate_home_section("categories")
     category.pop("_id", None)
     return category
 
@@ -74,6 +76,7 @@ async def update_category(category_id: str, data: dict, current_user: dict = Dep
     result = await db.categories.update_one({"id": category_id}, {"$set": update_data})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="الصنف غير موجود")
+    invalidate_home_section("categories")
     return {"message": "تم تحديث الصنف بنجاح"}
 
 
@@ -87,4 +90,5 @@ async def delete_category(category_id: str, current_user: dict = Depends(get_cur
         raise HTTPException(status_code=400, detail="لا يمكن حذف صنف 'الكل'")
     
     await db.categories.update_one({"id": category_id}, {"$set": {"is_active": False}})
+    invalidate_home_section("categories")
     return {"message": "تم حذف الصنف"}
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from routes.deps import *
 from models.schemas import UserLocationUpdate
 from typing import Optional
+from utils.spatial import CityLocator
 
 router = APIRouter()
 
@@ -14,16 +15,16 @@ SYRIAN_CITIES = [
         "lat": 33.5138,
         "lng": 36.2765,
         "districts": [
-            {"id": "mazzeh", "name": "المزة", "name_en": "Mazzeh"},
-            {"id": "kafarsouseh", "name": "كفرسوسة", "name_en": "Kafarsouseh"},
-            {"id": "malki", "name": "المالكي", "name_en": "Malki"},
-            {"id": "abu_rummaneh", "name": "أبو رمانة", "name_en": "Abu Rummaneh"},
-            {"id": "sha3lan", "name": "الشعلان", "name_en": "Shaalan"},
-            {"id": "midan", "name": "الميدان", "name_en": "Midan"},
-            {"id": "bab_touma", "name": "باب توما", "name_en": "Bab Touma"},
-            {"id": "qassa3", "name": "القصاع", "name_en": "Qassa"},
-            {"id": "jaramana", "name": "جرمانا", "name_en": "Jaramana"},
-            {"id": "sahnaya", "name": "صحنايا", "name_en": "Sahnaya"},
+            {"id": "mazzeh", "name": "المزة", "name_en": "Mazzeh", "lat": 33.5006, "lng": 36.2445},
+            {"id": "kafarsouseh", "name": "كفرسوسة", "name_en": "Kafarsouseh", "lat": 33.4996, "lng": 36.2696},
+            {"id": "malki", "name": "المالكي", "name_en": "Malki", "lat": 33.5225, "lng": 36.2755},
+            {"id": "abu_rummaneh", "name": "أبو رمانة", "name_en": "Abu Rummaneh", "lat": 33.5158, "lng": 36.283},
+            {"id": "sha3lan", "name": "الشعلان", "name_en": "Shaalan", "lat": 33.5155, "lng": 36.2895},
+            {"id": "midan", "name": "الميدان", "name_en": "Midan", "lat": 33.493, "lng": 36.299},
+            {"id": "bab_touma", "name": "باب توما", "name_en": "Bab Touma", "lat": 33.5137, "lng": 36.3155},
+            {"id": "qassa3", "name": "القصاع", "name_en": "Qassa", "lat": 33.5187, "lng": 36.317},
+            {"id": "jaramana", "name": "جرمانا", "name_en": "Jaramana", "lat": 33.4862, "lng": 36.3462},
+            {"id": "sahnaya", "name": "صحنايا", "name_en": "Sahnaya", "lat": 33.433, "lng": 36.237},
         ]
     },
     {
@@ -33,12 +34,12 @@ SYRIAN_CITIES = [
         "lat": 36.2021,
         "lng": 37.1343,
         "districts": [
-            {"id": "aziziyeh", "name": "العزيزية", "name_en": "Aziziyeh"},
-            {"id": "shahba", "name": "شهباء", "name_en": "Shahba"},
-            {"id": "hamdaniyeh", "name": "الحمدانية", "name_en": "Hamdaniyeh"},
-            {"id": "sulaymaniyeh", "name": "السليمانية", "name_en": "Sulaymaniyeh"},
-            {"id": "midan_aleppo", "name": "الميدان", "name_en": "Midan"},
-            {"id": "jamiliyeh", "name": "الجميلية", "name_en": "Jamiliyeh"},
+            {"id": "aziziyeh", "name": "العزيزية", "name_en": "Aziziyeh", "lat": 36.2105, "lng": 37.144},
+            {"id": "shahba", "name": "شهباء", "name_en": "Shahba", "lat": 36.224, "lng": 37.118},
+            {"id": "hamdaniyeh", "name": "الحمدانية", "name_en": "Hamdaniyeh", "lat": 36.184, "lng": 37.115},
+            {"id": "sulaymaniyeh", "name": "السليمانية", "name_en": "Sulaymaniyeh", "lat": 36.213, "lng": 37.153},
+            {"id": "midan_aleppo", "name": "الميدان", "name_en": "Midan", "lat": 36.215, "lng": 37.16},
+            {"id": "jamiliyeh", "name": "الجميلية", "name_en": "Jamiliyeh", "lat": 36.206, "lng": 37.137},
         ]
     },
     {
@@ -48,11 +49,11 @@ SYRIAN_CITIES = [
         "lat": 34.7324,
         "lng": 36.7137,
         "districts": [
-            {"id": "inshaat", "name": "الإنشاءات", "name_en": "Inshaat"},
-            {"id": "wa3r", "name": "الوعر", "name_en": "Waer"},
-            {"id": "zahra", "name": "الزهراء", "name_en": "Zahra"},
-            {"id": "akrama", "name": "عكرمة", "name_en": "Akrama"},
-            {"id": "ghouta", "name": "الغوطة", "name_en": "Ghouta"},
+            {"id": "inshaat", "name": "الإنشاءات", "name_en": "Inshaat", "lat": 34.718, "lng": 36.696},
+            {"id": "wa3r", "name": "الوعر", "name_en": "Waer", "lat": 34.738, "lng": 36.67},
+            {"id": "zahra", "name": "الزهراء", "name_en": "Zahra", "lat": 34.729, "lng": 36.737},
+            {"id": "akrama", "name": "عكرمة", "name_en": "Akrama", "lat": 34.715, "lng": 36.723},
+            {"id": "ghouta", "name": "الغوطة", "name_en": "Ghouta", "lat": 34.729, "lng": 36.7},
         ]
     },
     {
@@ -62,11 +63,11 @@ SYRIAN_CITIES = [
         "lat": 35.5317,
         "lng": 35.7918,
         "districts": [
-            {"id": "kornish", "name": "الكورنيش", "name_en": "Corniche"},
-            {"id": "zira3a", "name": "الزراعة", "name_en": "Ziraa"},
-            {"id": "american", "name": "الأمريكان", "name_en": "American"},
-            {"id": "mashrou3", "name": "المشروع", "name_en": "Mashrou"},
-            {"id": "slibeh", "name": "الصليبة", "name_en": "Slibeh"},
+            {"id": "kornish", "name": "الكورنيش", "name_en": "Corniche", "lat": 35.525, "lng": 35.777},
+            {"id": "zira3a", "name": "الزراعة", "name_en": "Ziraa", "lat": 35.538, "lng": 35.798},
+            {"id": "american", "name": "الأمريكان", "name_en": "American", "lat": 35.529, "lng": 35.787},
+            {"id": "mashrou3", "name": "المشروع", "name_en": "Mashrou", "lat": 35.545, "lng": 35.79},
+            {"id": "slibeh", "name": "الصليبة", "name_en": "Slibeh", "lat": 35.518, "lng": 35.785},
         ]
     },
     {
@@ -76,12 +77,16 @@ SYRIAN_CITIES = [
         "lat": 34.8890,
         "lng": 35.8866,
         "districts": [
-            {"id": "kornish_tartous", "name": "الكورنيش", "name_en": "Corniche"},
-            {"id": "thawra", "name": "الثورة", "name_en": "Thawra"},
-            {"id": "dawwar", "name": "الدوار", "name_en": "Dawwar"},
+            {"id": "kornish_tartous", "name": "الكورنيش", "name_en": "Corniche", "lat": 34.892, "lng": 35.878},
+            {"id": "thawra", "name": "الثورة", "name_en": "Thawra", "lat": 34.885, "lng": 35.893},
+            {"id": "dawwar", "name": "الدوار", "name_en": "Dawwar", "lat": 34.895, "lng": 35.888},
         ]
     },
 ]
+
+# Precomputed spatial lookup over city and district centroids
+CITY_LOCATOR = CityLocator(SYRIAN_CITIES)
+
 @router.get("/cities")
 async def get_cities():
     """Get list of available cities with districts"""
@@ -89,14 +94,10 @@ async def get_cities():
 
 @router.get("/cities/detect")
 async def detect_city(lat: float, lng: float):
-    """Detect the closest city based on GPS coordinates"""
-    closest_city = None
-    min_distance = float('inf')
-    for city in SYRIAN_CITIES:
-        dist = calculate_distance(lat, lng, city["lat"], city["lng"])
-        if dist < min_distance:
-            min_distance = dist
-            closest_city = city
+    """Detect the closest city (and district) based on GPS coordinates"""
+    located = CITY_LOCATOR.locate(lat, lng)
+    closest_city = located["city"]
+    min_distance = located["city_distance_km"]
     
     # If user is more than 200km from nearest Syrian city, they're outside coverage
     if min_distance > 200:
@@ -109,9 +110,12 @@ async def detect_city(lat: float, lng: float):
         }
     
     if closest_city:
+        district = located["district"]
         return {
             "city_id": closest_city["id"],
             "city_name": closest_city["name"],
+            "district_id": district["id"] if district else None,
+            "district_name": district["name"] if district else None,
             "distance_km": round(min_distance, 1),
             "outside_coverage": False
         }
@@ -120,9 +124,9 @@ async def detect_city(lat: float, lng: float):
 @router.get("/cities/{city_id}")
 async def get_city(city_id: str):
     """Get specific city details"""
-    for city in SYRIAN_CITIES:
-        if city["id"] == city_id:
-            return city
+    city = CITY_LOCATOR.get_city(city_id)
+    if city:
+        return city
     raise HTTPException(status_code=404, detail="المدينة غير موجودة")
 
 @router.put("/users/location")
@@ -132,31 +136,25 @@ async def update_user_location(
 ):
     """Update user's current location (city/district)"""
     # Validate city exists
-    city = None
-    for c in SYRIAN_CITIES:
-        if c["id"] == location.city_id:
-            city = c
-            break
-    
+    city = CITY_LOCATOR.get_city(location.city_id)
     if not city:
         raise HTTPException(status_code=400, detail="المدينة غير موجودة")
     
-    # Validate district if provided
-    if location.district_id:
-        district_found = False
-        for d in city["districts"]:
-            if d["id"] == location.district_id:
-                district_found = True
-                break
-        if not district_found:
+    # Validate district if provided, otherwise detect it from the coordinates
+    district_id = location.district_id
+    if district_id:
+        if not CITY_LOCATOR.get_district(city["id"], district_id):
             raise HTTPException(status_code=400, detail="المنطقة غير موجودة")
+    elif location.lat is not None and location.lng is not None:
+        district, _ = CITY_LOCATOR.nearest_district(city["id"], location.lat, location.lng)
+        district_id = district["id"] if district else None
     
     # Update user location
     await db.users.update_one(
         {"id": current_user["id"]},
         {"$set": {
             "city_id": location.city_id,
-            "district_id": location.district_id,
+            "district_id": district_id,
             "lat": location.lat,
             "lng": location.lng,
             "location_updated_at": datetime.utcnow()
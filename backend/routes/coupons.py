@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from database import db
 from utils.auth import get_current_user
+from utils.idempotency import run_idempotent, request_fingerprint
+from pymongo.errors import DuplicateKeyError
+from utils.coupons import (
+    normalize_code, parse_expiry, serialize_coupon, check_coupon, compute_discount,
+    find_usable_coupon, redeem_coupon,
+)
 from datetime import datetime, timezone
+from typing import Optional
 import uuid
 
 router = APIRouter()
@@ -14,22 +21,23 @@ async def create_coupon(data: dict, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=403, detail="غير مصرح")
     coupon = {
         "id": str(uuid.uuid4())[:8],
-        "code": data["code"].upper().strip(),
+        "code": normalize_code(data["code"]),
         "discount_type": data.get("discount_type", "percentage"),  # percentage | fixed | free_delivery
         "discount_value": data.get("discount_value", 0),
         "min_order": data.get("min_order", 0),
         "max_uses": data.get("max_uses", 100),
         "used_count": 0,
-        "expires_at": data.get("expires_at"),
+        "expires_at": parse_expiry(data.get("expires_at")),
         "is_active": True,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    existing = await db.coupons.find_one({"code": coupon["code"]})
-    if existing:
+    try:
+        # Unique index on code: two admins creating the same code cannot both succeed
+        await db.coupons.insert_one(coupon)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="كود الكوبون موجود مسبقاً")
-    await db.coupons.insert_one(coupon)
     coupon.pop("_id", None)
-    return coupon
+    return serialize_coupon(coupon)
 
 
 @router.get("/admin/coupons")
@@ -38,7 +46,7 @@ async def get_coupons(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") not in ["admin"]:
         raise HTTPException(status_code=403, detail="غير مصرح")
     coupons = await db.coupons.find({}, {"_id": 0}).sort("created_at", -1).to_list(200)
-    return coupons
+    return [serialize_coupon(c) for c in coupons]
 
 
 @router.put("/admin/coupons/{coupon_id}")
@@ -51,8 +59,14 @@ async def update_coupon(coupon_id: str, data: dict, current_user: dict = Depends
         if key in data:
             update[key] = data[key]
     if "code" in update:
-        update["code"] = update["code"].upper().strip()
-    result = await db.coupons.update_one({"id": coupon_id}, {"$set": update})
+        update["code"] = normalize_code(update["code"])
+    if "expires_at" in update:
+        update["expires_at"] = parse_expiry(update["expires_at"])
+    ops = {"$set": update}
+    if update.get("is_active"):
+        # Re-enabled by hand: no longer counts as swept
+        ops["$unset"] = {"deactivated_reason": "", "deactivated_at": ""}
+    result = await db.coupons.update_one({"id": coupon_id}, ops)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="الكوبون غير موجود")
     return {"message": "تم تحديث الكوبون"}
@@ -70,32 +84,16 @@ async def delete_coupon(coupon_id: str, current_user: dict = Depends(get_current
 @router.post("/coupons/validate")
 async def validate_coupon(data: dict, current_user: dict = Depends(get_current_user)):
     """Validate a coupon code and return discount info"""
-    code = data.get("code", "").upper().strip()
+    code = normalize_code(data.get("code", ""))
     subtotal = data.get("subtotal", 0)
     if not code:
         raise HTTPException(status_code=400, detail="يرجى إدخال كود الخصم")
-    coupon = await db.coupons.find_one({"code": code, "is_active": True}, {"_id": 0})
-    if not coupon:
-        raise HTTPException(status_code=404, detail="كود الخصم غير صالح")
-    if coupon.get("max_uses") and coupon["used_count"] >= coupon["max_uses"]:
-        raise HTTPException(status_code=400, detail="تم استنفاد عدد مرات استخدام هذا الكوبون")
-    if coupon.get("expires_at"):
-        try:
-            exp = datetime.fromisoformat(coupon["expires_at"].replace("Z", "+00:00"))
-            if datetime.now(timezone.utc) > exp:
-                raise HTTPException(status_code=400, detail="انتهت صلاحية هذا الكوبون")
-        except (ValueError, TypeError):
-            pass
-    if coupon.get("min_order") and subtotal < coupon["min_order"]:
-        raise HTTPException(status_code=400, detail=f"الحد الأدنى للطلب {coupon['min_order']} ل.س")
-    # Calculate discount
-    discount = 0
-    if coupon["discount_type"] == "percentage":
-        discount = int(subtotal * coupon["discount_value"] / 100)
-    elif coupon["discount_type"] == "fixed":
-        discount = coupon["discount_value"]
-    elif coupon["discount_type"] == "free_delivery":
-        discount = 0  # handled in frontend
+    coupon = await find_usable_coupon(code=code)
+    check_coupon(coupon, subtotal)
+    if await db.coupon_redemptions.count_documents({"coupon_id": coupon["id"], "user_id": current_user["id"]}, limit=1):
+        raise HTTPException(status_code=400, detail="لقد استخدمت هذا الكوبون مسبقاً")
+    # Free delivery is applied against the delivery fee when the order is placed
+    discount = compute_discount(coupon, subtotal)
     return {
         "valid": True,
         "coupon_id": coupon["id"],
@@ -108,9 +106,22 @@ async def validate_coupon(data: dict, current_user: dict = Depends(get_current_u
 
 
 @router.post("/coupons/use")
-async def use_coupon(data: dict, current_user: dict = Depends(get_current_user)):
-    """Increment coupon usage count (called after order is placed)"""
-    coupon_id = data.get("coupon_id")
-    if coupon_id:
-        await db.coupons.update_one({"id": coupon_id}, {"$inc": {"used_count": 1}})
-    return {"message": "ok"}
+async def use_coupon(
+    data: dict,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Record a coupon use for clients that do not send coupon_code with the order"""
+    async def redeem():
+        coupon_id = data.get("coupon_id")
+        if not coupon_id:
+            return {"message": "ok"}
+        # Already redeemed by this user (through the order or an earlier call): nothing to do
+        if await db.coupon_redemptions.count_documents({"coupon_id": coupon_id, "user_id": current_user["id"]}, limit=1):
+            return {"message": "ok"}
+        await redeem_coupon(current_user["id"], coupon_id=coupon_id, order_id=data.get("order_id"))
+        return {"message": "ok"}
+    
+    return await run_idempotent(
+        current_user["id"], idempotency_key, "coupons.use", redeem, fingerprint=request_fingerprint(data)
+    )
@@ -2,7 +2,13 @@ from fastapi import APIRouter
 from routes.deps import *
 from models.schemas import DriverLocation, DriverStatus, OrderStatusUpdate
 from typing import List, Optional
-from routes.cities import SYRIAN_CITIES
+from routes.cities import CITY_LOCATOR
+from utils.location_store import record_driver_location, set_driver_city, peek_driver_location
+from utils.breadcrumbs import record_breadcrumb, get_driver_route
+from utils.dispatch import DISPATCH_ENABLED, open_to_driver, release_offer, request_dispatch
+from utils.order_state import transition_order
+from utils.eta import estimate_eta
+from utils.tracking import get_tracking_snapshot
 
 router = APIRouter()
 
@@ -14,10 +20,12 @@ async def update_driver_status(status: DriverStatus, current_user: dict = Depend
     if current_user.get("role") != "driver":
         raise HTTPException(status_code=403, detail="غير مصرح")
     
-    await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$set": {"is_online": status.is_online}}
-    )
+    update = {"is_online": status.is_online}
+    if status.is_online:
+        # Grace period for the first location heartbeat (see utils/driver_presence)
+        update["went_online_at"] = datetime.utcnow()
+    # A manual change overrides an automatic offline marking
+    await db.users.update_one({"id": current_user["id"]}, {"$set": update, "$unset": {"offline_reason": ""}})
     
     return {"is_online": status.is_online}
 
@@ -27,28 +35,42 @@ async def update_driver_location(location: DriverLocation, current_user: dict =
     if current_user.get("role") != "driver":
         raise HTTPException(status_code=403, detail="غير مصرح")
     
-    # Auto-detect city from GPS coordinates
-    closest_city_id = None
-    min_dist = float('inf')
-    for city in SYRIAN_CITIES:
-        dist = calculate_distance(location.lat, location.lng, city["lat"], city["lng"])
-        if dist < min_dist:
-            min_dist = dist
-            closest_city_id = city["id"]
-    
-    update_data = {
-        "current_location": {"lat": location.lat, "lng": location.lng},
-        "location_updated_at": datetime.utcnow()
-    }
-    if closest_city_id:
-        update_data["city_id"] = closest_city_id
+    # Heartbeats are back after the sweeper marked this driver offline: restore the status
+    if not current_user.get("is_online") and current_user.get("offline_reason") == "heartbeat_timeout":
+        await db.users.update_one(
+            {"id": current_user["id"], "offline_reason": "heartbeat_timeout"},
+            {"$set": {"is_online": True, "went_online_at": datetime.utcnow()}, "$unset": {"offline_reason": ""}}
+        )
     
-    await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$set": update_data}
-    )
+    # Buffer the ping in memory; it is persisted by the write-behind flusher
+    moved = record_driver_location(current_user["id"], location.lat, location.lng)
+    city_id = current_user.get("city_id")
+    if not moved:
+        return {"message": "تم تحديث الموقع", "city_id": city_id}
+    
+    record_breadcrumb(current_user["id"], location.lat, location.lng)
     
-    return {"message": "تم تحديث الموقع", "city_id": closest_city_id}
+    # Auto-detect city and district from GPS coordinates
+    located = CITY_LOCATOR.locate(location.lat, location.lng)
+    closest_city_id = located["city"]["id"] if located["city"] else None
+    district = located["district"]
+    
+    if closest_city_id:
+        set_driver_city(
+            current_user["id"],
+            closest_city_id,
+            district_id=district["id"] if district else None,
+            area=district["name"] if district else None,
+        )
+        # Only touch the users document when the driver actually changes city
+        if closest_city_id != city_id:
+            await db.users.update_one(
+                {"id": current_user["id"]},
+                {"$set": {"city_id": closest_city_id}}
+            )
+            city_id = closest_city_id
+    
+    return {"message": "تم تحديث الموقع", "city_id": city_id}
 
 
 @router.put("/driver/city")
@@ -67,10 +89,11 @@ async def update_driver_city(data: dict, current_user: dict = Depends(get_curren
 
 @router.get("/orders/{order_id}/driver-location")
 async def get_driver_location_for_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    """Get live driver location for an order with ETA"""
-    order = await db.orders.find_one({"id": order_id})
-    if not order:
+    """Get live driver location for an order with ETA (served from the tracking snapshot)"""
+    snapshot = await get_tracking_snapshot(order_id)
+    if not snapshot:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
+    order = snapshot["order"]
     
     is_customer = order.get("user_id") == current_user["id"]
     is_restaurant = current_user.get("role") == "restaurant"
@@ -82,36 +105,21 @@ async def get_driver_location_for_order(order_id: str, current_user: dict = Depe
     if not driver_id:
         return {"driver_location": None, "driver_assigned": False, "message": "لم يتم تعيين سائق بعد"}
     
-    driver = await db.users.find_one({"id": driver_id})
+    driver = snapshot["driver"]
     if not driver:
         return {"driver_location": None, "driver_assigned": True, "message": "السائق غير موجود في النظام"}
     
-    location = driver.get("current_location")
-    location_time = driver.get("location_updated_at")
+    location = snapshot["location"]
+    location_time = snapshot["location_updated_at"]
     
-    # Get restaurant location
-    restaurant = await db.restaurants.find_one({"id": order.get("restaurant_id")})
-    rest_lat = restaurant.get("lat") if restaurant else None
-    rest_lng = restaurant.get("lng") if restaurant else None
-    rest_name = restaurant.get("name", "") if restaurant else ""
+    rest_lat = order.get("restaurant_lat")
+    rest_lng = order.get("restaurant_lng")
+    rest_name = order.get("restaurant_name", "")
     
-    # Calculate distances and ETA
+    # Distances and ETA from historical stage durations (in-memory tables)
     driver_lat = location.get("lat") if location and isinstance(location, dict) else None
     driver_lng = location.get("lng") if location and isinstance(location, dict) else None
-    
-    distance_to_restaurant = None
-    distance_to_customer = None
-    eta_to_restaurant = None
-    eta_to_customer = None
-    
-    if driver_lat and driver_lng:
-        if rest_lat and rest_lng:
-            distance_to_restaurant = round(calculate_distance(driver_lat, driver_lng, rest_lat, rest_lng), 1)
-            eta_to_restaurant = max(3, int(distance_to_restaurant * 3 + 2))
-        
-        if rest_lat and rest_lng and distance_to_restaurant is not None:
-            total_distance = distance_to_restaurant * 2.5
-            eta_to_customer = max(5, int(total_distance * 3 + 5))
+    eta = estimate_eta(order, driver_lat, driver_lng)
     
     order_status = order.get("order_status", "")
     
@@ -142,14 +150,54 @@ async def get_driver_location_for_order(order_id: str, current_user: dict = Depe
         "restaurant_name": rest_name,
         "restaurant_lat": rest_lat,
         "restaurant_lng": rest_lng,
-        "distance_to_restaurant_km": distance_to_restaurant,
-        "distance_to_customer_km": distance_to_customer,
-        "eta_to_restaurant_min": eta_to_restaurant,
-        "eta_to_customer_min": eta_to_customer,
+        "delivery_lat": order.get("delivery_lat"),
+        "delivery_lng": order.get("delivery_lng"),
+        **eta,
         "phase": phase,
         "phase_text": phase_text,
     }
 
+def _route_start(order: dict, customer_view: bool):
+    """When the trail of an order begins: the driver's assignment (pickup for customers)"""
+    stamps = order.get("stage_timestamps") or {}
+    statuses = ["picked_up", "out_for_delivery"]
+    if not customer_view:
+        statuses.insert(0, "driver_assigned")
+    return next((stamps[s] for s in statuses if stamps.get(s)), None)
+
+@router.get("/orders/{order_id}/route")
+async def get_order_route(order_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the driver's breadcrumb trail for an order"""
+    order = await db.orders.find_one({"id": order_id})
+    if not order:
+        raise HTTPException(status_code=404, detail="الطلب غير موجود")
+    
+    is_customer = order.get("user_id") == current_user["id"]
+    is_driver = order.get("driver_id") == current_user["id"]
+    is_admin = current_user.get("role") in ["admin", "moderator"]
+    is_restaurant = False
+    if current_user.get("role") == "restaurant" and not (is_customer or is_driver):
+        try:
+            restaurant = await get_current_restaurant(current_user)
+            is_restaurant = restaurant["id"] == order.get("restaurant_id")
+        except HTTPException:
+            pass
+    if not is_customer and not is_driver and not is_restaurant and not is_admin:
+        raise HTTPException(status_code=403, detail="غير مصرح")
+    
+    driver_id = order.get("driver_id")
+    # Movements before the driver took this order (other deliveries) are not shown
+    start = _route_start(order, customer_view=is_customer and not (is_driver or is_restaurant or is_admin))
+    if not driver_id or not start:
+        return {"order_id": order_id, "driver_id": driver_id, "points": [], "count": 0}
+    
+    end = datetime.utcnow()
+    if order.get("order_status") in ["delivered", "cancelled"] and order.get("updated_at"):
+        end = order["updated_at"]
+    
+    points = await get_driver_route(driver_id, start, end)
+    return {"order_id": order_id, "driver_id": driver_id, "points": points, "count": len(points)}
+
 @router.get("/driver/available-orders")
 async def get_available_orders_for_driver(current_user: dict = Depends(get_current_user)):
     """Get orders ready for pickup in driver's city"""
@@ -167,33 +215,37 @@ async def get_available_orders_for_driver(current_user: dict = Depends(get_curre
         logger.info(f"Driver {current_user['id']} has no city_id set, returning empty")
         return []
     
-    # Get restaurants in driver's city ONLY
-    city_restaurants = await db.restaurants.find({"city_id": driver_city}).to_list(200)
-    city_restaurant_ids = [r["id"] for r in city_restaurants]
-    
-    if not city_restaurant_ids:
-        logger.info(f"No restaurants in driver's city ({driver_city})")
-        return []
-    
-    # Query: orders assigned to platform_driver that are ready/preparing and unassigned
+    # Query: platform orders of the driver's city that are ready/preparing and unassigned
+    # (served by the city_id/order_status/delivery_mode/created_at index)
     query = {
+        "city_id": driver_city,
         "order_status": {"$in": ["ready", "preparing"]},
         "delivery_mode": "platform_driver",
-        "$or": [{"driver_id": None}, {"driver_id": ""}, {"driver_id": {"$exists": False}}],
-        "restaurant_id": {"$in": city_restaurant_ids},
+        "$and": [
+            {"$or": [{"driver_id": None}, {"driver_id": ""}, {"driver_id": {"$exists": False}}]},
+            # Orders currently offered to another driver by the dispatcher are hidden
+            open_to_driver(current_user["id"]),
+        ],
     }
     
     orders = await db.orders.find(query).sort("created_at", 1).to_list(20)
     
-    logger.info(f"Driver {current_user['id']} (city={driver_city}): found {len(orders)} available orders (city_restaurants={len(city_restaurant_ids)})")
+    logger.info(f"Driver {current_user['id']} (city={driver_city}): found {len(orders)} available orders")
+    
+    # Resolve all customers with one query
+    user_ids = list({o.get("user_id") for o in orders if o.get("user_id")})
+    customers = {}
+    if user_ids:
+        customer_docs = await db.users.find(
+            {"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1, "phone": 1}
+        ).to_list(len(user_ids))
+        customers = {c["id"]: c for c in customer_docs}
     
-    # Enrich orders with restaurant info
     result = []
     for order in orders:
         order.pop("_id", None)
-        restaurant = next((r for r in city_restaurants if r["id"] == order.get("restaurant_id")), None)
-        order["restaurant_address"] = restaurant.get("address", "") if restaurant else ""
-        order["restaurant_name"] = restaurant.get("name", "") if restaurant else ""
+        order["restaurant_address"] = order.get("restaurant_address") or ""
+        order["restaurant_name"] = order.get("restaurant_name") or ""
         # Clean items
         if isinstance(order.get("items"), list):
             for item in order["items"]:
@@ -208,7 +260,7 @@ async def get_available_orders_for_driver(current_user: dict = Depends(get_curre
                 except:
                     order[key] = str(val)
         # Add customer info
-        customer = await db.users.find_one({"id": order.get("user_id")})
+        customer = customers.get(order.get("user_id"))
         if customer:
             order["customer_name"] = order.get("recipient_name") or customer.get("name", "")
             order["customer_phone"] = order.get("recipient_phone") or customer.get("phone", "")
@@ -228,30 +280,36 @@ async def driver_accept_order(order_id: str, current_user: dict = Depends(get_cu
     if not current_user.get("is_online"):
         raise HTTPException(status_code=400, detail="يجب أن تكون متصلاً لقبول الطلبات")
     
-    # Try to atomically lock the order
-    result = await db.orders.update_one(
-        {
-            "id": order_id,
-            "order_status": {"$in": ["ready", "preparing"]},
+    # Atomically lock the order and get it back in the same round trip
+    order = await transition_order(
+        order_id,
+        "driver_assigned",
+        from_statuses=["ready", "preparing"],
+        conditions={
             "delivery_mode": "platform_driver",
-            "$or": [{"driver_id": None}, {"driver_id": ""}, {"driver_id": {"$exists": False}}]
+            "$and": [
+                {"$or": [{"driver_id": None}, {"driver_id": ""}, {"driver_id": {"$exists": False}}]},
+                open_to_driver(current_user["id"]),
+            ],
         },
-        {"$set": {
+        set_fields={
             "driver_id": current_user["id"],
             "driver_name": current_user["name"],
             "driver_phone": current_user.get("phone"),
             "driver_type": "platform_driver",
-            "order_status": "driver_assigned",
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
-    if result.modified_count == 0:
+        },
+        unset_fields={"offered_driver_id": "", "offer_id": "", "offer_expires_at": ""},
         # Order was already taken by another driver
-        raise HTTPException(status_code=409, detail="تم استلام هذا الطلب من سائق آخر")
+        conflict_detail="تم استلام هذا الطلب من سائق آخر",
+        actor=current_user,
+        location=peek_driver_location(current_user["id"]),
+    )
     
-    # Get order details
-    order = await db.orders.find_one({"id": order_id})
+    # Close any offer this driver (or an expired one) held on the order
+    await db.driver_offers.update_many(
+        {"order_id": order_id, "status": "offered"},
+        {"$set": {"status": "accepted", "updated_at": datetime.utcnow()}}
+    )
     
     # Notify restaurant
     restaurant = await db.restaurants.find_one({"id": order["restaurant_id"]})
@@ -292,24 +350,22 @@ async def driver_reject_order(order_id: str, current_user: dict = Depends(get_cu
     if current_user.get("role") != "driver":
         raise HTTPException(status_code=403, detail="غير مصرح")
     
-    order = await db.orders.find_one({"id": order_id, "driver_id": current_user["id"]})
-    if not order:
-        raise HTTPException(status_code=404, detail="الطلب غير موجود أو ليس مسنداً لك")
-    
-    if order.get("order_status") not in ["driver_assigned"]:
-        raise HTTPException(status_code=400, detail="لا يمكن رفض هذا الطلب بعد الاستلام")
-    
-    # Remove driver and reset status
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
+    # Remove driver and reset status - only while still assigned and not picked up
+    order = await transition_order(
+        order_id,
+        "ready",
+        match={"driver_id": current_user["id"]},
+        from_statuses=["driver_assigned"],
+        set_fields={
             "driver_id": None,
             "driver_name": None,
             "driver_phone": None,
             "driver_type": None,
-            "order_status": "ready",
-            "updated_at": datetime.utcnow()
-        }}
+        },
+        add_to_set={"declined_driver_ids": current_user["id"]},
+        conflict_detail="لا يمكن رفض هذا الطلب بعد الاستلام",
+        actor=current_user,
+        location=peek_driver_location(current_user["id"]),
     )
     
     # Notify restaurant
@@ -323,14 +379,74 @@ async def driver_reject_order(order_id: str, current_user: dict = Depends(get_cu
             {"order_id": order_id}
         )
     
-    # Notify other drivers
+    # Offer the order to the next best driver (or to all drivers when dispatch is off)
     city_id = order.get("city_id") or (restaurant.get("city_id") if restaurant else None)
     if city_id:
-        await notify_drivers_new_order(order_id, city_id)
+        if DISPATCH_ENABLED:
+            request_dispatch(city_id)
+        else:
+            await notify_drivers_new_order(order, city_id)
     
     return {"message": "تم رفض الطلب", "order_id": order_id}
 
 
+@router.get("/driver/offers")
+async def get_driver_offers(current_user: dict = Depends(get_current_user)):
+    """Open dispatch offers for the current driver"""
+    if current_user.get("role") != "driver":
+        raise HTTPException(status_code=403, detail="غير مصرح")
+    
+    offers = await db.driver_offers.find(
+        {"driver_id": current_user["id"], "status": "offered", "expires_at": {"$gt": datetime.utcnow()}},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(10)
+    if not offers:
+        return []
+    
+    orders = await db.orders.find(
+        {"id": {"$in": [o["order_id"] for o in offers]}},
+        {"_id": 0, "id": 1, "restaurant_name": 1, "restaurant_address": 1, "total": 1,
+         "delivery_fee": 1, "address": 1, "order_status": 1}
+    ).to_list(len(offers))
+    orders_by_id = {o["id"]: o for o in orders}
+    
+    result = []
+    for offer in offers:
+        offer["order"] = orders_by_id.get(offer["order_id"])
+        for key in ["created_at", "expires_at", "updated_at"]:
+            val = offer.get(key)
+            if val and not isinstance(val, str):
+                offer[key] = val.isoformat()
+        result.append(offer)
+    return result
+
+
+@router.post("/driver/offers/{offer_id}/accept")
+async def accept_driver_offer(offer_id: str, current_user: dict = Depends(get_current_user)):
+    """Accept a dispatch offer"""
+    offer = await db.driver_offers.find_one({"id": offer_id, "driver_id": current_user.get("id")})
+    if not offer:
+        raise HTTPException(status_code=404, detail="العرض غير موجود")
+    if offer.get("status") != "offered" or (offer.get("expires_at") and offer["expires_at"] < datetime.utcnow()):
+        raise HTTPException(status_code=409, detail="انتهت صلاحية العرض")
+    
+    return await driver_accept_order(offer["order_id"], current_user)
+
+
+@router.post("/driver/offers/{offer_id}/decline")
+async def decline_driver_offer(offer_id: str, current_user: dict = Depends(get_current_user)):
+    """Decline a dispatch offer so the order moves on to the next driver"""
+    offer = await db.driver_offers.find_one({"id": offer_id, "driver_id": current_user.get("id")})
+    if not offer:
+        raise HTTPException(status_code=404, detail="العرض غير موجود")
+    if offer.get("status") != "offered":
+        raise HTTPException(status_code=409, detail="انتهت صلاحية العرض")
+    
+    await release_offer(offer["order_id"], offer_id, current_user["id"], "declined")
+    request_dispatch(offer.get("city_id"))
+    return {"message": "تم رفض العرض", "offer_id": offer_id}
+
+
 @router.get("/driver/my-orders")
 async def get_driver_orders(current_user: dict = Depends(get_current_user)):
     """Get driver's current and recent orders"""
@@ -405,38 +521,24 @@ async def update_order_status_driver(
     if current_user.get("role") != "driver":
         raise HTTPException(status_code=403, detail="غير مصرح")
     
-    order = await db.orders.find_one({"id": order_id, "driver_id": current_user["id"]})
-    if not order:
-        raise HTTPException(status_code=404, detail="الطلب غير موجود")
-    
     valid_statuses = ["picked_up", "out_for_delivery", "delivered"]
     if status_update.status not in valid_statuses:
         raise HTTPException(status_code=400, detail="حالة غير صالحة")
     
-    update_data = {"order_status": status_update.status, "updated_at": datetime.utcnow()}
+    order = await transition_order(
+        order_id,
+        status_update.status,
+        match={"driver_id": current_user["id"]},
+        actor=current_user,
+        location=peek_driver_location(current_user["id"]),
+    )
     
     # If delivered, update payment status for COD
-    if status_update.status == "delivered" and order["payment_method"] == "COD":
-        update_data["payment_status"] = "paid"
-    
-    await db.orders.update_one({"id": order_id}, {"$set": update_data})
-    
-    # Notify customer
-    status_messages = {
-        "picked_up": "السائق استلم طلبك من المطعم",
-        "out_for_delivery": "طلبك في الطريق إليك",
-        "delivered": "تم توصيل طلبك بنجاح"
-    }
-    
-    await create_notification(
-        order["user_id"],
-        f"تحديث الطلب #{order_id[:8]}",
-        status_messages.get(status_update.status, "تم تحديث حالة طلبك"),
-        "order_update",
-        {"order_id": order_id, "status": status_update.status}
-    )
+    if status_update.status == "delivered" and order.get("payment_method") == "COD":
+        await db.orders.update_one({"id": order_id, "payment_method": "COD"}, {"$set": {"payment_status": "paid"}})
+        order["payment_status"] = "paid"
     
-    # Send push notification to customer
+    # Notify customer (one stored notification + push)
     await notify_customer_order_status(order, status_update.status)
     
     return {"message": "تم تحديث حالة الطلب"}
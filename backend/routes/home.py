@@ -0,0 +1,34 @@
+from fastapi import APIRouter
+from routes.deps import *
+from typing import Optional
+import asyncio
+from routes.cities import CITY_LOCATOR, get_cities
+from routes.categories import get_categories
+from routes.admin import get_advertisements, get_app_settings
+from routes.restaurants import get_restaurants
+from utils.home_feed import get_section, parse_known_versions, compact_feed
+
+router = APIRouter()
+
+@router.get("/home")
+async def get_home_feed(city_id: Optional[str] = None, versions: Optional[str] = None):
+    """Everything the home screen needs in one request.
+
+    `versions` lists the section versions the client already holds, e.g.
+    `cities:ab12,categories:cd34`; those sections are returned with their version only.
+    """
+    if city_id and not CITY_LOCATOR.get_city(city_id):
+        raise HTTPException(status_code=404, detail="المدينة غير موجودة")
+
+    names = ["cities", "categories", "advertisements", "settings", "restaurants"]
+    entries = await asyncio.gather(
+        get_section("cities", get_cities),
+        get_section("categories", get_categories),
+        get_section("advertisements", lambda: get_advertisements(active_only=True)),
+        get_section("settings", get_app_settings),
+        get_section("restaurants", lambda: get_restaurants(city_id=city_id), city_id=city_id),
+    )
+    return {
+        "city_id": city_id,
+        "sections": compact_feed(dict(zip(names, entries)), parse_known_versions(versions)),
+    }
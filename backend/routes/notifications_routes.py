@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 from routes.deps import *
 from models.schemas import PushTokenRegister, PushToken, Notification
+from utils.notifications import read_expiry, notification_window_start
+from utils.notification_counters import adjust_unread, get_unread
 from typing import List
 
 router = APIRouter()
@@ -9,9 +11,10 @@ router = APIRouter()
 
 @router.get("/notifications")
 async def get_notifications(current_user: dict = Depends(get_current_user)):
-    """Get user notifications"""
+    """Get user notifications (most recent within the notification window)"""
     notifications = await db.notifications.find({
-        "user_id": current_user["id"]
+        "user_id": current_user["id"],
+        "created_at": {"$gte": notification_window_start()}
     }).sort("created_at", -1).to_list(50)
     
     result = []
@@ -29,31 +32,33 @@ async def get_notifications(current_user: dict = Depends(get_current_user)):
 
 @router.get("/notifications/unread-count")
 async def get_unread_count(current_user: dict = Depends(get_current_user)):
-    """Get unread notifications count"""
-    count = await db.notifications.count_documents({
-        "user_id": current_user["id"],
-        "is_read": False
-    })
-    return {"count": count}
+    """Get unread notifications count (maintained counter, not a count query)"""
+    return {"count": await get_unread(current_user["id"])}
 
 @router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
     """Mark notification as read"""
     result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user["id"]},
-        {"$set": {"is_read": True}}
+        {"id": notification_id, "user_id": current_user["id"], "is_read": False},
+        {"$set": {"is_read": True, "read_at": datetime.utcnow(), "expires_at": read_expiry()}}
     )
     if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="الإشعار غير موجود")
+        # Already read is fine; only a missing notification is an error
+        if not await db.notifications.find_one({"id": notification_id, "user_id": current_user["id"]}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="الإشعار غير موجود")
+        return {"message": "تم"}
+    await adjust_unread(current_user["id"], -1)
     return {"message": "تم"}
 
 @router.put("/notifications/mark-all-read")
 async def mark_all_notifications_read(current_user: dict = Depends(get_current_user)):
     """Mark all notifications as read"""
-    await db.notifications.update_many(
+    result = await db.notifications.update_many(
         {"user_id": current_user["id"], "is_read": False},
-        {"$set": {"is_read": True}}
+        {"$set": {"is_read": True, "read_at": datetime.utcnow(), "expires_at": read_expiry()}}
     )
+    # Subtract what was marked rather than zeroing, so a notification created meanwhile still counts
+    await adjust_unread(current_user["id"], -result.modified_count)
     return {"message": "تم تحديث جميع الإشعارات"}
 
 # ==================== Push Token Routes ====================
@@ -1,11 +1,16 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
 from routes.deps import *
 from models.schemas import (
-    Address, AddressCreate, Order, OrderCreate, OrderItem, OrderItemCreate,
+    Address, AddressCreate, Order, OrderCreate, OrderItem, OrderItemCreate, OrderAddOnSelection,
     PaymentVerification, Payment, RatingCreate,
     AddOnGroup, AddOnGroupCreate, AddOnOption,
 )
 from typing import List, Optional
+from routes.cities import CITY_LOCATOR
+from utils.order_state import transition_order, order_event, stage_durations
+from utils.idempotency import run_idempotent, request_fingerprint
+from utils.coupons import redeem_coupon, release_coupon
+from utils.menu_snapshot import invalidate_menu
 
 router = APIRouter()
 
@@ -18,11 +23,16 @@ async def get_addresses(current_user: dict = Depends(get_current_user)):
 
 @router.post("/addresses", response_model=Address)
 async def create_address(address_data: AddressCreate, current_user: dict = Depends(get_current_user)):
+    # Fill the area from the detected district when the client did not send one
+    area = address_data.area
+    if not area and address_data.lat is not None and address_data.lng is not None:
+        area = CITY_LOCATOR.locate(address_data.lat, address_data.lng)["district"]
+        area = area["name"] if area else None
     address = Address(
         user_id=current_user["id"],
         label=address_data.label,
         address_line=address_data.address_line,
-        area=address_data.area,
+        area=area,
         lat=address_data.lat,
         lng=address_data.lng
     )
@@ -39,7 +49,18 @@ async def delete_address(address_id: str, current_user: dict = Depends(get_curre
 # ==================== Order Routes ====================
 
 @router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user: dict = Depends(get_current_user)):
+async def create_order(
+    order_data: OrderCreate,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    return await run_idempotent(
+        current_user["id"], idempotency_key, "orders.create",
+        lambda: _create_order(order_data, current_user),
+        fingerprint=request_fingerprint(order_data),
+    )
+
+async def _create_order(order_data: OrderCreate, current_user: dict):
     # Get restaurant
     restaurant = await db.restaurants.find_one({"id": order_data.restaurant_id})
     if not restaurant:
@@ -113,6 +134,12 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
     delivery_fee = restaurant["delivery_fee"]
     total = subtotal + delivery_fee
     
+    # Denormalize restaurant location so the driver board and tracking need no joins
+    city_id = restaurant.get("city_id")
+    restaurant_lat, restaurant_lng = CITY_LOCATOR.position_or_centre(
+        city_id, restaurant.get("lat"), restaurant.get("lng")
+    )
+    
     # Set payment status based on method
     payment_status = "unpaid"
     order_status = "pending"
@@ -135,33 +162,70 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
     elif order_data.payment_method == "SHAMCASH":
         payment_status = "pending_verification"
     
-    order = Order(
-        user_id=current_user["id"],
-        restaurant_id=order_data.restaurant_id,
-        restaurant_name=restaurant["name"],
-        items=order_items,
-        subtotal=subtotal,
-        delivery_fee=delivery_fee,
-        total=total,
-        payment_method=order_data.payment_method,
-        payment_status=payment_status,
-        payment_transaction_id=payment_transaction_id,
-        payment_screenshot=payment_screenshot,
-        order_status=order_status,
-        address={
-            "label": address["label"],
-            "address_line": address["address_line"],
-            "area": address.get("area", "")
-        },
-        notes=order_data.notes
-    )
-    
-    order_dict = order.dict()
-    # Save recipient info
-    order_dict["recipient_name"] = order_data.recipient_name or current_user.get("name", "")
-    order_dict["recipient_phone"] = order_data.recipient_phone or current_user.get("phone", "")
+    # Redeem the coupon atomically; it is released again if the order cannot be saved
+    order_id = str(uuid.uuid4())
+    redemption = None
+    discount = 0
+    if order_data.coupon_code:
+        redemption = await redeem_coupon(
+            current_user["id"], code=order_data.coupon_code, subtotal=subtotal,
+            delivery_fee=delivery_fee, order_id=order_id
+        )
     
-    await db.orders.insert_one(order_dict)
+    # Anything that fails from here on must give the coupon use back
+    try:
+        if redemption:
+            discount = redemption["discount"]
+            total = max(0, subtotal + delivery_fee - discount)
+        
+        order = Order(
+            id=order_id,
+            user_id=current_user["id"],
+            restaurant_id=order_data.restaurant_id,
+            restaurant_name=restaurant["name"],
+            items=order_items,
+            subtotal=subtotal,
+            delivery_fee=delivery_fee,
+            total=total,
+            payment_method=order_data.payment_method,
+            payment_status=payment_status,
+            payment_transaction_id=payment_transaction_id,
+            payment_screenshot=payment_screenshot,
+            order_status=order_status,
+            address={
+                "label": address["label"],
+                "address_line": address["address_line"],
+                "area": address.get("area", ""),
+                "lat": address.get("lat"),
+                "lng": address.get("lng")
+            },
+            notes=order_data.notes,
+            city_id=city_id,
+            restaurant_address=restaurant.get("address", ""),
+            restaurant_lat=restaurant_lat,
+            restaurant_lng=restaurant_lng,
+            delivery_lat=address.get("lat"),
+            delivery_lng=address.get("lng"),
+            coupon_code=redemption["code"] if redemption else None,
+            coupon_id=redemption["coupon_id"] if redemption else None,
+            discount=discount
+        )
+        
+        order_dict = order.dict()
+        # Save recipient info
+        order_dict["recipient_name"] = order_data.recipient_name or current_user.get("name", "")
+        order_dict["recipient_phone"] = order_data.recipient_phone or current_user.get("phone", "")
+        if redemption:
+            order_dict["coupon_redemption_id"] = redemption["id"]
+        # Event log starts with the creation itself
+        order_dict["status_history"] = [order_event(order_status, current_user, at=order.created_at)]
+        order_dict["stage_timestamps"] = {order_status: order.created_at}
+        
+        await db.orders.insert_one(order_dict)
+    except Exception:
+        if redemption:
+            await release_coupon(redemption["id"])
+        raise
     
     # Create notification for restaurant
     if restaurant.get("owner_id"):
@@ -202,25 +266,69 @@ async def get_order(order_id: str, current_user: dict = Depends(get_current_user
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
     order.pop("_id", None); return order
 
-@router.post("/orders/{order_id}/cancel")
-async def cancel_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user["id"]})
+@router.get("/orders/{order_id}/timeline")
+async def get_order_timeline(order_id: str, current_user: dict = Depends(get_current_user)):
+    """Status events of an order with the time spent in each stage"""
+    order = await db.orders.find_one(
+        {"id": order_id},
+        {"_id": 0, "id": 1, "user_id": 1, "driver_id": 1, "restaurant_id": 1, "order_status": 1,
+         "created_at": 1, "status_history": 1, "stage_timestamps": 1}
+    )
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
     
-    if order["order_status"] not in ["pending", "accepted"]:
-        raise HTTPException(status_code=400, detail="لا يمكن إلغاء الطلب في هذه المرحلة")
+    allowed = current_user.get("role") in ["admin", "moderator"] or current_user["id"] in [order.get("user_id"), order.get("driver_id")]
+    if not allowed and current_user.get("role") == "restaurant":
+        allowed = await db.restaurants.count_documents({"id": order.get("restaurant_id"), "owner_id": current_user["id"]}) > 0
+    if not allowed:
+        raise HTTPException(status_code=403, detail="غير مصرح")
+    
+    # Orders created before the event log only know their creation time
+    history = order.get("status_history") or [order_event("pending", at=order.get("created_at"))]
+    stamps = order.get("stage_timestamps") or {"pending": order.get("created_at")}
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"order_status": "cancelled", "updated_at": datetime.utcnow()}}
+    events = []
+    for event in history:
+        event = dict(event)
+        if event.get("at") and not isinstance(event["at"], str):
+            event["at"] = event["at"].isoformat()
+        events.append(event)
+    
+    return {
+        "order_id": order_id,
+        "order_status": order.get("order_status"),
+        "events": events,
+        "stage_timestamps": {k: v.isoformat() for k, v in stamps.items() if v and not isinstance(v, str)},
+        "stage_durations_seconds": stage_durations(stamps),
+    }
+
+@router.post("/orders/{order_id}/cancel")
+async def cancel_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    await transition_order(
+        order_id,
+        "cancelled",
+        match={"user_id": current_user["id"]},
+        from_statuses=["pending", "accepted"],
+        conflict_detail="لا يمكن إلغاء الطلب في هذه المرحلة",
+        actor=current_user,
     )
     return {"message": "تم إلغاء الطلب"}
 
 # ==================== Payment Routes ====================
 
 @router.post("/payments/verify")
-async def verify_payment(payment_data: PaymentVerification, current_user: dict = Depends(get_current_user)):
+async def verify_payment(
+    payment_data: PaymentVerification,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    return await run_idempotent(
+        current_user["id"], idempotency_key, "payments.verify",
+        lambda: _verify_payment(payment_data, current_user),
+        fingerprint=request_fingerprint(payment_data),
+    )
+
+async def _verify_payment(payment_data: PaymentVerification, current_user: dict):
     order = await db.orders.find_one({"id": payment_data.order_id, "user_id": current_user["id"]})
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
@@ -273,15 +381,8 @@ async def get_menu_item_addons(restaurant_id: str, item_id: str):
     return [AddOnGroup(**group) for group in addon_groups]
 
 @router.get("/restaurant/menu/{item_id}/addons")
-async def get_restaurant_menu_item_addons(item_id: str, current_user: dict = Depends(get_current_user)):
+async def get_restaurant_menu_item_addons(item_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Get add-on groups for a menu item (Restaurant Panel)"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Verify item belongs to restaurant
     item = await db.menu_items.find_one({"id": item_id, "restaurant_id": restaurant["id"]})
     if not item:
@@ -297,16 +398,9 @@ async def get_restaurant_menu_item_addons(item_id: str, current_user: dict = Dep
 async def create_addon_group(
     item_id: str,
     addon_data: AddOnGroupCreate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Create an add-on group for a menu item"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Verify item belongs to restaurant
     item = await db.menu_items.find_one({"id": item_id, "restaurant_id": restaurant["id"]})
     if not item:
@@ -331,22 +425,16 @@ async def create_addon_group(
     )
     
     await db.addon_groups.insert_one(addon_group.dict())
+    await invalidate_menu(restaurant["id"])
     return addon_group
 
 @router.put("/restaurant/addons/{group_id}")
 async def update_addon_group(
     group_id: str,
     addon_data: AddOnGroupCreate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update an add-on group"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Verify group belongs to restaurant
     group = await db.addon_groups.find_one({"id": group_id, "restaurant_id": restaurant["id"]})
     if not group:
@@ -370,29 +458,35 @@ async def update_addon_group(
             "options": options
         }}
     )
+    await invalidate_menu(restaurant["id"])
     
     return {"message": "تم تحديث مجموعة الإضافات"}
 
 @router.delete("/restaurant/addons/{group_id}")
-async def delete_addon_group(group_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_addon_group(group_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Delete an add-on group"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     result = await db.addon_groups.delete_one({"id": group_id, "restaurant_id": restaurant["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="مجموعة الإضافات غير موجودة")
+    await invalidate_menu(restaurant["id"])
     
     return {"message": "تم حذف مجموعة الإضافات"}
 
 # ==================== Rating Routes ====================
 
 @router.post("/ratings")
-async def create_rating(rating_data: RatingCreate, current_user: dict = Depends(get_current_user)):
+async def create_rating(
+    rating_data: RatingCreate,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    return await run_idempotent(
+        current_user["id"], idempotency_key, "ratings.create",
+        lambda: _create_rating(rating_data, current_user),
+        fingerprint=request_fingerprint(rating_data),
+    )
+
+async def _create_rating(rating_data: RatingCreate, current_user: dict):
     order = await db.orders.find_one({"id": rating_data.order_id, "user_id": current_user["id"]})
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
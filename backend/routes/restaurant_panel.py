@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from pymongo import UpdateOne, ReturnDocument
 from routes.deps import *
 from models.schemas import (
     Restaurant, MenuItem, MenuItemCreate, MenuItemUpdate, OrderStatusUpdate,
@@ -7,22 +9,24 @@ from models.schemas import (
     ComplaintResponse,
 )
 from typing import List, Optional
+from utils.location_store import get_driver_locations
+from utils.geo import distances_from
+from utils.order_state import transition_order
+from utils.dispatch import DISPATCH_ENABLED, request_dispatch
+from utils.menu_io import (
+    MenuImportError, MAX_REPORTED_ERRORS, CSV_COLUMNS, iter_csv_rows, iter_json_rows, validate_row,
+    build_addon_documents, export_row, export_csv_row, export_json_row, csv_line,
+)
+from utils.menu_snapshot import invalidate_menu
+from utils.home_feed import invalidate_home_section
 
 router = APIRouter()
 
 # ==================== Restaurant Panel Routes ====================
 
 @router.get("/restaurant/orders")
-async def get_restaurant_orders(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_orders(restaurant: dict = Depends(get_current_restaurant)):
     """Get orders for restaurant owner"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    # Find restaurant owned by this user
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     orders = await db.orders.find({
         "restaurant_id": restaurant["id"],
     }).sort("created_at", -1).to_list(200)
@@ -88,15 +92,8 @@ async def get_restaurant_orders(current_user: dict = Depends(get_current_user)):
     return clean_orders
 
 @router.get("/restaurant/orders/history")
-async def get_restaurant_order_history(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_order_history(restaurant: dict = Depends(get_current_restaurant)):
     """Get completed orders history for restaurant"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     orders = await db.orders.find({
         "restaurant_id": restaurant["id"],
         "order_status": {"$in": ["delivered", "cancelled"]}
@@ -111,51 +108,27 @@ async def get_restaurant_order_history(current_user: dict = Depends(get_current_
 async def update_order_status_restaurant(
     order_id: str,
     status_update: OrderStatusUpdate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update order status by restaurant"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
-    order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant["id"]})
-    if not order:
-        raise HTTPException(status_code=404, detail="الطلب غير موجود")
-    
     valid_statuses = ["accepted", "preparing", "ready", "cancelled"]
     if status_update.status not in valid_statuses:
         raise HTTPException(status_code=400, detail="حالة غير صالحة")
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"order_status": status_update.status, "updated_at": datetime.utcnow()}}
-    )
-    
-    # Create notification for customer
-    status_messages = {
-        "accepted": "تم قبول طلبك من المطعم",
-        "preparing": "جاري تحضير طلبك",
-        "ready": "طلبك جاهز للتوصيل",
-        "cancelled": "تم إلغاء طلبك"
-    }
-    
-    await create_notification(
-        order["user_id"],
-        f"تحديث الطلب #{order_id[:8]}",
-        status_messages.get(status_update.status, "تم تحديث حالة طلبك"),
-        "order_update",
-        {"order_id": order_id, "status": status_update.status}
+    order = await transition_order(
+        order_id, status_update.status, match={"restaurant_id": restaurant["id"]}, actor=current_user
     )
     
-    # Send push notification to customer
+    # Notify customer (one stored notification + push)
     await notify_customer_order_status(order, status_update.status)
     
-    # If order is ready and no driver assigned, notify platform drivers
+    # If order is ready and no driver assigned, offer it to platform drivers
     if status_update.status == "ready" and not order.get("driver_id"):
-        await notify_drivers_new_order(order, restaurant.get("city_id"))
+        if DISPATCH_ENABLED:
+            request_dispatch(order.get("city_id") or restaurant.get("city_id"))
+        else:
+            await notify_drivers_new_order(order, restaurant.get("city_id"))
     
     # If order is ready and driver IS assigned, notify the assigned driver
     if status_update.status == "ready" and order.get("driver_id"):
@@ -170,67 +143,44 @@ async def update_order_status_restaurant(
     return {"message": "تم تحديث حالة الطلب"}
 
 @router.put("/restaurant/toggle-status")
-async def toggle_restaurant_status(current_user: dict = Depends(get_current_user)):
+async def toggle_restaurant_status(restaurant: dict = Depends(get_current_restaurant)):
     """Toggle restaurant open/closed status"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
-    new_status = not restaurant.get("is_open", True)
-    await db.restaurants.update_one(
+    # Flipped in the database; the cached document may be a few seconds old
+    updated = await db.restaurants.find_one_and_update(
         {"id": restaurant["id"]},
-        {"$set": {"is_open": new_status}}
+        [{"$set": {"is_open": {"$not": [{"$ifNull": ["$is_open", True]}]}}}],
+        projection={"_id": 0, "is_open": 1},
+        return_document=ReturnDocument.AFTER,
     )
+    invalidate_restaurant(restaurant["id"])
+    invalidate_home_section("restaurants")
     
-    return {"is_open": new_status}
+    return {"is_open": updated["is_open"]}
 
 @router.get("/restaurant/menu")
-async def get_restaurant_menu_panel(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_menu_panel(restaurant: dict = Depends(get_current_restaurant)):
     """Get menu items for restaurant panel"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     items = await db.menu_items.find({"restaurant_id": restaurant["id"]}).to_list(100)
     return [MenuItem(**item) for item in items]
 
 @router.post("/restaurant/menu")
-async def add_menu_item(item_data: MenuItemCreate, current_user: dict = Depends(get_current_user)):
+async def add_menu_item(item_data: MenuItemCreate, restaurant: dict = Depends(get_current_restaurant)):
     """Add new menu item"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     item = MenuItem(
         restaurant_id=restaurant["id"],
         **item_data.dict()
     )
     await db.menu_items.insert_one(item.dict())
+    await invalidate_menu(restaurant["id"])
     return item
 
 @router.put("/restaurant/menu/{item_id}")
 async def update_menu_item(
     item_id: str,
     item_data: MenuItemUpdate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update menu item"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     item = await db.menu_items.find_one({"id": item_id, "restaurant_id": restaurant["id"]})
     if not item:
         raise HTTPException(status_code=404, detail="الصنف غير موجود")
@@ -238,35 +188,171 @@ async def update_menu_item(
     update_data = {k: v for k, v in item_data.dict().items() if v is not None}
     if update_data:
         await db.menu_items.update_one({"id": item_id}, {"$set": update_data})
+        await invalidate_menu(restaurant["id"])
     
     return {"message": "تم تحديث الصنف"}
 
 @router.delete("/restaurant/menu/{item_id}")
-async def delete_menu_item(item_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_menu_item(item_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Delete menu item"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     result = await db.menu_items.delete_one({"id": item_id, "restaurant_id": restaurant["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="الصنف غير موجود")
+    await invalidate_menu(restaurant["id"])
     
     return {"message": "تم حذف الصنف"}
 
+MENU_IMPORT_BATCH_SIZE = 500
+MENU_EXPORT_BATCH_SIZE = 200
+
+async def _apply_menu_batch(restaurant_id: str, batch: list):
+    """Upsert one batch of imported items and replace the add-on groups of rows that carried them"""
+    now = datetime.utcnow()
+    await db.menu_items.bulk_write([
+        UpdateOne(
+            {"id": item_id, "restaurant_id": restaurant_id},
+            {"$set": item, "$setOnInsert": {"id": item_id, "restaurant_id": restaurant_id, "created_at": now}},
+            upsert=True
+        )
+        for item_id, _, item, _ in batch
+    ], ordered=False)
+    
+    with_addons = [(item_id, groups) for item_id, _, _, groups in batch if groups is not None]
+    if with_addons:
+        await db.addon_groups.delete_many({
+            "restaurant_id": restaurant_id,
+            "menu_item_id": {"$in": [item_id for item_id, _ in with_addons]}
+        })
+        docs = [doc for item_id, groups in with_addons for doc in build_addon_documents(groups, item_id, restaurant_id)]
+        if docs:
+            await db.addon_groups.insert_many(docs, ordered=False)
+
+@router.post("/restaurant/menu/import")
+async def import_menu(
+    request: Request,
+    format: Optional[str] = None,
+    dry_run: bool = False,
+    restaurant: dict = Depends(get_current_restaurant)
+):
+    """Bulk create/update menu items (and their add-on groups) from a CSV or JSON/NDJSON request body.
+    
+    Rows are matched by id, else by name + category. A row with an addons field replaces that
+    item's add-on groups; rows without it leave them untouched. Invalid rows are reported and skipped.
+    """
+    restaurant_id = restaurant["id"]
+    
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "json")
+    if fmt not in ["csv", "json"]:
+        raise HTTPException(status_code=400, detail="صيغة غير مدعومة، استخدم csv أو json")
+    
+    existing = await db.menu_items.find(
+        {"restaurant_id": restaurant_id}, {"_id": 0, "id": 1, "name": 1, "category": 1}
+    ).to_list(None)
+    known_ids = {item["id"] for item in existing}
+    by_name = {(item["name"], item["category"]): item["id"] for item in existing}
+    
+    report = {"rows": 0, "created": 0, "updated": 0, "failed": 0, "errors": [], "dry_run": dry_run}
+    batch = []
+    
+    async def flush():
+        if not dry_run:
+            await _apply_menu_batch(restaurant_id, batch)
+        for _, is_new, _, _ in batch:
+            report["created" if is_new else "updated"] += 1
+        batch.clear()
+    
+    rows = iter_csv_rows(request.stream()) if fmt == "csv" else iter_json_rows(request.stream())
+    try:
+        async for row_number, row in rows:
+            report["rows"] += 1
+            item, groups, errors = validate_row(row)
+            item_id = row.get("id") if isinstance(row, dict) else None
+            if item_id and item_id not in known_ids:
+                errors.append("id: الصنف غير موجود في قائمة مطعمك")
+            if errors:
+                report["failed"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"row": row_number, "errors": errors})
+                continue
+            
+            item_id = item_id or by_name.get((item["name"], item["category"]))
+            is_new = item_id is None
+            if is_new:
+                item_id = str(uuid.uuid4())
+            # Later rows for the same item in this file update it
+            known_ids.add(item_id)
+            by_name[(item["name"], item["category"])] = item_id
+            batch.append((item_id, is_new, item, groups))
+            if len(batch) >= MENU_IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+    except MenuImportError as e:
+        if not dry_run and report["created"] + report["updated"]:
+            await invalidate_menu(restaurant_id)
+        raise HTTPException(
+            status_code=400,
+            detail=f"{e} (تمت معالجة {report['created'] + report['updated']} صنف قبل الخطأ)"
+        )
+    
+    if not dry_run and report["created"] + report["updated"]:
+        await invalidate_menu(restaurant_id)
+    logger.info(f"Menu import for restaurant {restaurant_id}: {report['created']} created, "
+                f"{report['updated']} updated, {report['failed']} failed (dry_run={dry_run})")
+    return report
+
+@router.get("/restaurant/menu/export")
+async def export_menu(format: str = "csv", restaurant: dict = Depends(get_current_restaurant)):
+    """Stream the full menu with add-on groups as CSV or a JSON array (the import accepts both)"""
+    if format not in ["csv", "json"]:
+        raise HTTPException(status_code=400, detail="صيغة غير مدعومة، استخدم csv أو json")
+    
+    restaurant_id = restaurant["id"]
+    
+    async def render(items):
+        groups = {}
+        async for group in db.addon_groups.find(
+            {"restaurant_id": restaurant_id, "menu_item_id": {"$in": [i["id"] for i in items]}}, {"_id": 0}
+        ):
+            groups.setdefault(group["menu_item_id"], []).append(group)
+        return [export_row(item, groups.get(item["id"], [])) for item in items]
+    
+    async def body():
+        if format == "csv":
+            # BOM so spreadsheet apps open the Arabic text as UTF-8
+            yield "\ufeff" + csv_line(CSV_COLUMNS)
+        else:
+            yield "["
+        first = True
+        cursor = db.menu_items.find({"restaurant_id": restaurant_id}, {"_id": 0}).sort(
+            [("category", 1), ("name", 1)]
+        ).batch_size(MENU_EXPORT_BATCH_SIZE)
+        items = []
+        async for item in cursor:
+            items.append(item)
+            if len(items) < MENU_EXPORT_BATCH_SIZE:
+                continue
+            for row in await render(items):
+                yield export_csv_row(row) if format == "csv" else ("" if first else ",") + export_json_row(row)
+                first = False
+            items = []
+        if items:
+            for row in await render(items):
+                yield export_csv_row(row) if format == "csv" else ("" if first else ",") + export_json_row(row)
+                first = False
+        if format == "json":
+            yield "]"
+    
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/json"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="menu-{restaurant_id}.{format}"'}
+    )
+
 @router.get("/restaurant/stats")
-async def get_restaurant_stats(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_stats(restaurant: dict = Depends(get_current_restaurant)):
     """Get restaurant statistics"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Get today's orders
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     today_orders = await db.orders.count_documents({
@@ -309,16 +395,9 @@ async def get_restaurant_stats(current_user: dict = Depends(get_current_user)):
 @router.get("/restaurant/reports")
 async def get_restaurant_reports(
     period: str = "week",  # today, week, month, year
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Get detailed reports and statistics for the restaurant"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Calculate date range
     now = datetime.utcnow()
     if period == "today":
@@ -448,15 +527,8 @@ async def get_restaurant_reports(
     }
 
 @router.get("/restaurant/info")
-async def get_restaurant_info(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_info(restaurant: dict = Depends(get_current_restaurant)):
     """Get restaurant details for editing"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     return {
         "id": restaurant["id"],
         "name": restaurant.get("name", ""),
@@ -483,16 +555,9 @@ async def get_restaurant_info(current_user: dict = Depends(get_current_user)):
 @router.put("/restaurant/info")
 async def update_restaurant_info(
     update_data: RestaurantUpdate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update restaurant information"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Build update dict from non-None fields
     update_dict = {}
     for field, value in update_data.dict().items():
@@ -508,6 +573,8 @@ async def update_restaurant_info(
         {"id": restaurant["id"]},
         {"$set": update_dict}
     )
+    invalidate_restaurant(restaurant["id"])
+    invalidate_home_section("restaurants")
     
     # Return updated restaurant
     updated_restaurant = await db.restaurants.find_one({"id": restaurant["id"]})
@@ -528,20 +595,15 @@ async def update_restaurant_info(
 async def update_restaurant_location(
     lat: float,
     lng: float,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update restaurant location on map"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     await db.restaurants.update_one(
         {"id": restaurant["id"]},
         {"$set": {"lat": lat, "lng": lng, "updated_at": datetime.utcnow()}}
     )
+    invalidate_restaurant(restaurant["id"])
+    invalidate_home_section("restaurants")
     
     return {"message": "تم تحديث موقع المطعم", "lat": lat, "lng": lng}
 
@@ -549,16 +611,9 @@ async def update_restaurant_location(
 
 @router.get("/restaurant/payment-methods")
 async def get_restaurant_payment_methods(
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Get restaurant's configured payment methods"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Get payment methods from restaurant or return defaults
     payment_methods = restaurant.get("payment_methods", [
         {
@@ -575,16 +630,9 @@ async def get_restaurant_payment_methods(
 @router.put("/restaurant/payment-methods")
 async def update_restaurant_payment_methods(
     update_data: PaymentMethodUpdate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update restaurant's payment methods"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Convert to dict format for storage
     methods_list = [m.dict() for m in update_data.methods]
     
@@ -592,6 +640,8 @@ async def update_restaurant_payment_methods(
         {"id": restaurant["id"]},
         {"$set": {"payment_methods": methods_list, "updated_at": datetime.utcnow()}}
     )
+    invalidate_restaurant(restaurant["id"])
+    invalidate_home_section("restaurants")
     
     return {"message": "تم تحديث طرق الدفع بنجاح", "methods": methods_list}
 
@@ -642,16 +692,9 @@ async def get_customer_verification_status(
 @router.put("/restaurant/orders/{order_id}/confirm-payment")
 async def confirm_order_payment(
     order_id: str,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Restaurant confirms payment for an order"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant["id"]})
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
@@ -668,16 +711,11 @@ async def confirm_order_payment(
     )
     
     # Create notification for customer
-    notification = {
-        "id": str(uuid.uuid4()),
-        "user_id": order["user_id"],
-        "title": "تم تأكيد الدفع",
-        "message": f"تم تأكيد دفعك لطلب #{order_id[:8]}",
-        "type": "payment_confirmed",
-        "is_read": False,
-        "created_at": datetime.utcnow()
-    }
-    await db.notifications.insert_one(notification)
+    await store_notification(
+        order["user_id"], "تم تأكيد الدفع",
+        f"تم تأكيد دفعك لطلب #{order_id[:8]}",
+        "payment_confirmed"
+    )
     
     return {"message": "تم تأكيد الدفع بنجاح"}
 
@@ -685,43 +723,26 @@ async def confirm_order_payment(
 @router.put("/restaurant/orders/{order_id}/reject-payment")
 async def reject_order_payment(
     order_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Restaurant rejects payment for an order"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
-    order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant["id"]})
-    if not order:
-        raise HTTPException(status_code=404, detail="الطلب غير موجود")
-    
-    if order.get("payment_status") != "pending_verification":
-        raise HTTPException(status_code=400, detail="الطلب ليس بانتظار تأكيد الدفع")
-    
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
-            "payment_status": "failed",
-            "order_status": "cancelled",
-            "updated_at": datetime.utcnow()
-        }}
+    order = await transition_order(
+        order_id,
+        "cancelled",
+        match={"restaurant_id": restaurant["id"]},
+        conditions={"payment_status": "pending_verification"},
+        set_fields={"payment_status": "failed"},
+        conflict_detail="الطلب ليس بانتظار تأكيد الدفع",
+        actor=current_user,
     )
     
     # Create notification for customer
-    notification = {
-        "id": str(uuid.uuid4()),
-        "user_id": order["user_id"],
-        "title": "رُفض الدفع",
-        "message": f"لم يتم التحقق من دفعك لطلب #{order_id[:8]}. يرجى التواصل مع المطعم.",
-        "type": "payment_rejected",
-        "is_read": False,
-        "created_at": datetime.utcnow()
-    }
-    await db.notifications.insert_one(notification)
+    await store_notification(
+        order["user_id"], "رُفض الدفع",
+        f"لم يتم التحقق من دفعك لطلب #{order_id[:8]}. يرجى التواصل مع المطعم.",
+        "payment_rejected"
+    )
     
     return {"message": "تم رفض الدفع وإلغاء الطلب"}
 
@@ -730,16 +751,9 @@ async def reject_order_payment(
 @router.get("/restaurant/platform-drivers")
 async def get_available_platform_drivers(
     sort_by: str = "distance",  # distance, rating, availability
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Get available platform drivers for the restaurant's city, sorted by preference"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Get restaurant location and search radius
     rest_lat = restaurant.get("lat", 33.5138)  # Default Damascus
     rest_lng = restaurant.get("lng", 36.2765)
@@ -754,8 +768,24 @@ async def get_available_platform_drivers(
     # Get favorite driver IDs
     favorite_ids = restaurant.get("favorite_platform_drivers", []) or []
     
-    result = []
+    # Latest positions come from the location store, not the users documents
+    locations = await get_driver_locations([d["id"] for d in drivers])
+    
+    # Distance from the restaurant to every driver in one vectorized pass
+    positions = []
     for driver in drivers:
+        driver_loc = locations.get(driver["id"]) or driver.get("current_location", {})
+        driver_lat = driver_loc.get("lat", rest_lat + 0.01) if isinstance(driver_loc, dict) else rest_lat + 0.01
+        driver_lng = driver_loc.get("lng", rest_lng + 0.01) if isinstance(driver_loc, dict) else rest_lng + 0.01
+        positions.append((driver_lat, driver_lng))
+    distances = distances_from(rest_lat, rest_lng, positions)
+    
+    result = []
+    for driver, distance in zip(drivers, distances):
+        # Filter by radius before loading any stats
+        if distance > search_radius and driver["id"] not in favorite_ids:
+            continue
+        
         # Get driver stats
         completed_orders = await db.orders.count_documents({
             "driver_id": driver["id"],
@@ -766,16 +796,6 @@ async def get_available_platform_drivers(
         ratings = await db.ratings.find({"driver_id": driver["id"]}).to_list(100)
         avg_rating = sum(r.get("rating", 5) for r in ratings) / len(ratings) if ratings else 4.5
         
-        # Calculate distance from restaurant
-        driver_loc = driver.get("current_location", {})
-        driver_lat = driver_loc.get("lat", rest_lat + 0.01) if isinstance(driver_loc, dict) else rest_lat + 0.01
-        driver_lng = driver_loc.get("lng", rest_lng + 0.01) if isinstance(driver_loc, dict) else rest_lng + 0.01
-        distance = calculate_distance(rest_lat, rest_lng, driver_lat, driver_lng)
-        
-        # Filter by radius
-        if distance > search_radius and driver["id"] not in favorite_ids:
-            continue
-        
         current_orders_count = await db.orders.count_documents({
             "driver_id": driver["id"],
             "order_status": {"$in": ["driver_assigned", "picked_up", "out_for_delivery"]}
@@ -808,15 +828,8 @@ async def get_available_platform_drivers(
 
 # Favorite Platform Drivers Management
 @router.get("/restaurant/favorite-drivers")
-async def get_favorite_drivers(current_user: dict = Depends(get_current_user)):
+async def get_favorite_drivers(restaurant: dict = Depends(get_current_restaurant)):
     """Get restaurant's favorite platform drivers"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     favorite_ids = restaurant.get("favorite_platform_drivers", []) or []
     
     drivers = []
@@ -835,91 +848,87 @@ async def get_favorite_drivers(current_user: dict = Depends(get_current_user)):
     return drivers
 
 @router.post("/restaurant/favorite-drivers/{driver_id}")
-async def add_favorite_driver(driver_id: str, current_user: dict = Depends(get_current_user)):
+async def add_favorite_driver(driver_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Add a platform driver to favorites"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     # Verify driver exists
     driver = await db.users.find_one({"id": driver_id, "role": "driver"})
     if not driver:
         raise HTTPException(status_code=404, detail="السائق غير موجود")
     
-    favorites = restaurant.get("favorite_platform_drivers", []) or []
-    if driver_id not in favorites:
-        favorites.append(driver_id)
-        await db.restaurants.update_one(
-            {"id": restaurant["id"]},
-            {"$set": {"favorite_platform_drivers": favorites}}
-        )
+    updated = await db.restaurants.find_one_and_update(
+        {"id": restaurant["id"]},
+        {"$addToSet": {"favorite_platform_drivers": driver_id}},
+        projection={"_id": 0, "favorite_platform_drivers": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_restaurant(restaurant["id"])
+    favorites = updated.get("favorite_platform_drivers") or []
     
     return {"message": f"تم إضافة {driver.get('name', 'السائق')} للمفضلين", "favorites": favorites}
 
 @router.delete("/restaurant/favorite-drivers/{driver_id}")
-async def remove_favorite_driver(driver_id: str, current_user: dict = Depends(get_current_user)):
+async def remove_favorite_driver(driver_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Remove a platform driver from favorites"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
-    favorites = restaurant.get("favorite_platform_drivers", []) or []
-    if driver_id in favorites:
-        favorites.remove(driver_id)
-        await db.restaurants.update_one(
-            {"id": restaurant["id"]},
-            {"$set": {"favorite_platform_drivers": favorites}}
-        )
+    updated = await db.restaurants.find_one_and_update(
+        {"id": restaurant["id"]},
+        {"$pull": {"favorite_platform_drivers": driver_id}},
+        projection={"_id": 0, "favorite_platform_drivers": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_restaurant(restaurant["id"])
+    favorites = updated.get("favorite_platform_drivers") or []
     
     return {"message": "تم إزالة السائق من المفضلين", "favorites": favorites}
 
 @router.put("/restaurant/driver-search-settings")
 async def update_driver_search_settings(
-    current_user: dict = Depends(get_current_user),
+    restaurant: dict = Depends(get_current_restaurant),
     search_radius: float = 50,
     city_id: str = None,
 ):
     """Update restaurant's driver search radius and city"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     update = {"driver_search_radius": search_radius}
     if city_id:
         update["city_id"] = city_id
     
     await db.restaurants.update_one({"id": restaurant["id"]}, {"$set": update})
+    invalidate_restaurant(restaurant["id"])
     
     return {"message": "تم تحديث إعدادات البحث", "search_radius": search_radius}
 
 @router.post("/restaurant/orders/{order_id}/change-driver")
-async def change_order_driver(order_id: str, current_user: dict = Depends(get_current_user)):
+async def change_order_driver(
+    order_id: str,
+    current_user: dict = Depends(get_current_user),
+    restaurant: dict = Depends(get_current_restaurant)
+):
     """Remove current driver assignment so a new one can be assigned"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
-    order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant["id"]})
+    order = await db.orders.find_one(
+        {"id": order_id, "restaurant_id": restaurant["id"]},
+        {"_id": 0, "driver_id": 1, "driver_type": 1}
+    )
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
     
-    # Can only change driver if order is not yet picked up
-    if order.get("order_status") in ["picked_up", "out_for_delivery", "delivered"]:
-        raise HTTPException(status_code=400, detail="لا يمكن تغيير السائق بعد استلام الطلب")
+    # Reset driver assignment - only while the order is not yet picked up, and
+    # only if the same driver is still assigned
+    await transition_order(
+        order_id,
+        "ready",
+        match={"restaurant_id": restaurant["id"]},
+        conditions={"driver_id": order.get("driver_id")},
+        allow_same=True,
+        set_fields={
+            "driver_id": None,
+            "driver_type": None,
+            "driver_name": None,
+            "driver_phone": None,
+        },
+        conflict_detail="لا يمكن تغيير السائق بعد استلام الطلب",
+        actor=current_user,
+    )
     
-    # Notify current driver if platform driver
+    # Notify the removed driver if platform driver
     old_driver_id = order.get("driver_id")
     old_driver_type = order.get("driver_type")
     
@@ -932,31 +941,11 @@ async def change_order_driver(order_id: str, current_user: dict = Depends(get_cu
             {"order_id": order_id}
         )
     
-    # Reset driver assignment
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
-            "driver_id": None,
-            "driver_type": None,
-            "driver_name": None,
-            "driver_phone": None,
-            "order_status": "ready",
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
     return {"message": "تم إلغاء تعيين السائق، يمكنك تعيين سائق جديد"}
 
 @router.get("/restaurant/drivers")
-async def get_restaurant_drivers(current_user: dict = Depends(get_current_user)):
+async def get_restaurant_drivers(restaurant: dict = Depends(get_current_restaurant)):
     """Get restaurant's own drivers (without app)"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     drivers = await db.restaurant_drivers.find({"restaurant_id": restaurant["id"]}).to_list(50)
     # Convert ObjectId to string and clean up
     result = []
@@ -970,16 +959,9 @@ async def get_restaurant_drivers(current_user: dict = Depends(get_current_user))
 @router.post("/restaurant/drivers")
 async def add_restaurant_driver(
     driver_data: RestaurantDriverCreate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Add a driver to restaurant (without app)"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     driver = RestaurantDriver(
         restaurant_id=restaurant["id"],
         name=driver_data.name,
@@ -994,16 +976,9 @@ async def add_restaurant_driver(
 async def update_restaurant_driver(
     driver_id: str,
     driver_data: RestaurantDriverCreate,
-    current_user: dict = Depends(get_current_user)
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Update restaurant driver"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     result = await db.restaurant_drivers.update_one(
         {"id": driver_id, "restaurant_id": restaurant["id"]},
         {"$set": {
@@ -1019,15 +994,8 @@ async def update_restaurant_driver(
     return {"message": "تم تحديث بيانات السائق"}
 
 @router.delete("/restaurant/drivers/{driver_id}")
-async def delete_restaurant_driver(driver_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_restaurant_driver(driver_id: str, restaurant: dict = Depends(get_current_restaurant)):
     """Delete restaurant driver"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     result = await db.restaurant_drivers.delete_one({"id": driver_id, "restaurant_id": restaurant["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="السائق غير موجود")
@@ -1038,16 +1006,10 @@ async def delete_restaurant_driver(driver_id: str, current_user: dict = Depends(
 async def assign_driver_to_order(
     order_id: str,
     assignment: AssignDriverRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    restaurant: dict = Depends(get_current_restaurant)
 ):
     """Assign a driver to an order"""
-    if current_user.get("role") != "restaurant":
-        raise HTTPException(status_code=403, detail="غير مصرح")
-    
-    restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]})
-    if not restaurant:
-        raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
-    
     order = await db.orders.find_one({"id": order_id, "restaurant_id": restaurant["id"]})
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
@@ -1095,27 +1057,38 @@ async def assign_driver_to_order(
         if not city_id:
             logger.warning(f"Restaurant {restaurant['id']} has no city_id!")
         
-        platform_drivers = await db.users.find({
-            "role": "driver",
-            "is_online": True,
-            "city_id": city_id,
-        }).to_list(50)
-        
-        logger.info(f"Platform driver assignment: order={order_id}, city={city_id}, drivers_in_city={len(platform_drivers)}")
-        
-        notification_title = "🚀 طلب جديد قريب منك"
-        notification_body = f"طلب من {restaurant['name']} جاري التحضير - جهّز نفسك!" if is_preparing else f"طلب من {restaurant['name']} جاهز للتوصيل"
-        
-        for driver in platform_drivers:
-            await create_notification(
-                driver["id"],
+        # With dispatch enabled the order is offered to the best matched driver below
+        if not DISPATCH_ENABLED:
+            driver_ids = await online_driver_ids(city_id) if city_id else []
+            
+            logger.info(f"Platform driver assignment: order={order_id}, city={city_id}, drivers_in_city={len(driver_ids)}")
+            
+            notification_title = "🚀 طلب جديد قريب منك"
+            notification_body = f"طلب من {restaurant['name']} جاري التحضير - جهّز نفسك!" if is_preparing else f"طلب من {restaurant['name']} جاهز للتوصيل"
+            
+            await create_notifications_bulk(
+                driver_ids,
                 notification_title,
                 notification_body,
                 "new_order",
                 {"order_id": order_id, "restaurant_name": restaurant["name"]}
             )
     
-    await db.orders.update_one({"id": order_id}, {"$set": update_data})
+    new_status = update_data.pop("order_status", None)
+    if new_status:
+        # Compare-and-set against the status read above so a concurrent cancel is not overwritten
+        await transition_order(
+            order_id,
+            new_status,
+            match={"restaurant_id": restaurant["id"]},
+            from_statuses=[order.get("order_status"), new_status],
+            allow_same=True,
+            set_fields=update_data,
+            actor=current_user,
+        )
+    
+    if assignment.driver_type == "platform_driver" and DISPATCH_ENABLED:
+        request_dispatch(order.get("city_id") or restaurant.get("city_id"))
     
     # Notify customer
     if assignment.driver_type == "restaurant_driver":
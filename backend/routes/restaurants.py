@@ -1,16 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from routes.deps import *
 from models.schemas import Restaurant, MenuItem
 from typing import List, Optional
-from routes.cities import SYRIAN_CITIES
+from routes.cities import CITY_LOCATOR
+from utils.geo import k_nearest
+from utils.menu_snapshot import get_menu_snapshot
 
 router = APIRouter()
 
 # Helper: get city coordinates
 def get_city_coords(city_id: str):
-    for city in SYRIAN_CITIES:
-        if city["id"] == city_id:
-            return city["lat"], city["lng"]
+    city = CITY_LOCATOR.get_city(city_id)
+    if city:
+        return city["lat"], city["lng"]
     return None, None
 
 @router.get("/restaurants", response_model=List[Restaurant])
@@ -73,9 +75,8 @@ async def get_nearby_restaurants(
         "review_count": 1, "min_order": 1, "is_featured": 1
     }).to_list(200)
     
-    result = []
+    located = []
     for r in restaurants:
-        r.pop("_id", None)
         r_lat = r.get("lat")
         r_lng = r.get("lng")
         
@@ -84,16 +85,21 @@ async def get_nearby_restaurants(
             r_lat, r_lng = get_city_coords(r.get("city_id"))
         
         if r_lat and r_lng:
-            distance = calculate_distance(lat, lng, r_lat, r_lng)
-            if distance <= radius:
-                result.append({
-                    "id": r["id"], "name": r.get("name", ""), "cuisine_type": r.get("cuisine_type", ""),
-                    "image": r.get("image", ""), "is_open": r.get("is_open", True), "rating": r.get("rating", 0),
-                    "delivery_time": r.get("delivery_time", "30-45 دقيقة"), "delivery_fee": r.get("delivery_fee", 0),
-                    "lat": r_lat, "lng": r_lng, "distance_km": round(distance, 1), "address": r.get("address", ""),
-                })
+            located.append((r, r_lat, r_lng))
+    
+    # One vectorized distance pass, already ordered nearest first
+    nearest = k_nearest(lat, lng, [(r_lat, r_lng) for _, r_lat, r_lng in located], max_distance_km=radius)
+    
+    result = []
+    for index, distance in nearest:
+        r, r_lat, r_lng = located[index]
+        result.append({
+            "id": r["id"], "name": r.get("name", ""), "cuisine_type": r.get("cuisine_type", ""),
+            "image": r.get("image", ""), "is_open": r.get("is_open", True), "rating": r.get("rating", 0),
+            "delivery_time": r.get("delivery_time", "30-45 دقيقة"), "delivery_fee": r.get("delivery_fee", 0),
+            "lat": r_lat, "lng": r_lng, "distance_km": round(distance, 1), "address": r.get("address", ""),
+        })
     
-    result.sort(key=lambda x: (x["distance_km"] is None, x["distance_km"] or 999))
     return result
 
 @router.get("/restaurants/{restaurant_id}", response_model=Restaurant)
@@ -103,6 +109,18 @@ async def get_restaurant(restaurant_id: str):
         raise HTTPException(status_code=404, detail="المطعم غير موجود")
     return Restaurant(**restaurant)
 
+@router.get("/restaurants/{restaurant_id}/menu/full")
+async def get_restaurant_full_menu(restaurant_id: str, request: Request):
+    """Whole menu grouped by category with add-on groups embedded; supports If-None-Match"""
+    snapshot = await get_menu_snapshot(restaurant_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="المطعم غير موجود")
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if snapshot["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot["body"], media_type="application/json", headers=headers)
+
 @router.get("/restaurants/{restaurant_id}/menu", response_model=List[MenuItem])
 async def get_restaurant_menu(restaurant_id: str, category: Optional[str] = None):
     query = {"restaurant_id": restaurant_id}
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from routes.deps import *
 from models.schemas import Restaurant, MenuItem
 from typing import List
+from utils.menu_snapshot import drop_menu_snapshots
 
 router = APIRouter()
 
@@ -445,6 +446,8 @@ async def seed_database():
     
     # Insert add-on groups
     await db.addon_groups.insert_many(addon_groups)
+    # Menus built for an earlier seed would otherwise match the fresh menu_version
+    await drop_menu_snapshots([r["id"] for r in restaurants])
     
     return {"message": "تم إضافة البيانات التجريبية بنجاح", "restaurants": len(restaurants), "menu_items": len(menu_items), "addon_groups": len(addon_groups)}
 
@@ -4,6 +4,7 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.staticfiles import StaticFiles
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from datetime import datetime
@@ -39,6 +40,7 @@ from routes.seed import router as seed_router
 from routes.categories import router as categories_router
 from routes.favorites import router as favorites_router
 from routes.coupons import router as coupons_router
+from routes.home import router as home_router
 
 # Include all routers with /api prefix
 app.include_router(auth_router, prefix="/api")
@@ -53,6 +55,7 @@ app.include_router(seed_router, prefix="/api")
 app.include_router(categories_router, prefix="/api")
 app.include_router(favorites_router, prefix="/api")
 app.include_router(coupons_router, prefix="/api")
+app.include_router(home_router, prefix="/api")
 
 # Health check routes
 @app.get("/api/")
@@ -77,6 +80,19 @@ app.mount("/api/static", StaticFiles(directory=str(ROOT_DIR / "static")), name="
 
 # Startup & shutdown events
 from utils.auth import hash_password
+from utils.location_store import run_location_flusher, flush_driver_locations
+from utils.breadcrumbs import run_breadcrumb_flusher, run_breadcrumb_compactor, flush_breadcrumbs
+from utils.migrations import backfill_order_city_ids, migrate_coupon_expiry, backfill_notification_expiry
+from utils.dispatch import run_dispatcher, DISPATCH_ENABLED
+from utils.eta import run_eta_refresher
+from utils.coupons import run_coupon_sweeper
+from utils.notification_archive import run_notification_archiver, NOTIFICATION_ARCHIVE_DIR
+from utils.notification_counters import run_unread_reconciler
+from utils.push_receipts import run_push_receipt_poller
+from utils.driver_presence import run_driver_sweeper
+from utils.notifications import NOTIFICATION_WINDOW_DAYS
+
+background_tasks = []
 
 @app.on_event("startup")
 async def startup_event():
@@ -109,7 +125,13 @@ async def startup_event():
         await db.users.create_index("id", unique=True)
         await db.users.create_index("phone", unique=True)
         await db.users.create_index("role")
-        await db.users.create_index("city_id")
+        await db.users.create_index([("city_id", 1), ("created_at", 1)])
+        await db.users.create_index("created_at")
+        await db.users.create_index([("role", 1), ("is_online", 1), ("location_updated_at", 1)])
+        await db.menu_items.create_index([("restaurant_id", 1), ("category", 1), ("name", 1)])
+        await db.menu_items.create_index("id")
+        await db.addon_groups.create_index([("restaurant_id", 1), ("menu_item_id", 1)])
+        await db.menu_snapshots.create_index("restaurant_id", unique=True)
         await db.restaurants.create_index("id", unique=True)
         await db.restaurants.create_index("city_id")
         await db.restaurants.create_index("cuisine_type")
@@ -117,18 +139,96 @@ async def startup_event():
         await db.restaurants.create_index("owner_id")
         await db.restaurants.create_index([("name", 1), ("cuisine_type", 1)])
         await db.orders.create_index("id", unique=True)
-        await db.orders.create_index("user_id")
+        await db.orders.create_index([("user_id", 1), ("created_at", -1)])
+        await db.complaints.create_index("id")
+        await db.complaints.create_index("created_at")
+        await db.complaints.create_index([("restaurant_id", 1), ("created_at", 1)])
         await db.orders.create_index("restaurant_id")
         await db.orders.create_index("driver_id")
         await db.orders.create_index("order_status")
         await db.orders.create_index("created_at")
-        await db.notifications.create_index("user_id")
-        await db.notifications.create_index("is_read")
-        await db.notifications.create_index([("user_id", 1), ("is_read", 1)])
+        await db.orders.create_index([("city_id", 1), ("created_at", 1)])
+        await db.orders.create_index([("city_id", 1), ("order_status", 1), ("delivery_mode", 1), ("created_at", 1)])
+        await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+        await db.notifications.create_index([("user_id", 1), ("is_read", 1), ("created_at", -1)])
+        await db.notifications.create_index("expires_at", expireAfterSeconds=0)
+        await db.notifications.create_index("id", unique=True)
+        await db.notification_counters.create_index("user_id", unique=True)
+        await db.push_tokens.create_index([("user_id", 1), ("is_active", 1)])
+        await db.push_tokens.create_index("token")
+        await db.push_tickets.create_index("ticket_id")
+        await db.push_tickets.create_index("created_at")
+        await db.push_tickets.create_index("expires_at", expireAfterSeconds=0)
+        await db.push_delivery_stats.create_index([("day", 1), ("channel_id", 1)], unique=True)
+        await db.notifications.create_index(
+            [("user_id", 1), ("coalesce_key", 1), ("created_at", -1)],
+            partialFilterExpression={"coalesce_key": {"$exists": True}}
+        )
+        await db.driver_locations.create_index("driver_id", unique=True)
+        await db.driver_locations.create_index("updated_at")
+        await db.driver_breadcrumbs.create_index([("driver_id", 1), ("bucket_start", 1)], unique=True)
+        await db.driver_breadcrumbs.create_index([("resolution", 1), ("bucket_start", 1)])
+        await db.driver_breadcrumbs.create_index("expires_at", expireAfterSeconds=0)
+        await db.orders.create_index([("city_id", 1), ("offer_expires_at", 1)], sparse=True)
+        await db.orders.create_index("stage_timestamps.delivered", sparse=True)
+        await db.idempotency_keys.create_index([("user_id", 1), ("key", 1), ("scope", 1)], unique=True)
+        await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+        await db.driver_offers.create_index("id", unique=True)
+        await db.driver_offers.create_index([("driver_id", 1), ("status", 1)])
+        await db.driver_offers.create_index("order_id")
+        await db.coupon_redemptions.create_index([("coupon_id", 1), ("user_id", 1)], unique=True)
+        await db.coupon_redemptions.create_index("id", unique=True)
+        await db.coupons.create_index([("is_active", 1), ("expires_at", 1)])
+        await db.coupons.create_index("created_at")
+        await db.coupons_archive.create_index("id", unique=True)
         logger.info("MongoDB indexes created successfully")
     except Exception as e:
         logger.warning(f"Index creation warning: {e}")
 
+    # Separate so that existing duplicate codes do not block the indexes above
+    try:
+        await db.coupons.create_index("code", unique=True)
+    except Exception as e:
+        logger.warning(f"Coupon code index warning (duplicate codes?): {e}")
+
+    try:
+        await backfill_order_city_ids()
+    except Exception as e:
+        logger.warning(f"Order city backfill warning: {e}")
+
+    try:
+        await migrate_coupon_expiry()
+    except Exception as e:
+        logger.warning(f"Coupon expiry migration warning: {e}")
+
+    try:
+        await backfill_notification_expiry()
+        # Covered by the compound (user_id, ...) indexes; is_read alone is not selective
+        for name in ["user_id_1", "is_read_1", "user_id_1_is_read_1"]:
+            if name in await db.notifications.index_information():
+                await db.notifications.drop_index(name)
+    except Exception as e:
+        logger.warning(f"Notification retention setup warning: {e}")
+
+    # Start background workers
+    background_tasks.append(asyncio.create_task(run_location_flusher()))
+    background_tasks.append(asyncio.create_task(run_breadcrumb_flusher()))
+    background_tasks.append(asyncio.create_task(run_breadcrumb_compactor()))
+    background_tasks.append(asyncio.create_task(run_eta_refresher()))
+    background_tasks.append(asyncio.create_task(run_coupon_sweeper()))
+    background_tasks.append(asyncio.create_task(run_unread_reconciler(NOTIFICATION_WINDOW_DAYS)))
+    background_tasks.append(asyncio.create_task(run_push_receipt_poller()))
+    background_tasks.append(asyncio.create_task(run_driver_sweeper()))
+    if NOTIFICATION_ARCHIVE_DIR:
+        background_tasks.append(asyncio.create_task(run_notification_archiver()))
+    if DISPATCH_ENABLED:
+        background_tasks.append(asyncio.create_task(run_dispatcher()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    # Persist any buffered driver positions before exiting
+    await flush_driver_locations()
+    await flush_breadcrumbs()
     client.close()
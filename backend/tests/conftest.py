@@ -0,0 +1,315 @@
+import copy
+import os
+import sys
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+# Allow tests to import backend modules (utils, models, ...) directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py reads these at import time; the client does not connect until first use
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "food_app_test")
+# utils.auth reads the signing key at import time
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+
+# --- In-memory stand-in for the Motor collections used by unit tests ---------------------------
+# Supports the subset of the query/update language the backend uses; anything else raises so a
+# test never passes on a silently ignored operator.
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def _compare(value, op, arg):
+    present = value is not _MISSING
+    if op == "$exists":
+        return present == bool(arg)
+    if op == "$eq":
+        return _equals(value, arg)
+    if op == "$ne":
+        return not _equals(value, arg)
+    if op == "$in":
+        return any(_equals(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_equals(value, a) for a in arg)
+    if op in ("$lt", "$lte", "$gt", "$gte"):
+        if not present or value is None:
+            return False
+        return {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]
+    raise NotImplementedError(f"query operator {op}")
+
+
+def _equals(value, arg):
+    if arg is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(arg, list):
+        return arg in value
+    return value == arg
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            value = _get(doc, key)
+            if not all(_compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif not _equals(_get(doc, key), cond):
+            return False
+    return True
+
+
+def evaluate(expr, doc):
+    """Aggregation expressions used by pipeline updates ($ifNull, $add of a date and milliseconds)"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and "$ifNull" in expr:
+        value = evaluate(expr["$ifNull"][0], doc)
+        return value if value is not None else evaluate(expr["$ifNull"][1], doc)
+    if isinstance(expr, dict) and "$add" in expr:
+        date, millis = (evaluate(e, doc) for e in expr["$add"])
+        return date + timedelta(milliseconds=millis)
+    if isinstance(expr, dict) and any(k.startswith("$") for k in expr):
+        raise NotImplementedError(f"expression {expr}")
+    return expr
+
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        for stage in update:
+            if set(stage) != {"$set"}:
+                raise NotImplementedError(f"pipeline stage {stage}")
+            for path, expr in stage["$set"].items():
+                _set(doc, path, evaluate(expr, doc))
+        return
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            current = _get(doc, path)
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(arg))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + arg)
+            elif op == "$min":
+                if current is _MISSING or arg < current:
+                    _set(doc, path, arg)
+            elif op == "$max":
+                if current is _MISSING or arg > current:
+                    _set(doc, path, arg)
+            elif op in ("$push", "$addToSet"):
+                items = list(arg["$each"]) if isinstance(arg, dict) and "$each" in arg else [arg]
+                values = [] if current is _MISSING else list(current)
+                for item in items:
+                    if op == "$push" or item not in values:
+                        values.append(copy.deepcopy(item))
+                if isinstance(arg, dict) and "$slice" in arg:
+                    n = arg["$slice"]
+                    values = values[n:] if n < 0 else values[:n]
+                _set(doc, path, values)
+            else:
+                raise NotImplementedError(f"update operator {op}")
+
+
+def _seed_from_query(query):
+    doc = {}
+    for key, cond in query.items():
+        if not key.startswith("$") and not isinstance(cond, dict):
+            _set(doc, key, copy.deepcopy(cond))
+    return doc
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if projection:
+        included = [k for k, v in projection.items() if v and k != "_id"]
+        if included:
+            doc = {k: v for k, v in doc.items() if k.split(".")[0] in {i.split(".")[0] for i in included}}
+        for key, value in projection.items():
+            if not value:
+                doc.pop(key, None)
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, str) else list(key)
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: (_get(d, field) is _MISSING, _get(d, field)), reverse=order < 0)
+        return self
+
+    def skip(self, n):
+        del self.docs[:n]
+        return self
+
+    def limit(self, n):
+        if n:
+            del self.docs[n:]
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs if length is None else self.docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Documents live in .docs; reads, bulk_write batches and a failure switch are exposed for tests"""
+
+    def __init__(self, docs=None):
+        self.docs = docs if docs is not None else []
+        self.reads = 0
+        self.writes = []
+        self.fail = False
+
+    def _check(self):
+        if self.fail:
+            raise RuntimeError("write failed")
+
+    def find(self, query=None, projection=None):
+        self.reads += 1
+        return FakeCursor([_project(d, projection) for d in self.docs if matches(d, query or {})])
+
+    async def find_one(self, query=None, projection=None):
+        self.reads += 1
+        doc = next((d for d in self.docs if matches(d, query or {})), None)
+        return _project(doc, projection) if doc is not None else None
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def distinct(self, field, query=None):
+        values = []
+        for doc in self.docs:
+            value = _get(doc, field)
+            if matches(doc, query or {}) and value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+    async def insert_one(self, doc):
+        self._check()
+        self.docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc.get("id"))
+
+    async def insert_many(self, docs, ordered=True):
+        self._check()
+        self.docs.extend(copy.deepcopy(d) for d in docs)
+
+    def _update(self, query, update, many, upsert=False):
+        self._check()
+        matched = [d for d in self.docs if matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            apply_update(doc, update)
+        if not matched and upsert:
+            doc = _seed_from_query(query)
+            apply_update(doc, update, inserting=True)
+            self.docs.append(doc)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def update_one(self, query, update, upsert=False):
+        return self._update(query, update, many=False, upsert=upsert)
+
+    async def update_many(self, query, update, upsert=False):
+        return self._update(query, update, many=True, upsert=upsert)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False, upsert=False):
+        self._check()
+        doc = next((d for d in self.docs if matches(d, query)), None)
+        if doc is None:
+            return None
+        before = copy.deepcopy(doc)
+        apply_update(doc, update)
+        return _project(doc if return_document else before, projection)
+
+    async def delete_one(self, query):
+        doc = next((d for d in self.docs if matches(d, query)), None)
+        if doc is not None:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=int(doc is not None))
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    async def bulk_write(self, ops, ordered=True):
+        self._check()
+        self.writes.append(ops)
+        modified = 0
+        for op in ops:
+            kind = type(op).__name__
+            if kind == "InsertOne":
+                self.docs.append(copy.deepcopy(op._doc))
+                continue
+            result = self._update(op._filter, op._doc, many=kind == "UpdateMany", upsert=op._upsert)
+            modified += result.modified_count
+        return SimpleNamespace(modified_count=modified)
+
+
+class FakeDatabase:
+    """Collections are created on first access, like Motor's"""
+
+    def __getattr__(self, name):
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Replace the module-level db of the given modules with one shared in-memory database"""
+    database = FakeDatabase()
+
+    def install(*modules):
+        for module in modules:
+            monkeypatch.setattr(module, "db", database)
+        return database
+    return install
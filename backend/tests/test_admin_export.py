@@ -0,0 +1,62 @@
+"""
+Test Suite for streaming admin exports
+- CSV (with BOM and header) and NDJSON rows from a cursor
+- Only whitelisted columns are exported
+- gzip output decompresses to the plain export and arrives in several chunks
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+from utils import admin_export
+from utils.admin_export import EXPORT_COLUMNS, export_projection, stream_export
+
+
+async def cursor(docs):
+    for doc in docs:
+        yield dict(doc)
+
+
+def collect(kind, docs, fmt, compress=False):
+    async def run():
+        return [chunk async for chunk in stream_export(kind, cursor(docs), fmt, compress)]
+    return asyncio.run(run())
+
+
+ORDER = {
+    "id": "o1", "created_at": datetime(2026, 3, 1, 12, 30), "city_id": "damascus", "restaurant_name": "مطعم",
+    "total": 25000, "order_status": "delivered", "items": [{"quantity": 2}, {"quantity": 1}],
+}
+USER = {"id": "u1", "name": "سامر", "phone": "0912345678", "role": "customer", "password_hash": "secret"}
+
+
+def test_csv_export():
+    body = b"".join(collect("orders", [ORDER], "csv")).decode("utf-8")
+    assert body.startswith("\ufeff")
+    rows = list(csv.DictReader(io.StringIO(body.lstrip("\ufeff"))))
+    assert rows[0]["id"] == "o1"
+    assert rows[0]["created_at"] == "2026-03-01T12:30:00"
+    assert rows[0]["item_count"] == "3"
+    assert rows[0]["driver_id"] == ""
+
+
+def test_ndjson_export_has_only_whitelisted_columns():
+    lines = b"".join(collect("users", [USER], "ndjson")).decode("utf-8").splitlines()
+    row = json.loads(lines[0])
+    assert set(row) == set(EXPORT_COLUMNS["users"])
+    assert "secret" not in lines[0]
+    assert "password_hash" not in export_projection("users")
+
+
+def test_gzip_export_streams_in_chunks(monkeypatch):
+    monkeypatch.setattr(admin_export, "EXPORT_CHUNK_BYTES", 512)
+    docs = [dict(ORDER, id=f"o{i}") for i in range(200)]
+    chunks = collect("orders", docs, "ndjson", compress=True)
+    assert len(chunks) > 1
+    plain = b"".join(collect("orders", docs, "ndjson"))
+    assert gzip.decompress(b"".join(chunks)) == plain
+    assert len(plain.splitlines()) == 200
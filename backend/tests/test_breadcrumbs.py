@@ -0,0 +1,143 @@
+"""
+Test Suite for utils.breadcrumbs
+- Bucket boundaries for bucket lengths that do and do not divide an hour
+- Flushing groups points per bucket; route queries merge buckets with unflushed points
+- The order route endpoint: who may read it and where the trail starts
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from routes import drivers
+from utils import breadcrumbs, restaurant_owner
+from utils.breadcrumbs import (
+    bucket_start_for, downsample_points, flush_breadcrumbs, get_driver_route, record_breadcrumb,
+)
+
+T0 = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.mark.parametrize("minutes,ts,expected", [
+    (10, datetime(2026, 3, 1, 12, 37, 12, 5), datetime(2026, 3, 1, 12, 30)),
+    (7, datetime(2026, 3, 1, 12, 9, 30), datetime(2026, 3, 1, 12, 7)),
+    # Minute-of-hour flooring would give 11:56, a bucket that also holds 12:00-12:02
+    (7, datetime(2026, 3, 1, 11, 59, 10), datetime(2026, 3, 1, 11, 53)),
+    (90, datetime(2026, 3, 1, 13, 10), datetime(2026, 3, 1, 12, 0)),
+    (90, datetime(2026, 3, 1, 13, 40), datetime(2026, 3, 1, 13, 30)),
+    (1440, datetime(2026, 3, 1, 23, 59), datetime(2026, 3, 1, 0, 0)),
+])
+def test_bucket_start(monkeypatch, minutes, ts, expected):
+    monkeypatch.setattr(breadcrumbs, "BREADCRUMB_BUCKET_MINUTES", minutes)
+    assert bucket_start_for(ts) == expected
+
+
+@pytest.mark.parametrize("minutes", [7, 10, 90])
+def test_buckets_are_contiguous(monkeypatch, minutes):
+    monkeypatch.setattr(breadcrumbs, "BREADCRUMB_BUCKET_MINUTES", minutes)
+    size = timedelta(minutes=minutes)
+    for offset in range(0, 600, 7):
+        ts = T0 + timedelta(minutes=offset, seconds=13)
+        start = bucket_start_for(ts)
+        assert start <= ts < start + size
+        assert bucket_start_for(start) == start
+
+
+def test_downsample_keeps_first_point_per_interval():
+    points = [[T0 + timedelta(seconds=s), 33.5, 36.3] for s in (0, 10, 59, 60, 61, 185)]
+    assert [p[0].second for p in downsample_points(points, 60)] == [0, 0, 5]
+
+
+@pytest.fixture
+def store(fake_db, monkeypatch):
+    db = fake_db(breadcrumbs)
+    monkeypatch.setattr(breadcrumbs, "BREADCRUMB_BUCKET_MINUTES", 10)
+    breadcrumbs._pending.clear()
+    yield db.driver_breadcrumbs
+    breadcrumbs._pending.clear()
+
+
+def test_flush_groups_points_per_bucket(store):
+    for minute in (1, 4, 12, 25):
+        record_breadcrumb("d1", 33.5, 36.3, T0 + timedelta(minutes=minute))
+    record_breadcrumb("d2", 33.6, 36.4, T0)
+    assert asyncio.run(flush_breadcrumbs()) == 5
+    assert {(b["driver_id"], b["bucket_start"]): b["count"] for b in store.docs} == {
+        ("d1", T0): 2, ("d1", T0 + timedelta(minutes=10)): 1, ("d1", T0 + timedelta(minutes=20)): 1, ("d2", T0): 1,
+    }
+    assert not breadcrumbs._pending
+
+
+def test_route_merges_flushed_and_pending_points(store):
+    for minute in (25, 1, 12):
+        record_breadcrumb("d1", 33.5, 36.3 + minute / 100, T0 + timedelta(minutes=minute))
+    asyncio.run(flush_breadcrumbs())
+    record_breadcrumb("d1", 33.5, 36.6, T0 + timedelta(minutes=27))
+    record_breadcrumb("d1", 33.5, 36.7, T0 + timedelta(minutes=45))
+
+    # The start falls inside the first bucket; points before it are dropped
+    route = asyncio.run(get_driver_route("d1", T0 + timedelta(minutes=3), T0 + timedelta(minutes=30)))
+    assert [p["t"] for p in route] == [
+        (T0 + timedelta(minutes=m)).isoformat() for m in (12, 25, 27)
+    ]
+    assert route[0] == {"t": (T0 + timedelta(minutes=12)).isoformat(), "lat": 33.5, "lng": pytest.approx(36.42)}
+
+
+def test_route_is_capped(store, monkeypatch):
+    monkeypatch.setattr(breadcrumbs, "MAX_ROUTE_POINTS", 10)
+    for second in range(0, 100):
+        record_breadcrumb("d1", 33.5, 36.3, T0 + timedelta(seconds=second))
+    route = asyncio.run(get_driver_route("d1", T0, T0 + timedelta(hours=1)))
+    assert len(route) == 10
+    assert route[0]["t"] == T0.isoformat()
+    assert route[-1]["t"] == (T0 + timedelta(seconds=90)).isoformat()
+
+
+@pytest.fixture
+def route_db(store, fake_db):
+    db = fake_db(drivers, restaurant_owner)
+    restaurant_owner._cache.clear()
+    db.restaurants.docs = [{"id": "r1", "owner_id": "owner-1"}, {"id": "r2", "owner_id": "owner-2"}]
+    db.orders.docs = [{
+        "id": "o1", "user_id": "c1", "restaurant_id": "r1", "driver_id": "d1", "order_status": "delivered",
+        "updated_at": T0 + timedelta(minutes=50),
+        "stage_timestamps": {
+            "pending": T0, "driver_assigned": T0 + timedelta(minutes=20), "picked_up": T0 + timedelta(minutes=30),
+            "delivered": T0 + timedelta(minutes=50),
+        },
+    }]
+    # The driver was on another delivery before this order was assigned
+    for minute in (5, 25, 35, 45):
+        record_breadcrumb("d1", 33.5, 36.3, T0 + timedelta(minutes=minute))
+    return db
+
+
+def route_for(user):
+    return asyncio.run(drivers.get_order_route("o1", user))
+
+
+def minutes(route):
+    return [(datetime.fromisoformat(p["t"]) - T0).seconds // 60 for p in route["points"]]
+
+
+def test_route_starts_at_assignment_or_pickup(route_db):
+    assert minutes(route_for({"id": "d1", "role": "driver"})) == [25, 35, 45]
+    assert minutes(route_for({"id": "owner-1", "role": "restaurant"})) == [25, 35, 45]
+    assert minutes(route_for({"id": "a1", "role": "admin"})) == [25, 35, 45]
+    # Customers see the trail from pickup on
+    assert minutes(route_for({"id": "c1", "role": "customer"})) == [35, 45]
+
+
+def test_route_needs_a_stage_timestamp(route_db):
+    route_db.orders.docs[0]["stage_timestamps"] = {"pending": T0}
+    assert route_for({"id": "d1", "role": "driver"})["points"] == []
+
+
+def test_only_the_owning_restaurant_may_read_the_route(route_db):
+    for user in [{"id": "owner-2", "role": "restaurant"}, {"id": "owner-3", "role": "restaurant"},
+                 {"id": "c2", "role": "customer"}, {"id": "d2", "role": "driver"}]:
+        with pytest.raises(HTTPException) as e:
+            route_for(user)
+        assert e.value.status_code == 403
@@ -0,0 +1,102 @@
+"""
+Test Suite for atomic coupon redemption under concurrency (runs against a live backend)
+Tests:
+- Many users redeeming a limited coupon at once never exceed max_uses
+- One user firing concurrent requests gets a single redemption
+"""
+
+import pytest
+import requests
+import os
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://expo-food-app.preview.emergentagent.com')
+
+ADMIN_PHONE = "0900000000"
+ADMIN_PASSWORD = "admin123"
+
+MAX_USES = 5
+USERS = 20
+
+
+@pytest.fixture(scope="module")
+def admin_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "phone": ADMIN_PHONE,
+        "password": ADMIN_PASSWORD
+    })
+    assert response.status_code == 200, f"Admin login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def register_user():
+    response = requests.post(f"{BASE_URL}/api/auth/register", json={
+        "name": "TEST coupon load",
+        "phone": f"09{random.randint(10000000, 99999999)}",
+        "password": "test123",
+        "role": "customer"
+    })
+    assert response.status_code == 200, f"User registration failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def user_headers_list():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return list(pool.map(lambda _: register_user(), range(USERS)))
+
+
+def create_coupon(admin_headers, max_uses):
+    code = f"LOAD{uuid.uuid4().hex[:8].upper()}"
+    response = requests.post(f"{BASE_URL}/api/admin/coupons", json={
+        "code": code,
+        "discount_type": "fixed",
+        "discount_value": 1000,
+        "max_uses": max_uses,
+    }, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def get_coupon(admin_headers, coupon_id):
+    response = requests.get(f"{BASE_URL}/api/admin/coupons", headers=admin_headers)
+    assert response.status_code == 200
+    return next(c for c in response.json() if c["id"] == coupon_id)
+
+
+class TestCouponRedemptionLoad:
+    """Concurrent /coupons/use calls against a coupon with few uses left"""
+
+    def test_max_uses_never_exceeded(self, admin_headers, user_headers_list):
+        coupon = create_coupon(admin_headers, MAX_USES)
+
+        def use(headers):
+            return requests.post(f"{BASE_URL}/api/coupons/use", json={"coupon_id": coupon["id"]}, headers=headers)
+
+        with ThreadPoolExecutor(max_workers=USERS) as pool:
+            responses = list(pool.map(use, user_headers_list))
+
+        successes = [r for r in responses if r.status_code == 200]
+        assert len(successes) == MAX_USES, [r.status_code for r in responses]
+        assert all(r.status_code == 400 for r in responses if r.status_code != 200)
+        assert get_coupon(admin_headers, coupon["id"])["used_count"] == MAX_USES
+        print(f"✓ {USERS} concurrent users, exactly {MAX_USES} redemptions")
+
+        requests.delete(f"{BASE_URL}/api/admin/coupons/{coupon['id']}", headers=admin_headers)
+
+    def test_single_user_redeems_once(self, admin_headers, user_headers_list):
+        coupon = create_coupon(admin_headers, MAX_USES)
+        headers = user_headers_list[0]
+
+        def use(_):
+            return requests.post(f"{BASE_URL}/api/coupons/use", json={"coupon_id": coupon["id"]}, headers=headers)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(use, range(8)))
+
+        assert get_coupon(admin_headers, coupon["id"])["used_count"] == 1
+        print("✓ 8 concurrent requests from one user counted once")
+
+        requests.delete(f"{BASE_URL}/api/admin/coupons/{coupon['id']}", headers=admin_headers)
@@ -0,0 +1,64 @@
+"""
+Test Suite for the coupon helpers
+- Expiry parsing into naive UTC datetimes and back to ISO strings
+- Expiry checks for migrated and legacy coupons
+- Discount computation
+- Reactivation filter after a released redemption
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from utils.coupons import (
+    _reactivate_filter, _usable_filter, compute_discount, coupon_expired, parse_expiry, serialize_coupon,
+)
+
+
+def test_parse_expiry_converts_to_naive_utc():
+    assert parse_expiry("2026-05-01T15:00:00+03:00") == datetime(2026, 5, 1, 12, 0)
+    assert parse_expiry("2026-05-01T12:00:00Z") == datetime(2026, 5, 1, 12, 0)
+    assert parse_expiry("2026-05-01T12:00:00") == datetime(2026, 5, 1, 12, 0)
+    assert parse_expiry(None) is None
+    assert parse_expiry("") is None
+
+
+def test_parse_expiry_rejects_garbage():
+    with pytest.raises(HTTPException) as exc:
+        parse_expiry("next week")
+    assert exc.value.status_code == 400
+
+
+def test_serialize_round_trip():
+    coupon = serialize_coupon({"expires_at": datetime(2026, 5, 1, 12, 0)})
+    assert coupon["expires_at"] == "2026-05-01T12:00:00+00:00"
+    assert parse_expiry(coupon["expires_at"]) == datetime(2026, 5, 1, 12, 0)
+    assert serialize_coupon({"expires_at": None})["expires_at"] is None
+
+
+def test_coupon_expired():
+    now = datetime.utcnow()
+    assert coupon_expired({"expires_at": now - timedelta(minutes=1)})
+    assert not coupon_expired({"expires_at": now + timedelta(minutes=1)})
+    assert not coupon_expired({"expires_at": None})
+    # Not yet migrated: ISO string
+    past = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    assert coupon_expired({"expires_at": past})
+
+
+def test_compute_discount():
+    assert compute_discount({"discount_type": "percentage", "discount_value": 10}, 25000) == 2500
+    assert compute_discount({"discount_type": "fixed", "discount_value": 5000}, 3000) == 3000
+    assert compute_discount({"discount_type": "free_delivery", "discount_value": 0}, 25000, 4000) == 4000
+
+
+def test_reactivation_keeps_both_usability_guards():
+    now = datetime.utcnow()
+    query = _reactivate_filter("c1", now)
+    assert "$or" not in query
+    # Both the max-uses and the expiry clause must survive (they are separate $or conditions)
+    assert {"max_uses": {"$in": [None, 0]}} in query["$and"][0]["$or"]
+    assert {"expires_at": {"$gt": now}} in query["$and"][1]["$or"]
+    assert query["deactivated_reason"] == "exhausted" and query["is_active"] is False
+    assert len(_usable_filter({"id": "c1"})["$and"]) == 2
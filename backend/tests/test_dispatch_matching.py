@@ -0,0 +1,180 @@
+"""
+Test Suite for the platform dispatch matching engine
+Runs the pure matcher against a simulated fleet (no server or database needed):
+- Every order gets at most one driver and no driver exceeds its load
+- Nearest free driver wins, loaded drivers are penalised
+- Declined drivers and out-of-range drivers are skipped
+- Orders no driver can take are broadcast instead of waiting for offers that never come
+- Immediate rounds are tracked until they finish
+"""
+
+import asyncio
+import random
+
+import pytest
+
+from utils import dispatch
+from utils.helpers import calculate_distance
+from utils.matching import match_orders_to_drivers, orders_without_candidates
+
+DAMASCUS = (33.5138, 36.2765)
+HOMS = (34.7324, 36.7137)
+
+
+def simulated_fleet(n_orders, n_drivers, seed=7, spread=0.05, max_load=2):
+    rng = random.Random(seed)
+
+    def point():
+        return DAMASCUS[0] + rng.uniform(-spread, spread), DAMASCUS[1] + rng.uniform(-spread, spread)
+
+    orders = []
+    for i in range(n_orders):
+        lat, lng = point()
+        orders.append({"id": f"order-{i}", "lat": lat, "lng": lng})
+    drivers = []
+    for i in range(n_drivers):
+        lat, lng = point()
+        drivers.append({"id": f"driver-{i}", "lat": lat, "lng": lng, "load": rng.randint(0, max_load)})
+    return orders, drivers
+
+
+@pytest.mark.parametrize("n_orders,n_drivers", [(5, 20), (40, 40), (60, 15)])
+def test_assignment_respects_capacity(n_orders, n_drivers):
+    orders, drivers = simulated_fleet(n_orders, n_drivers)
+    assignments = match_orders_to_drivers(orders, drivers, max_load=2)
+
+    order_ids = [a[0] for a in assignments]
+    assert len(order_ids) == len(set(order_ids))
+
+    free_drivers = {d["id"] for d in drivers if d["load"] < 2}
+    assigned_drivers = [a[1] for a in assignments]
+    assert len(assigned_drivers) == len(set(assigned_drivers))
+    assert set(assigned_drivers) <= free_drivers
+    # Greedy matching never leaves both an order and a free driver unused
+    assert len(assignments) == min(len(orders), len(free_drivers))
+
+
+def test_reported_distance_matches_haversine():
+    orders, drivers = simulated_fleet(10, 10)
+    by_id = {o["id"]: o for o in orders}
+    by_id.update({d["id"]: d for d in drivers})
+    for order_id, driver_id, distance in match_orders_to_drivers(orders, drivers):
+        o, d = by_id[order_id], by_id[driver_id]
+        assert distance == pytest.approx(calculate_distance(o["lat"], o["lng"], d["lat"], d["lng"]))
+
+
+def test_nearest_idle_driver_wins():
+    orders = [{"id": "o1", "lat": 33.5138, "lng": 36.2765}]
+    drivers = [
+        {"id": "far", "lat": 33.5500, "lng": 36.3000, "load": 0},
+        {"id": "near", "lat": 33.5140, "lng": 36.2770, "load": 0},
+    ]
+    assert match_orders_to_drivers(orders, drivers)[0][1] == "near"
+
+
+def test_loaded_driver_is_penalised():
+    orders = [{"id": "o1", "lat": 33.5138, "lng": 36.2765}]
+    drivers = [
+        # ~0.5 km away but already carrying an order
+        {"id": "busy", "lat": 33.5183, "lng": 36.2765, "load": 1},
+        # ~1.5 km away and idle
+        {"id": "idle", "lat": 33.5273, "lng": 36.2765, "load": 0},
+    ]
+    assert match_orders_to_drivers(orders, drivers, load_penalty_km=2.0)[0][1] == "idle"
+    assert match_orders_to_drivers(orders, drivers, load_penalty_km=0.0)[0][1] == "busy"
+
+
+def test_excluded_and_out_of_range_drivers_are_skipped():
+    orders = [{"id": "o1", "lat": 33.5138, "lng": 36.2765, "excluded_driver_ids": ["near"]}]
+    drivers = [
+        {"id": "near", "lat": 33.5140, "lng": 36.2770, "load": 0},
+        {"id": "aleppo", "lat": 36.2021, "lng": 37.1343, "load": 0},
+    ]
+    assert match_orders_to_drivers(orders, drivers, max_distance_km=15) == []
+
+
+def test_full_drivers_get_nothing():
+    orders, drivers = simulated_fleet(10, 5)
+    for d in drivers:
+        d["load"] = 2
+    assert match_orders_to_drivers(orders, drivers, max_load=2) == []
+
+
+def stranded_fleet():
+    """Damascus orders; drivers are either in Homs (~140 km) or nearby but declined every order"""
+    orders, near = simulated_fleet(20, 10, seed=3)
+    far = [
+        dict(d, id=f"far-{i}", lat=d["lat"] - DAMASCUS[0] + HOMS[0], lng=d["lng"] - DAMASCUS[1] + HOMS[1], load=0)
+        for i, d in enumerate(simulated_fleet(0, 10, seed=4)[1])
+    ]
+    near = [dict(d, load=0) for d in near]
+    for order in orders:
+        order["excluded_driver_ids"] = [d["id"] for d in near]
+    return orders, near + far
+
+
+def test_orders_without_any_eligible_driver():
+    orders, drivers = stranded_fleet()
+    assert match_orders_to_drivers(orders, drivers, max_load=2, max_distance_km=15) == []
+    assert orders_without_candidates(orders, drivers, max_load=2, max_distance_km=15) == {o["id"] for o in orders}
+
+    # One nearby driver who has not declined makes every order reachable again, even though
+    # a single round can only offer one of them
+    drivers.append({"id": "fresh", "lat": DAMASCUS[0], "lng": DAMASCUS[1], "load": 0})
+    assert len(match_orders_to_drivers(orders, drivers, max_load=2, max_distance_km=15)) == 1
+    assert orders_without_candidates(orders, drivers, max_load=2, max_distance_km=15) == set()
+
+    # ... unless that driver is already fully loaded
+    drivers[-1]["load"] = 2
+    assert len(orders_without_candidates(orders, drivers, max_load=2, max_distance_km=15)) == len(orders)
+    assert orders_without_candidates([], drivers) == set()
+
+
+def test_stranded_orders_are_broadcast(fake_db, monkeypatch):
+    orders, drivers = stranded_fleet()
+    db = fake_db(dispatch)
+    db.orders.docs = [
+        {"id": o["id"], "city_id": "damascus", "order_status": "ready", "delivery_mode": "platform_driver",
+         "restaurant_name": "مطعم", "restaurant_lat": o["lat"], "restaurant_lng": o["lng"],
+         "declined_driver_ids": o["excluded_driver_ids"], "offer_attempts": 1, "created_at": i}
+        for i, o in enumerate(orders)
+    ]
+    broadcasts = []
+
+    async def available_drivers(city_id):
+        return drivers
+
+    async def notify_drivers_new_order(order, city_id):
+        broadcasts.append(order["id"])
+
+    monkeypatch.setattr(dispatch, "_available_drivers", available_drivers)
+    monkeypatch.setattr(dispatch, "notify_drivers_new_order", notify_drivers_new_order)
+
+    assert asyncio.run(dispatch.dispatch_city("damascus")) == 0
+    assert sorted(broadcasts) == sorted(o["id"] for o in orders)
+    assert all(o.get("broadcast_at") for o in db.orders.docs)
+    # Broadcast once only
+    asyncio.run(dispatch.dispatch_city("damascus"))
+    assert len(broadcasts) == len(orders)
+
+
+def test_request_dispatch_keeps_task_until_done(monkeypatch):
+    rounds = []
+
+    async def dispatch_city(city_id):
+        await asyncio.sleep(0)
+        rounds.append(city_id)
+
+    monkeypatch.setattr(dispatch, "DISPATCH_ENABLED", True)
+    monkeypatch.setattr(dispatch, "dispatch_city", dispatch_city)
+
+    async def run():
+        dispatch.request_dispatch("damascus")
+        dispatch.request_dispatch("damascus")
+        assert len(dispatch._dispatch_tasks) == 1 and "damascus" in dispatch._inflight
+        await asyncio.gather(*dispatch._dispatch_tasks)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert rounds == ["damascus"]
+    assert not dispatch._dispatch_tasks and not dispatch._inflight
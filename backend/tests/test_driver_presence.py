@@ -0,0 +1,144 @@
+"""
+Test Suite for the driver offline sweeper
+- Silent drivers are marked offline with offline_reason=heartbeat_timeout and counted in the metrics
+- Drivers within the heartbeat window or the post-online grace period are left alone
+- A heartbeat after an automatic sweep restores the driver; a manual offline is not overridden
+- A driver pinging normally is never swept, even though the users mirror is throttled
+"""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.schemas import DriverLocation
+from routes import drivers
+from utils import breadcrumbs, driver_presence, location_store
+from utils.driver_presence import get_sweep_stats, stale_driver_query, sweep_offline_drivers
+
+NOW = datetime(2026, 3, 1, 12, 0)
+OFFLINE_AFTER = timedelta(seconds=driver_presence.DRIVER_OFFLINE_AFTER_SECONDS)
+
+
+def driver(driver_id, silent_for, city_id="damascus", **fields):
+    return {"id": driver_id, "role": "driver", "is_online": True, "city_id": city_id,
+            "location_updated_at": NOW - silent_for, "went_online_at": NOW - timedelta(hours=2), **fields}
+
+
+@pytest.fixture
+def users(fake_db, monkeypatch):
+    db = fake_db(driver_presence, drivers, location_store)
+    monkeypatch.setattr(
+        driver_presence, "_sweep_stats", {"runs": 0, "swept_total": 0, "last_run_at": None, "last_swept": 0}
+    )
+    monkeypatch.setattr(driver_presence, "_recent_sweeps", deque(maxlen=50))
+    location_store._latest.clear()
+    location_store._dirty.clear()
+    breadcrumbs._pending.clear()
+    yield db.users
+    location_store._latest.clear()
+    location_store._dirty.clear()
+    breadcrumbs._pending.clear()
+
+
+def by_id(users):
+    return {u["id"]: u for u in users.docs}
+
+
+def test_stale_query_cutoff():
+    query = stale_driver_query(NOW)
+    cutoff = NOW - OFFLINE_AFTER
+    assert query["role"] == "driver"
+    assert query["is_online"] is True
+    heartbeat, went_online = query["$and"]
+    assert {"location_updated_at": {"$lt": cutoff}} in heartbeat["$or"]
+    # Drivers that never sent a location are swept too, after the grace period
+    assert {"location_updated_at": None} in heartbeat["$or"]
+    assert {"went_online_at": {"$lt": cutoff}} in went_online["$or"]
+
+
+def test_sweep_marks_silent_drivers_offline(users):
+    users.docs = [
+        driver("silent", OFFLINE_AFTER + timedelta(seconds=1)),
+        driver("silent-aleppo", OFFLINE_AFTER * 3, city_id="aleppo"),
+        driver("never-pinged", OFFLINE_AFTER, location_updated_at=None),
+        driver("active", timedelta(seconds=30)),
+        # Switched online recently: still within the grace period for a first heartbeat
+        driver("just-online", OFFLINE_AFTER * 2, went_online_at=NOW - timedelta(seconds=30)),
+        driver("already-offline", OFFLINE_AFTER * 2, is_online=False),
+        {"id": "customer", "role": "customer", "is_online": True},
+    ]
+    assert asyncio.run(sweep_offline_drivers(NOW)) == 3
+
+    docs = by_id(users)
+    for driver_id in ("silent", "silent-aleppo", "never-pinged"):
+        assert docs[driver_id]["is_online"] is False
+        assert docs[driver_id]["offline_reason"] == "heartbeat_timeout"
+        assert docs[driver_id]["went_offline_at"] == NOW
+    for driver_id in ("active", "just-online", "customer"):
+        assert docs[driver_id]["is_online"] is True
+    assert "offline_reason" not in docs["already-offline"]
+
+    stats = get_sweep_stats()
+    assert (stats["runs"], stats["swept_total"], stats["last_swept"], stats["last_run_at"]) == (1, 3, 3, NOW)
+    assert stats["recent"] == [{"at": NOW, "swept": 3, "by_city": {"damascus": 2, "aleppo": 1}}]
+
+    # Nothing left to sweep: the run is counted but not recorded as a sweep
+    assert asyncio.run(sweep_offline_drivers(NOW)) == 0
+    stats = get_sweep_stats()
+    assert (stats["runs"], stats["swept_total"], stats["last_swept"], len(stats["recent"])) == (2, 3, 0, 1)
+
+
+def test_heartbeat_restores_swept_driver(users):
+    users.docs = [driver("d1", OFFLINE_AFTER * 2)]
+    asyncio.run(sweep_offline_drivers(NOW))
+    swept = dict(users.docs[0])
+    assert swept["is_online"] is False
+
+    asyncio.run(drivers.update_driver_location(DriverLocation(lat=33.5138, lng=36.2765), swept))
+    doc = users.docs[0]
+    assert doc["is_online"] is True
+    assert "offline_reason" not in doc
+    assert doc["went_online_at"] > NOW
+
+
+def test_heartbeat_does_not_override_manual_offline(users):
+    users.docs = [driver("d1", timedelta(seconds=5), is_online=False)]
+    asyncio.run(drivers.update_driver_location(DriverLocation(lat=33.5138, lng=36.2765), dict(users.docs[0])))
+    assert users.docs[0]["is_online"] is False
+
+
+class Clock:
+    def __init__(self, start):
+        self.now = start
+
+    def utcnow(self):
+        return self.now
+
+
+@pytest.mark.parametrize("moving", [False, True])
+def test_pinging_driver_is_never_swept(users, monkeypatch, moving):
+    """Simulated hour: pings every 15 s, flushes every 5 s, sweeps every minute"""
+    clock = Clock(NOW)
+    monkeypatch.setattr(location_store, "datetime", clock)
+    users.docs = [driver("d1", timedelta(0), location_updated_at=None, went_online_at=NOW)]
+
+    silent_from = 45 * 60
+    for second in range(0, 60 * 60, 5):
+        clock.now = NOW + timedelta(seconds=second)
+        if second % 15 == 0 and second < silent_from:
+            # ~2 m per ping when stationary (GPS jitter), ~150 m when moving
+            step = 0.0014 if moving else 0.00002
+            location_store.record_driver_location("d1", 33.5 + step * (second // 15 % 2), 36.3)
+        asyncio.run(location_store.flush_driver_locations())
+        if second % 60 == 0:
+            asyncio.run(sweep_offline_drivers(clock.now))
+            if second < silent_from:
+                assert users.docs[0]["is_online"] is True, f"swept after {second} s"
+
+    # Once the pings stop, the driver is swept after DRIVER_OFFLINE_AFTER_SECONDS (plus throttling)
+    assert users.docs[0]["is_online"] is False
+    assert users.docs[0]["went_offline_at"] - (NOW + timedelta(seconds=silent_from)) <= OFFLINE_AFTER + timedelta(
+        seconds=location_store.USER_LOCATION_MIRROR_SECONDS + driver_presence.DRIVER_SWEEP_INTERVAL_SECONDS
+    )
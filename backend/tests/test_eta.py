@@ -0,0 +1,56 @@
+"""
+Test Suite for the ETA estimator
+Builds tables from synthetic delivered orders and checks the estimates
+"""
+
+from datetime import datetime, timedelta
+
+from utils import eta
+
+
+def delivered_order(created, prep_min, delivery_min, km_north=3.0):
+    return {
+        "city_id": "damascus",
+        "restaurant_lat": 33.5, "restaurant_lng": 36.3,
+        "delivery_lat": 33.5 + km_north / 111.2, "delivery_lng": 36.3,
+        "stage_timestamps": {
+            "pending": created,
+            "accepted": created + timedelta(minutes=1),
+            "ready": created + timedelta(minutes=1 + prep_min),
+            "picked_up": created + timedelta(minutes=3 + prep_min),
+            "delivered": created + timedelta(minutes=3 + prep_min + delivery_min),
+        },
+    }
+
+
+def test_tables_and_estimates(monkeypatch):
+    created = datetime(2026, 3, 1, 17, 0)  # 20:00 in Damascus
+    orders = [delivered_order(created + timedelta(days=i % 7), 25, 12) for i in range(30)]
+    monkeypatch.setattr(eta, "_tables", eta.build_eta_tables(orders))
+
+    hour = eta.local_hour(created)
+    assert eta.lookup_stat("damascus", hour, "prep_minutes") == 25
+    # 3 km in 12 minutes
+    assert round(eta.lookup_stat("damascus", hour, "speed_kmh")) == 15
+    # Unknown city falls back to the overall table
+    assert eta.lookup_stat("aleppo", hour, "prep_minutes") == 25
+
+    now = created + timedelta(minutes=5)
+    order = dict(delivered_order(created, 0, 0), order_status="picked_up")
+    order["stage_timestamps"] = {"pending": created}
+    result = eta.estimate_eta(order, 33.5, 36.3, now=now)
+    assert result["distance_to_customer_km"] == 3.0
+    assert result["eta_to_customer_min"] == 12
+
+    order["order_status"] = "accepted"
+    order["stage_timestamps"] = {"pending": created, "accepted": created}
+    result = eta.estimate_eta(order, 33.5, 36.3, now=now)
+    # 20 min of prep left + handoff + 12 min ride
+    assert result["eta_to_restaurant_min"] == 1
+    assert result["eta_to_customer_min"] == 34
+
+
+def test_defaults_without_history(monkeypatch):
+    monkeypatch.setattr(eta, "_tables", eta.build_eta_tables([]))
+    assert eta.lookup_stat("damascus", 12, "speed_kmh") == eta.DEFAULT_STATS["speed_kmh"]
+    assert eta.estimate_eta({"order_status": "delivered"})["eta_to_customer_min"] is None
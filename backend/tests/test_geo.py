@@ -0,0 +1,45 @@
+"""
+Test Suite for utils.geo
+Checks the vectorized distance helpers against the scalar Haversine
+"""
+
+import random
+
+import pytest
+
+from utils import geo
+from utils.helpers import calculate_distance
+
+
+def random_points(n, seed=3):
+    rng = random.Random(seed)
+    return [(33.5 + rng.uniform(-2, 2), 36.3 + rng.uniform(-2, 2)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("n", [5, 500])
+def test_distances_from_matches_scalar(n):
+    points = random_points(n)
+    expected = [calculate_distance(33.5, 36.3, lat, lng) for lat, lng in points]
+    assert geo.distances_from(33.5, 36.3, points) == pytest.approx(expected)
+
+
+def test_distance_matrix_matches_scalar():
+    sources, targets = random_points(7, seed=1), random_points(40, seed=2)
+    matrix = geo.distance_matrix(sources, targets)
+    for i, (s_lat, s_lng) in enumerate(sources):
+        for j, (t_lat, t_lng) in enumerate(targets):
+            assert matrix[i][j] == pytest.approx(calculate_distance(s_lat, s_lng, t_lat, t_lng))
+
+
+@pytest.mark.parametrize("n", [10, 1000])
+def test_k_nearest_orders_and_filters(n):
+    points = random_points(n)
+    ranked = sorted(
+        (calculate_distance(33.5, 36.3, lat, lng), i) for i, (lat, lng) in enumerate(points)
+    )
+    within = [i for d, i in ranked if d <= 100]
+
+    result = geo.k_nearest(33.5, 36.3, points, k=5, max_distance_km=100)
+    assert [i for i, _ in result] == within[:5]
+    assert geo.k_nearest(33.5, 36.3, points, max_distance_km=100)[-1][0] == within[-1]
+    assert geo.k_nearest(33.5, 36.3, []) == []
@@ -0,0 +1,67 @@
+"""
+Test Suite for the cached home-feed sections
+- Section versions depend only on content
+- Concurrent misses share one build; invalidation forces a rebuild
+- Sections the client already has are sent without data
+"""
+
+import asyncio
+
+from utils import home_feed
+from utils.home_feed import compact_feed, get_section, invalidate_home_section, parse_known_versions, section_version
+
+
+class TestSectionCache:
+    def setup_method(self):
+        home_feed._sections.clear()
+        home_feed._locks.clear()
+
+    def test_version_is_content_hash(self):
+        assert section_version([{"a": 1, "b": 2}]) == section_version([{"b": 2, "a": 1}])
+        assert section_version([{"a": 1}]) != section_version([{"a": 2}])
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+
+        async def builder():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [{"id": "r1"}]
+
+        async def run():
+            return await asyncio.gather(*[get_section("restaurants", builder, city_id="damascus") for _ in range(5)])
+
+        entries = asyncio.run(run())
+        assert len(calls) == 1
+        assert len({entry["version"] for entry in entries}) == 1
+
+    def test_invalidate_rebuilds_every_city(self):
+        data = {"value": 1}
+
+        async def builder():
+            return dict(data)
+
+        async def run():
+            first = await get_section("restaurants", builder, city_id="homs")
+            data["value"] = 2
+            cached = await get_section("restaurants", builder, city_id="homs")
+            invalidate_home_section("restaurants")
+            rebuilt = await get_section("restaurants", builder, city_id="homs")
+            return first, cached, rebuilt
+
+        first, cached, rebuilt = asyncio.run(run())
+        assert cached["version"] == first["version"]
+        assert rebuilt["data"] == {"value": 2} and rebuilt["version"] != first["version"]
+
+
+class TestCompactFeed:
+    def test_known_sections_are_sent_without_data(self):
+        entries = {
+            "cities": {"version": "v1", "data": ["damascus"]},
+            "settings": {"version": "v2", "data": {"support_phone": "1"}},
+        }
+        known = parse_known_versions("cities:v1, settings:old,bogus")
+        assert known == {"cities": "v1", "settings": "old"}
+        feed = compact_feed(entries, known)
+        assert feed["cities"] == {"version": "v1"}
+        assert feed["settings"] == {"version": "v2", "data": {"support_phone": "1"}}
@@ -0,0 +1,74 @@
+"""
+Test Suite for Idempotency-Key support (runs against a live backend)
+Tests:
+- Retrying a POST with the same key replays the first response
+- Concurrent duplicates execute once
+- Reusing a key with a different payload is rejected
+"""
+
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://expo-food-app.preview.emergentagent.com')
+
+TEST_USER_PHONE = "0912345679"
+TEST_USER_PASSWORD = "test123"
+
+
+@pytest.fixture(scope="module")
+def user_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "phone": TEST_USER_PHONE,
+        "password": TEST_USER_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Test user not available")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def complaint_payload(subject):
+    return {"type": "other", "subject": subject, "message": "TEST idempotency"}
+
+
+class TestIdempotencyKey:
+    """Duplicate POSTs with the same Idempotency-Key"""
+
+    def test_retry_replays_first_response(self, user_headers):
+        headers = {**user_headers, "Idempotency-Key": str(uuid.uuid4())}
+        payload = complaint_payload("TEST retry")
+        first = requests.post(f"{BASE_URL}/api/complaints", json=payload, headers=headers)
+        second = requests.post(f"{BASE_URL}/api/complaints", json=payload, headers=headers)
+        assert first.status_code == 200, first.text
+        assert second.status_code == 200, second.text
+        assert first.json()["complaint_id"] == second.json()["complaint_id"]
+        print("✓ Retry replayed the stored response")
+
+    def test_concurrent_duplicates_execute_once(self, user_headers):
+        headers = {**user_headers, "Idempotency-Key": str(uuid.uuid4())}
+        payload = complaint_payload("TEST concurrent")
+
+        def send(_):
+            return requests.post(f"{BASE_URL}/api/complaints", json=payload, headers=headers)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(send, range(8)))
+        ids = {r.json()["complaint_id"] for r in responses if r.status_code == 200}
+        assert len(ids) == 1, f"Expected one complaint, got {ids}"
+        print(f"✓ 8 concurrent duplicates created a single complaint")
+
+    def test_key_reuse_with_different_payload(self, user_headers):
+        headers = {**user_headers, "Idempotency-Key": str(uuid.uuid4())}
+        first = requests.post(f"{BASE_URL}/api/complaints", json=complaint_payload("TEST a"), headers=headers)
+        assert first.status_code == 200
+        second = requests.post(f"{BASE_URL}/api/complaints", json=complaint_payload("TEST b"), headers=headers)
+        assert second.status_code == 422
+        print("✓ Key reuse with a different body rejected")
+
+    def test_without_key_each_request_executes(self, user_headers):
+        payload = complaint_payload("TEST no key")
+        first = requests.post(f"{BASE_URL}/api/complaints", json=payload, headers=user_headers)
+        second = requests.post(f"{BASE_URL}/api/complaints", json=payload, headers=user_headers)
+        assert first.json()["complaint_id"] != second.json()["complaint_id"]
@@ -0,0 +1,98 @@
+"""
+Test Suite for the Idempotency-Key in-progress lock (in-memory, no server needed)
+- An abandoned lock is taken over only by a retry with the same payload
+- A slow handler keeps its lock fresh and is not executed twice
+- A taken-over holder cannot overwrite the new holder's result
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from utils import idempotency
+from utils.idempotency import run_idempotent
+
+
+@pytest.fixture
+def keys(fake_db, monkeypatch):
+    collection = fake_db(idempotency).idempotency_keys
+    insert_one = collection.insert_one
+
+    async def unique_insert_one(doc):
+        # Unique index on (user_id, key, scope)
+        if await collection.find_one({k: doc[k] for k in ("user_id", "key", "scope")}):
+            raise DuplicateKeyError("duplicate key")
+        return await insert_one(doc)
+    monkeypatch.setattr(collection, "insert_one", unique_insert_one)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_SECONDS", 0.01)
+    return collection
+
+
+def abandoned(fingerprint, age_seconds):
+    now = datetime.utcnow()
+    return {"user_id": "u1", "key": "k1", "scope": "orders", "fingerprint": fingerprint, "status": "in_progress",
+            "lock_id": "crashed", "locked_at": now - timedelta(seconds=age_seconds), "created_at": now}
+
+
+def run(handler, fingerprint="fp-1"):
+    return asyncio.run(run_idempotent("u1", "k1", "orders", handler, fingerprint))
+
+
+def test_abandoned_lock_is_taken_over_by_the_same_payload(keys):
+    keys.docs = [abandoned("fp-1", idempotency.IDEMPOTENCY_LOCK_SECONDS + 1)]
+
+    async def handler():
+        return {"id": "o1"}
+
+    assert run(handler) == {"id": "o1"}
+    assert keys.docs[0]["status"] == "done" and keys.docs[0]["response"] == {"id": "o1"}
+
+
+def test_abandoned_lock_is_not_taken_over_by_a_different_payload(keys):
+    keys.docs = [abandoned("fp-1", idempotency.IDEMPOTENCY_LOCK_SECONDS + 1)]
+    executed = []
+
+    async def handler():
+        executed.append(True)
+
+    with pytest.raises(HTTPException) as e:
+        run(handler, fingerprint="fp-2")
+    assert e.value.status_code == 422
+    assert executed == [] and keys.docs[0]["lock_id"] == "crashed"
+
+
+def test_slow_handler_keeps_its_lock(keys, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_SECONDS", 0.15)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 2)
+    executed = []
+
+    async def slow_handler():
+        executed.append(True)
+        # Several lock periods long
+        await asyncio.sleep(0.6)
+        return {"id": "o1"}
+
+    async def scenario():
+        first = asyncio.create_task(run_idempotent("u1", "k1", "orders", slow_handler, "fp-1"))
+        await asyncio.sleep(0.4)
+        # A retry long after the lock period started waits for the first request instead of running
+        retry = await run_idempotent("u1", "k1", "orders", slow_handler, "fp-1")
+        return await first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first == retry == {"id": "o1"}
+    assert executed == [True]
+
+
+def test_taken_over_holder_cannot_overwrite_the_result(keys, monkeypatch):
+    async def handler():
+        # Meanwhile the lock was taken over by another request
+        keys.docs[0]["lock_id"] = "someone-else"
+        return {"id": "late"}
+
+    assert run(handler) == {"id": "late"}
+    assert keys.docs[0]["status"] == "in_progress"
+    assert "response" not in keys.docs[0]
@@ -0,0 +1,113 @@
+"""
+Test Suite for utils.location_store
+- Ping throttle (distance and max-silence)
+- Flush batching, the users mirror and retry after a failed write
+- Eviction and the freshness window for multi-worker reads
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import location_store
+from utils.location_store import (
+    flush_driver_locations, get_driver_location, get_driver_locations, record_driver_location,
+)
+
+
+@pytest.fixture
+def store(fake_db):
+    fake = fake_db(location_store)
+    location_store._latest.clear()
+    location_store._dirty.clear()
+    yield fake
+    location_store._latest.clear()
+    location_store._dirty.clear()
+
+
+def age(driver_id, seconds, *fields):
+    entry = location_store._latest[driver_id]
+    for field in fields:
+        entry[field] -= timedelta(seconds=seconds)
+
+
+class TestThrottle:
+    def test_small_moves_are_skipped_until_max_silence(self, store):
+        assert record_driver_location("d1", 33.5, 36.3) is True
+        # ~1 m away
+        assert record_driver_location("d1", 33.50001, 36.3) is False
+        # The in-memory position still follows every ping
+        assert location_store._latest["d1"]["lat"] == 33.50001
+        age("d1", location_store.LOCATION_MAX_SILENCE_SECONDS + 1, "accepted_at")
+        assert record_driver_location("d1", 33.50001, 36.3) is True
+
+    def test_real_move_is_accepted(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        assert record_driver_location("d1", 33.51, 36.3) is True
+        assert location_store._latest["d1"]["accepted_lat"] == 33.51
+
+
+class TestFlush:
+    def test_one_bulk_write_for_all_dirty_drivers(self, store):
+        for i in range(5):
+            record_driver_location(f"d{i}", 33.5 + i / 100, 36.3)
+        assert asyncio.run(flush_driver_locations()) == 5
+        assert len(store.driver_locations.writes) == 1 and len(store.driver_locations.writes[0]) == 5
+        assert len(store.users.writes[0]) == 5
+        assert not location_store._dirty
+        assert asyncio.run(flush_driver_locations()) == 0
+
+    def test_users_mirror_is_throttled(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        asyncio.run(flush_driver_locations())
+        record_driver_location("d1", 33.6, 36.3)
+        asyncio.run(flush_driver_locations())
+        assert len(store.driver_locations.writes) == 2
+        assert len(store.users.writes) == 1
+
+    def test_failed_mirror_is_retried(self, store):
+        store.users.fail = True
+        record_driver_location("d1", 33.5, 36.3)
+        assert asyncio.run(flush_driver_locations()) == 0
+        assert "d1" in location_store._dirty
+        assert location_store._latest["d1"]["mirrored_at"] is None
+        store.users.fail = False
+        asyncio.run(flush_driver_locations())
+        assert len(store.users.writes) == 1
+        assert location_store._latest["d1"]["mirrored_at"] is not None
+
+
+class TestEvictionAndFreshness:
+    def test_stale_clean_entries_are_evicted(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        record_driver_location("d2", 33.5, 36.3)
+        asyncio.run(flush_driver_locations())
+        age("d1", location_store.LOCATION_EVICT_SECONDS + 1, "updated_at")
+        age("d2", location_store.LOCATION_EVICT_SECONDS + 1, "updated_at")
+        location_store._dirty.add("d2")
+        location_store._evict_stale_entries()
+        assert "d1" not in location_store._latest
+        assert "d2" in location_store._latest
+
+    def test_fresh_memory_wins(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        store.driver_locations.docs = [{"driver_id": "d1", "lat": 1, "lng": 1, "updated_at": datetime.utcnow()}]
+        assert asyncio.run(get_driver_location("d1"))["lat"] == 33.5
+
+    def test_stale_memory_loses_to_newer_persisted_position(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        age("d1", location_store.LOCATION_MAX_SILENCE_SECONDS + 60, "updated_at")
+        # Another worker has persisted a newer ping
+        store.driver_locations.docs = [{"driver_id": "d1", "lat": 34.0, "lng": 36.0, "updated_at": datetime.utcnow()}]
+        assert asyncio.run(get_driver_location("d1"))["lat"] == 34.0
+        assert asyncio.run(get_driver_locations(["d1"]))["d1"]["lat"] == 34.0
+
+    def test_stale_memory_kept_when_newer_than_persisted(self, store):
+        record_driver_location("d1", 33.5, 36.3)
+        age("d1", location_store.LOCATION_MAX_SILENCE_SECONDS + 60, "updated_at")
+        store.driver_locations.docs = [
+            {"driver_id": "d1", "lat": 34.0, "lng": 36.0, "updated_at": datetime.utcnow() - timedelta(days=1)}
+        ]
+        assert asyncio.run(get_driver_location("d1"))["lat"] == 33.5
+        assert asyncio.run(get_driver_locations(["d1", "d2"])) == {"d1": asyncio.run(get_driver_location("d1"))}
@@ -0,0 +1,90 @@
+"""
+Test Suite for menu import/export parsing
+- CSV and JSON/NDJSON rows are read from a chunked byte stream
+- Row validation against MenuItemCreate / AddOnGroupCreate
+- Export rows round-trip through the import parser
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from utils.menu_io import (
+    CSV_COLUMNS, MenuImportError, csv_line, export_csv_row, export_json_row, export_row,
+    iter_csv_rows, iter_json_rows, validate_row,
+)
+
+
+async def chunked(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def collect(rows):
+    async def run():
+        return [row async for row in rows]
+    return asyncio.run(run())
+
+
+ADDONS = [{"name": "الحجم", "is_required": True, "options": [{"name": "كبير", "price": 2000}]}]
+
+
+def test_csv_rows_with_multiline_field_and_addons():
+    text = (
+        "﻿" + csv_line(["name", "price", "category", "description", "is_available", "addons"])
+        + csv_line(["شاورما", "15000", "سندويش", "سطر أول\nسطر ثاني", "نعم", json.dumps(ADDONS, ensure_ascii=False)])
+        + csv_line(["فلافل", "5000", "سندويش", "", "0", ""])
+    )
+    rows = collect(iter_csv_rows(chunked(text.encode("utf-8"))))
+    assert [n for n, _ in rows] == [1, 2]
+    first = rows[0][1]
+    assert first["description"] == "سطر أول\nسطر ثاني"
+    assert first["is_available"] is True
+    assert first["addons"] == ADDONS
+    assert rows[1][1]["is_available"] is False
+    assert "addons" not in rows[1][1]
+
+
+def test_csv_missing_columns():
+    with pytest.raises(MenuImportError):
+        collect(iter_csv_rows(chunked(b"name,price\nx,1\n")))
+
+
+def test_json_array_and_ndjson():
+    items = [{"name": "a", "price": 1, "category": "c"}, {"name": "b", "price": 2, "category": "c"}]
+    array_rows = collect(iter_json_rows(chunked(json.dumps(items).encode())))
+    ndjson = "\n".join(json.dumps(i) for i in items) + "\n\nnot json\n"
+    ndjson_rows = collect(iter_json_rows(chunked(ndjson.encode())))
+    assert [r for _, r in array_rows] == items
+    assert [r for _, r in ndjson_rows] == items + ["invalid"]
+
+
+def test_validate_row():
+    item, groups, errors = validate_row({"name": "x", "price": "12000", "category": "c", "addons": ADDONS})
+    assert errors == []
+    assert item["price"] == 12000
+    assert groups[0].options[0].price == 2000
+
+    item, groups, errors = validate_row({"name": "x", "category": "c", "addons": [{"name": "g"}]})
+    assert item is None
+    assert any(e.startswith("price") for e in errors)
+    assert any(e.startswith("addons.0.options") for e in errors)
+
+    assert validate_row("invalid")[2]
+
+
+def test_export_round_trip():
+    item = {"id": "i1", "name": "شاورما", "price": 15000.0, "category": "سندويش", "is_available": True}
+    groups = [{"name": "الحجم", "is_required": True, "max_selections": 1,
+               "options": [{"id": "o1", "name": "كبير", "price": 2000}]}]
+    row = export_row(item, groups)
+
+    csv_text = csv_line(CSV_COLUMNS) + export_csv_row(row)
+    [(_, parsed)] = collect(iter_csv_rows(chunked(csv_text.encode("utf-8"))))
+    assert parsed["id"] == "i1"
+    assert validate_row(parsed)[2] == []
+    assert parsed["addons"][0]["options"] == [{"name": "كبير", "price": 2000}]
+
+    [(_, parsed)] = collect(iter_json_rows(chunked(("[" + export_json_row(row) + "]").encode("utf-8"))))
+    assert parsed == row
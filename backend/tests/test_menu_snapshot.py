@@ -0,0 +1,41 @@
+"""
+Test Suite for the versioned menu snapshot
+- Items are grouped by category with their add-on groups embedded
+- Serialized bytes and ETag are stable for the same content and change with the version
+"""
+
+import json
+
+from utils.menu_snapshot import build_menu_document, serialize_menu
+
+ITEMS = [
+    {"id": "m1", "restaurant_id": "r1", "name": "شاورما", "price": 8000, "category": "سندويشات"},
+    {"id": "m2", "restaurant_id": "r1", "name": "بطاطا", "price": 3000, "category": "مقبلات"},
+    {"id": "m3", "restaurant_id": "r1", "name": "فلافل", "price": 4000, "category": "سندويشات"},
+]
+GROUPS = [
+    {"id": "g1", "menu_item_id": "m1", "restaurant_id": "r1", "name": "الحجم",
+     "options": [{"id": "o1", "name": "كبير", "price": 2000}]},
+]
+
+
+class TestMenuDocument:
+    def test_groups_items_by_category_with_addons(self):
+        document = build_menu_document("r1", 3, ITEMS, GROUPS)
+        assert document["version"] == 3
+        assert document["item_count"] == 3
+        categories = {c["name"]: c["items"] for c in document["categories"]}
+        assert [i["id"] for i in categories["سندويشات"]] == ["m1", "m3"]
+        assert [i["id"] for i in categories["مقبلات"]] == ["m2"]
+        shawarma = categories["سندويشات"][0]
+        assert shawarma["addon_groups"][0]["options"][0]["price"] == 2000
+        assert categories["سندويشات"][1]["addon_groups"] == []
+
+    def test_serialized_body_and_etag(self):
+        document = build_menu_document("r1", 3, ITEMS, GROUPS)
+        body, etag = serialize_menu(document)
+        assert json.loads(body)["categories"][0]["items"]
+        assert etag.startswith('"3-') and etag.endswith('"')
+        assert serialize_menu(document) == (body, etag)
+        document["version"] = 4
+        assert serialize_menu(document)[1] != etag
@@ -0,0 +1,46 @@
+"""
+Test Suite for utils.migrations.backfill_order_city_ids
+- Only open orders without a city are stamped
+- Restaurants without a position fall back to their city centre
+"""
+
+import asyncio
+
+import pytest
+
+from utils import migrations
+from utils.migrations import backfill_order_city_ids
+
+
+@pytest.fixture
+def fake(fake_db):
+    db = fake_db(migrations)
+    db.orders.docs = [
+        {"id": "open", "restaurant_id": "r1", "order_status": "preparing"},
+        {"id": "delivered", "restaurant_id": "r1", "order_status": "delivered"},
+        {"id": "cancelled", "restaurant_id": "r1", "order_status": "cancelled"},
+        {"id": "stamped", "restaurant_id": "r1", "order_status": "pending", "city_id": "aleppo"},
+        {"id": "no-position", "restaurant_id": "r2", "order_status": "pending"},
+    ]
+    db.restaurants.docs = [
+        {"id": "r1", "city_id": "damascus", "address": "المزة", "lat": 33.50, "lng": 36.24},
+        {"id": "r2", "city_id": "damascus", "address": "المالكي"},
+    ]
+    return db
+
+
+def test_only_open_orders_are_stamped(fake):
+    assert asyncio.run(backfill_order_city_ids()) == 2
+    orders = {o["id"]: o for o in fake.orders.docs}
+    assert orders["open"]["city_id"] == "damascus"
+    assert (orders["open"]["restaurant_lat"], orders["open"]["restaurant_lng"]) == (33.50, 36.24)
+    assert "city_id" not in orders["delivered"] and "city_id" not in orders["cancelled"]
+    assert orders["stamped"]["city_id"] == "aleppo" and "restaurant_lat" not in orders["stamped"]
+    assert asyncio.run(backfill_order_city_ids()) == 0
+
+
+def test_restaurant_without_position_uses_city_centre(fake):
+    asyncio.run(backfill_order_city_ids())
+    order = next(o for o in fake.orders.docs if o["id"] == "no-position")
+    assert (order["restaurant_lat"], order["restaurant_lng"]) == (33.5138, 36.2765)
+    assert order["restaurant_address"] == "المالكي"
@@ -0,0 +1,92 @@
+"""
+Test Suite for notification retention
+- archive_notifications writes rows expiring within the lead window and marks them once
+- backfill_notification_expiry gives legacy notifications an expires_at
+"""
+
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import migrations, notification_archive
+from utils.notification_archive import archive_notifications
+from utils.notifications import NOTIFICATION_READ_TTL_DAYS, NOTIFICATION_UNREAD_TTL_DAYS
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+
+def notification(notification_id, expires_in_hours, **fields):
+    return {"id": notification_id, "user_id": "u1", "title": "طلب جديد",
+            "expires_at": NOW + timedelta(hours=expires_in_hours), **fields}
+
+
+@pytest.fixture
+def notifications(fake_db):
+    return fake_db(notification_archive, migrations).notifications
+
+
+def read_archive(directory):
+    path = directory / f"notifications-{NOW:%Y%m%d}.ndjson.gz"
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_archives_only_notifications_about_to_expire(notifications, tmp_path, monkeypatch):
+    monkeypatch.setattr(notification_archive, "NOTIFICATION_ARCHIVE_LEAD_HOURS", 24)
+    notifications.docs = [
+        notification("expired", -1),
+        notification("soon", 23),
+        notification("later", 25),
+        notification("done", 2, archived_at=NOW - timedelta(hours=1)),
+    ]
+    assert asyncio.run(archive_notifications(str(tmp_path), now=NOW)) == 2
+
+    rows = read_archive(tmp_path)
+    assert [row["id"] for row in rows] == ["expired", "soon"]
+    assert rows[1]["title"] == "طلب جديد"
+    assert rows[1]["expires_at"] == (NOW + timedelta(hours=23)).isoformat()
+    archived = {d["id"]: d.get("archived_at") for d in notifications.docs}
+    assert archived == {"expired": NOW, "soon": NOW, "later": None, "done": NOW - timedelta(hours=1)}
+
+
+def test_second_run_appends_nothing_twice(notifications, tmp_path, monkeypatch):
+    monkeypatch.setattr(notification_archive, "ARCHIVE_BATCH_SIZE", 2)
+    notifications.docs = [notification(f"n{i}", 1) for i in range(5)]
+    assert asyncio.run(archive_notifications(str(tmp_path), now=NOW)) == 5
+    assert asyncio.run(archive_notifications(str(tmp_path), now=NOW)) == 0
+    notifications.docs.append(notification("n5", 1))
+    assert asyncio.run(archive_notifications(str(tmp_path), now=NOW)) == 1
+    assert [row["id"] for row in read_archive(tmp_path)] == [f"n{i}" for i in range(6)]
+
+
+def test_archiving_is_off_without_a_directory(notifications, monkeypatch):
+    monkeypatch.setattr(notification_archive, "NOTIFICATION_ARCHIVE_DIR", "")
+    notifications.docs = [notification("n1", 1)]
+    assert asyncio.run(archive_notifications(now=NOW)) == 0
+    assert "archived_at" not in notifications.docs[0]
+
+
+def test_backfill_notification_expiry(notifications):
+    created = datetime(2026, 1, 10, 8, 0)
+    notifications.docs = [
+        {"id": "unread", "is_read": False, "created_at": created},
+        {"id": "unread-no-date", "is_read": False},
+        {"id": "read", "is_read": True, "created_at": created},
+        {"id": "has-expiry", "is_read": True, "expires_at": NOW},
+    ]
+    before = datetime.utcnow()
+    assert asyncio.run(migrations.backfill_notification_expiry()) == 3
+    after = datetime.utcnow()
+
+    expires = {d["id"]: d["expires_at"] for d in notifications.docs}
+    assert expires["unread"] == created + timedelta(days=NOTIFICATION_UNREAD_TTL_DAYS)
+    assert before + timedelta(days=NOTIFICATION_UNREAD_TTL_DAYS) <= expires["unread-no-date"]
+    assert expires["unread-no-date"] <= after + timedelta(days=NOTIFICATION_UNREAD_TTL_DAYS)
+    # Read time is unknown, so the read window starts now
+    assert before + timedelta(days=NOTIFICATION_READ_TTL_DAYS) <= expires["read"]
+    assert expires["read"] <= after + timedelta(days=NOTIFICATION_READ_TTL_DAYS)
+    assert expires["has-expiry"] == NOW
+    assert asyncio.run(migrations.backfill_notification_expiry()) == 0
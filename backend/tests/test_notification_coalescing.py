@@ -0,0 +1,36 @@
+"""
+Test Suite for notification coalescing
+- Which notifications share a coalescing key
+- Rapid pushes for one order collapse into an immediate push plus one trailing push
+"""
+
+import asyncio
+
+from utils import notifications
+from utils.notifications import coalesce_key
+
+
+def test_coalesce_key():
+    assert coalesce_key("order_update", {"order_id": "o1", "status": "ready"}) == "order_update:o1"
+    assert coalesce_key("order_update", {"orderId": "o1"}) == "order_update:o1"
+    assert coalesce_key("order_update", None) is None
+    assert coalesce_key("new_order", {"order_id": "o1"}) is None
+
+
+def test_push_burst_is_coalesced(monkeypatch):
+    sent = []
+
+    async def fake_send(user_id, title, body, data=None, channel_id="default"):
+        sent.append(data["status"])
+
+    monkeypatch.setattr(notifications, "send_push_to_user", fake_send)
+    monkeypatch.setattr(notifications, "NOTIFICATION_COALESCE_SECONDS", 0.2)
+    notifications._push_windows.clear()
+
+    async def burst():
+        for status in ["accepted", "preparing", "ready"]:
+            await notifications._send_coalesced_push("u1:order_update:o1", "u1", "t", "b", {"status": status}, "x")
+        await asyncio.sleep(0.3)
+
+    asyncio.run(burst())
+    assert sent == ["accepted", "ready"]
@@ -0,0 +1,59 @@
+"""
+Test Suite for the maintained unread-notification counter (runs against a live backend)
+Tests:
+- unread-count agrees with the notifications list
+- mark-all-read brings the count to zero
+"""
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://expo-food-app.preview.emergentagent.com')
+
+TEST_USER_PHONE = "0912345679"
+TEST_USER_PASSWORD = "test123"
+
+
+@pytest.fixture(scope="module")
+def user_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "phone": TEST_USER_PHONE,
+        "password": TEST_USER_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Test user not available")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class TestUnreadCounter:
+    """GET /api/notifications/unread-count"""
+
+    def test_count_matches_list(self, user_headers):
+        count = requests.get(f"{BASE_URL}/api/notifications/unread-count", headers=user_headers)
+        assert count.status_code == 200
+        listing = requests.get(f"{BASE_URL}/api/notifications", headers=user_headers)
+        assert listing.status_code == 200
+        unread_listed = sum(1 for n in listing.json() if not n["is_read"])
+        # The list is capped at 50, the counter is not
+        assert count.json()["count"] >= min(unread_listed, 50)
+        print(f"✓ Unread count {count.json()['count']}, {unread_listed} unread in list")
+
+    def test_mark_all_read_resets_count(self, user_headers):
+        response = requests.put(f"{BASE_URL}/api/notifications/mark-all-read", headers=user_headers)
+        assert response.status_code == 200
+        count = requests.get(f"{BASE_URL}/api/notifications/unread-count", headers=user_headers)
+        assert count.json()["count"] == 0
+        print("✓ mark-all-read brought the counter to zero")
+
+    def test_mark_read_twice_is_ok(self, user_headers):
+        listing = requests.get(f"{BASE_URL}/api/notifications", headers=user_headers).json()
+        if not listing:
+            pytest.skip("No notifications for test user")
+        notification_id = listing[0]["id"]
+        for _ in range(2):
+            response = requests.put(f"{BASE_URL}/api/notifications/{notification_id}/read", headers=user_headers)
+            assert response.status_code == 200
+        count = requests.get(f"{BASE_URL}/api/notifications/unread-count", headers=user_headers)
+        assert count.json()["count"] >= 0
+        print("✓ Marking an already-read notification does not change the counter")
@@ -0,0 +1,210 @@
+"""
+Test Suite for the order state machine helpers
+- Transition table sanity
+- Stage durations, in Python and as the aggregation expressions used by the statistics
+- transition_order: the compare-and-set update, its 404/409 split and side effects
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from utils import order_state
+from utils.order_state import (
+    ALLOWED_FROM, STATUS_HISTORY_LIMIT, order_event, stage_duration_fields, stage_durations, transition_order,
+)
+
+
+def test_terminal_statuses_cannot_move():
+    for to_status, sources in ALLOWED_FROM.items():
+        assert "delivered" not in sources
+        assert "cancelled" not in sources
+
+
+def test_cannot_cancel_after_pickup():
+    assert "picked_up" not in ALLOWED_FROM["cancelled"]
+    assert "out_for_delivery" not in ALLOWED_FROM["cancelled"]
+
+
+def test_stage_durations():
+    t0 = datetime(2026, 1, 1, 12, 0)
+    stamps = {
+        "pending": t0,
+        "accepted": t0 + timedelta(minutes=2),
+        "ready": t0 + timedelta(minutes=17),
+        "driver_assigned": t0 + timedelta(minutes=10),  # assigned while still preparing
+        "picked_up": t0 + timedelta(minutes=20),
+        "delivered": t0 + timedelta(minutes=35),
+    }
+    durations = stage_durations(stamps)
+    assert durations["accept"] == 120
+    assert durations["prep"] == 15 * 60
+    assert "driver_assign" not in durations
+    assert durations["pickup"] == 10 * 60
+    assert durations["delivery"] == 15 * 60
+    assert durations["total"] == 35 * 60
+
+
+def evaluate(expr, doc):
+    """The few aggregation operators stage_duration_fields uses"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = doc
+        for part in expr[1:].split("."):
+            value = (value or {}).get(part)
+        return value
+    if not isinstance(expr, dict):
+        return expr
+    (op, args), = expr.items()
+    if op == "$cond":
+        return evaluate(args[1] if evaluate(args[0], doc) else args[2], doc)
+    values = [evaluate(a, doc) for a in args]
+    if op == "$and":
+        return all(values)
+    if op == "$gte":
+        # null sorts before any date, as in BSON comparison order
+        if values[0] is None or values[1] is None:
+            return values[1] is None
+        return values[0] >= values[1]
+    if op == "$subtract":
+        return (values[0] - values[1]).total_seconds() * 1000
+    if op == "$divide":
+        return values[0] / values[1]
+    raise NotImplementedError(op)
+
+
+def test_stage_duration_fields_match_stage_durations():
+    t0 = datetime(2026, 1, 1, 12, 0)
+    stamps = {
+        "pending": t0,
+        "accepted": t0 + timedelta(minutes=2),
+        "ready": t0 + timedelta(minutes=17),
+        "driver_assigned": t0 + timedelta(minutes=10),
+        "picked_up": t0 + timedelta(minutes=20),
+    }
+    fields = stage_duration_fields()
+    minutes = {name: evaluate(expr, {"stage_timestamps": stamps}) for name, expr in fields.items()}
+    expected = {name: seconds / 60 for name, seconds in stage_durations(stamps).items()}
+    assert {k: v for k, v in minutes.items() if v is not None} == expected
+    assert minutes["driver_assign"] is None and minutes["delivery"] is None
+
+
+def test_order_event_location_is_optional():
+    event = order_event("picked_up", {"id": "d1", "role": "driver"}, {"lat": 33.5, "lng": 36.3})
+    assert event["actor_role"] == "driver" and event["lat"] == 33.5
+    assert "lat" not in order_event("accepted", {"id": "r1", "role": "restaurant"})
+
+
+T0 = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {"tracking": [], "released": []}
+
+    async def release_coupon(redemption_id):
+        calls["released"].append(redemption_id)
+
+    monkeypatch.setattr(order_state, "update_tracking_order", lambda order: calls["tracking"].append(order["id"]))
+    monkeypatch.setattr(order_state, "release_coupon", release_coupon)
+    return calls
+
+
+@pytest.fixture
+def orders(fake_db, calls):
+    db = fake_db(order_state)
+    db.orders.docs = [{
+        "id": "o1", "user_id": "u1", "restaurant_id": "r1", "order_status": "pending",
+        "stage_timestamps": {"pending": T0}, "status_history": [order_event("pending", at=T0)],
+    }]
+    return db.orders
+
+
+def transition(*args, **kwargs):
+    return asyncio.run(transition_order(*args, **kwargs))
+
+
+def test_transition_updates_status_history_and_stamps(orders, calls):
+    actor = {"id": "owner", "role": "restaurant"}
+    order = transition("o1", "accepted", match={"restaurant_id": "r1"}, actor=actor)
+    assert order["order_status"] == "accepted"
+    assert "_id" not in order
+    assert order["stage_timestamps"]["pending"] == T0
+    assert order["stage_timestamps"]["accepted"] == order["updated_at"]
+    assert [e["status"] for e in order["status_history"]] == ["pending", "accepted"]
+    assert order["status_history"][-1]["actor_role"] == "restaurant"
+    assert orders.docs[0]["order_status"] == "accepted"
+    assert calls["tracking"] == ["o1"]
+
+
+def test_missing_order_is_404_and_lost_race_is_409(orders, calls):
+    with pytest.raises(HTTPException) as e:
+        transition("missing", "accepted")
+    assert e.value.status_code == 404
+    # Another restaurant's order looks missing rather than conflicting
+    with pytest.raises(HTTPException) as e:
+        transition("o1", "accepted", match={"restaurant_id": "r2"})
+    assert e.value.status_code == 404
+    # Invalid transition from the current status
+    with pytest.raises(HTTPException) as e:
+        transition("o1", "delivered")
+    assert e.value.status_code == 409
+    assert "بانتظار القبول" in e.value.detail
+    # A guard that another request already broke (e.g. a driver took the order first)
+    orders.docs[0]["driver_id"] = "d2"
+    with pytest.raises(HTTPException) as e:
+        transition("o1", "driver_assigned", conditions={"driver_id": None}, conflict_detail="تم أخذ الطلب")
+    assert (e.value.status_code, e.value.detail) == (409, "تم أخذ الطلب")
+    assert orders.docs[0]["order_status"] == "pending"
+    assert calls["tracking"] == []
+    with pytest.raises(HTTPException) as e:
+        transition("o1", "unknown")
+    assert e.value.status_code == 400
+
+
+def test_from_statuses_and_allow_same(orders):
+    with pytest.raises(HTTPException) as e:
+        transition("o1", "preparing", from_statuses=["accepted"])
+    assert e.value.status_code == 409
+    transition("o1", "preparing")
+    with pytest.raises(HTTPException):
+        transition("o1", "preparing")
+    first = orders.docs[0]["stage_timestamps"]["preparing"]
+    order = transition("o1", "preparing", allow_same=True)
+    # $min keeps the first time the status was reached; the repeat is still logged
+    assert order["stage_timestamps"]["preparing"] == first
+    assert [e["status"] for e in order["status_history"]].count("preparing") == 2
+
+
+def test_history_is_capped(orders):
+    for _ in range(STATUS_HISTORY_LIMIT + 10):
+        transition("o1", "preparing", allow_same=True)
+    history = orders.docs[0]["status_history"]
+    assert len(history) == STATUS_HISTORY_LIMIT
+    # The oldest events are dropped first
+    assert history[0]["status"] == "preparing"
+
+
+def test_set_unset_and_add_to_set_fields(orders):
+    orders.docs[0]["offered_driver_id"] = "d1"
+    order = transition(
+        "o1", "driver_assigned",
+        set_fields={"driver_id": "d1"}, unset_fields={"offered_driver_id": ""},
+        add_to_set={"declined_driver_ids": "d9"},
+    )
+    assert order["driver_id"] == "d1"
+    assert "offered_driver_id" not in order
+    assert order["declined_driver_ids"] == ["d9"]
+
+
+def test_cancel_releases_the_coupon(orders, calls):
+    orders.docs[0]["coupon_redemption_id"] = "red-1"
+    transition("o1", "accepted")
+    assert calls["released"] == []
+    transition("o1", "cancelled")
+    assert calls["released"] == ["red-1"]
+    # Cancelling again is rejected, so the coupon is not released twice
+    with pytest.raises(HTTPException):
+        transition("o1", "cancelled")
+    assert calls["released"] == ["red-1"]
@@ -0,0 +1,59 @@
+"""
+Test Suite for batched Expo push delivery
+Sends through send_push_batch against a local stand-in for the Expo push endpoint
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from utils import notifications
+
+
+@pytest.fixture
+def expo_stub(monkeypatch):
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests_seen.append(body)
+            tickets = [{"status": "ok", "id": m["to"]} for m in body]
+            payload = json.dumps({"data": tickets}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(notifications, "EXPO_PUSH_URL", f"http://127.0.0.1:{server.server_port}/push/send")
+    recorded = []
+
+    async def record(messages, tickets):
+        recorded.append((messages, tickets))
+
+    # Ticket bookkeeping writes to Mongo; receipt handling is tested in test_push_receipts
+    monkeypatch.setattr(notifications, "record_push_tickets", record)
+    yield requests_seen
+    server.shutdown()
+
+
+def test_messages_are_sent_in_chunks(expo_stub):
+    messages = [notifications._push_message(f"ExponentPushToken[{i}]", "t", "b") for i in range(250)]
+    tickets = asyncio.run(notifications.send_push_batch(messages))
+    assert [len(r) for r in expo_stub] == [100, 100, 50]
+    assert [t["id"] for t in tickets] == [m["to"] for m in messages]
+
+
+def test_empty_batch_makes_no_request(expo_stub):
+    assert asyncio.run(notifications.send_push_batch([])) == []
+    assert expo_stub == []
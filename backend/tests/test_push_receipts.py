@@ -0,0 +1,130 @@
+"""
+Test Suite for Expo push receipt processing
+Fetches receipts from a local stand-in for the Expo receipts endpoint and classifies them
+- Concurrent workers claim disjoint batches, so receipts are fetched and counted once
+- Tickets still waiting for a receipt do not hold back newer ones
+"""
+
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import httpx
+import pytest
+
+from utils import push_receipts
+from utils.push_receipts import classify_receipts, process_push_receipts
+
+RECEIPTS = {
+    "t-ok": {"status": "ok"},
+    "t-dead": {"status": "error", "message": "not registered", "details": {"error": "DeviceNotRegistered"}},
+    "t-too-big": {"status": "error", "message": "too big", "details": {"error": "MessageTooBig"}},
+}
+
+
+@pytest.fixture
+def receipts_stub(monkeypatch):
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            ids = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["ids"]
+            seen.append(ids)
+            payload = json.dumps({"data": {i: RECEIPTS[i] for i in ids if i in RECEIPTS}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(push_receipts, "EXPO_RECEIPTS_URL", f"http://127.0.0.1:{server.server_port}/getReceipts")
+    yield seen
+    server.shutdown()
+
+
+def ticket(ticket_id, token, age_minutes, channel="order-updates"):
+    return {"ticket_id": ticket_id, "token": token, "channel_id": channel,
+            "created_at": NOW - timedelta(minutes=age_minutes)}
+
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+
+def test_receipts_are_classified(receipts_stub):
+    tickets = [
+        ticket("t-ok", "tok-1", 20),
+        ticket("t-dead", "tok-2", 20),
+        ticket("t-too-big", "tok-3", 20, channel="new-orders"),
+        ticket("t-pending", "tok-4", 20),
+        ticket("t-lost", "tok-5", 24 * 60),
+    ]
+
+    async def fetch():
+        async with httpx.AsyncClient() as client:
+            return await push_receipts._fetch_receipts(client, [t["ticket_id"] for t in tickets])
+
+    receipts = asyncio.run(fetch())
+    assert receipts_stub == [[t["ticket_id"] for t in tickets]]
+
+    done, counts, dead = classify_receipts(tickets, receipts, NOW)
+    assert set(done) == {"t-ok", "t-dead", "t-too-big", "t-lost"}
+    assert dead == {"tok-2"}
+    assert counts["order-updates"] == {"delivered": 1, "failed": 1}
+    assert counts["new-orders"] == {"delivered": 0, "failed": 1}
+
+
+@pytest.fixture
+def fake(fake_db):
+    db = fake_db(push_receipts)
+    db.push_tokens.docs = [{"token": f"tok-{i}", "is_active": True} for i in range(1, 5)]
+    return db
+
+
+def test_concurrent_workers_count_each_ticket_once(receipts_stub, fake, monkeypatch):
+    monkeypatch.setattr(push_receipts, "RECEIPT_BATCH_SIZE", 2)
+    fake.push_tickets.docs = [
+        ticket("t-ok", "tok-1", 30), ticket("t-dead", "tok-2", 25), ticket("t-too-big", "tok-3", 20),
+    ]
+    update_many = fake.push_tickets.update_many
+
+    async def racing_update_many(*args, **kwargs):
+        # Let the other worker read the same candidates before this claim lands
+        await asyncio.sleep(0)
+        return await update_many(*args, **kwargs)
+    monkeypatch.setattr(fake.push_tickets, "update_many", racing_update_many)
+
+    async def run():
+        return await asyncio.gather(process_push_receipts(NOW), process_push_receipts(NOW))
+
+    summaries = asyncio.run(run())
+    fetched = [i for ids in receipts_stub for i in ids]
+    assert sorted(fetched) == ["t-dead", "t-ok", "t-too-big"]
+    assert sum(s["checked"] for s in summaries) == 3
+    stats = {d["channel_id"]: d for d in fake.push_delivery_stats.docs}
+    assert (stats["order-updates"]["delivered"], stats["order-updates"]["failed"]) == (1, 2)
+    assert sum(s["deactivated"] for s in summaries) == 1
+    assert fake.push_tickets.docs == []
+
+
+def test_pending_tickets_do_not_block_newer_ones(receipts_stub, fake, monkeypatch):
+    monkeypatch.setattr(push_receipts, "RECEIPT_BATCH_SIZE", 2)
+    fake.push_tickets.docs = [
+        ticket("t-pending-1", "tok-1", 40), ticket("t-pending-2", "tok-2", 35), ticket("t-ok", "tok-3", 20),
+    ]
+    summary = asyncio.run(process_push_receipts(NOW))
+    assert summary["ok"] == 1
+    assert [t["ticket_id"] for t in fake.push_tickets.docs] == ["t-pending-1", "t-pending-2"]
+
+    # Still claimed on the next run, retried once the claim expires
+    assert asyncio.run(process_push_receipts(NOW))["checked"] == 0
+    assert len(receipts_stub) == 2
+    later = NOW + timedelta(seconds=push_receipts.PUSH_RECEIPT_CLAIM_SECONDS)
+    asyncio.run(process_push_receipts(later))
+    assert receipts_stub[-1] == ["t-pending-1", "t-pending-2"]
@@ -0,0 +1,51 @@
+"""
+Test Suite for the cached owner-to-restaurant dependency
+- One lookup per owner while the cache is fresh; invalidation forces a re-read
+- Callers get a copy they can modify
+- Non-owners and owners without a restaurant are rejected
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from utils import restaurant_owner
+from utils.restaurant_owner import get_current_restaurant, invalidate_restaurant
+
+
+@pytest.fixture
+def restaurants(fake_db):
+    fake = fake_db(restaurant_owner).restaurants
+    fake.docs = [{"id": "r1", "owner_id": "u1", "is_open": True, "payment_methods": [{"method": "cod"}]}]
+    restaurant_owner._cache.clear()
+    return fake
+
+
+OWNER = {"id": "u1", "role": "restaurant"}
+
+
+def test_cached_until_invalidated(restaurants):
+    first = asyncio.run(get_current_restaurant(OWNER))
+    second = asyncio.run(get_current_restaurant(OWNER))
+    assert first == second and restaurants.reads == 1
+
+    restaurants.docs[0]["is_open"] = False
+    invalidate_restaurant("r1")
+    assert asyncio.run(get_current_restaurant(OWNER))["is_open"] is False
+    assert restaurants.reads == 2
+
+
+def test_callers_get_a_copy(restaurants):
+    restaurant = asyncio.run(get_current_restaurant(OWNER))
+    restaurant["payment_methods"].append({"method": "sham_cash"})
+    assert asyncio.run(get_current_restaurant(OWNER))["payment_methods"] == [{"method": "cod"}]
+
+
+def test_rejects_non_owners(restaurants):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_current_restaurant({"id": "u1", "role": "customer"}))
+    assert e.value.status_code == 403
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_current_restaurant({"id": "u2", "role": "restaurant"}))
+    assert e.value.status_code == 404
@@ -0,0 +1,96 @@
+"""
+Test Suite for utils.spatial
+Checks the k-d tree lookups against a brute-force scan with calculate_distance
+"""
+
+import random
+
+import pytest
+
+from utils.helpers import calculate_distance
+from utils.spatial import DISTRICT_MAX_DISTANCE_KM, CityLocator, KDTree
+
+
+def make_cities(n_cities, n_districts, seed=7):
+    rng = random.Random(seed)
+    cities = []
+    for c in range(n_cities):
+        lat, lng = 32.5 + rng.uniform(0, 4.5), 35.7 + rng.uniform(0, 6)
+        cities.append({
+            "id": f"c{c}", "lat": lat, "lng": lng,
+            "districts": [
+                {"id": f"c{c}-d{d}", "lat": lat + rng.uniform(-0.1, 0.1), "lng": lng + rng.uniform(-0.1, 0.1)}
+                for d in range(n_districts)
+            ],
+        })
+    return cities
+
+
+def brute_force(entries, lat, lng):
+    return min(entries, key=lambda e: calculate_distance(lat, lng, e["lat"], e["lng"]))
+
+
+@pytest.mark.parametrize("n_cities,n_districts", [(3, 4), (14, 12), (60, 30)])
+def test_locate_matches_brute_force(n_cities, n_districts):
+    cities = make_cities(n_cities, n_districts)
+    locator = CityLocator(cities)
+    rng = random.Random(n_cities)
+    for _ in range(300):
+        lat, lng = 32.3 + rng.uniform(0, 5), 35.5 + rng.uniform(0, 6.5)
+        result = locator.locate(lat, lng)
+
+        city = brute_force(cities, lat, lng)
+        city_distance = calculate_distance(lat, lng, city["lat"], city["lng"])
+        # Ties are allowed to resolve either way; the distance must be the minimum
+        assert result["city_distance_km"] == pytest.approx(city_distance)
+        if result["city"]["id"] != city["id"]:
+            city = result["city"]
+
+        district = brute_force(city["districts"], lat, lng)
+        district_distance = calculate_distance(lat, lng, district["lat"], district["lng"])
+        if district_distance > DISTRICT_MAX_DISTANCE_KM:
+            assert result["district"] is None and result["district_distance_km"] is None
+        else:
+            assert result["district_distance_km"] == pytest.approx(district_distance)
+
+
+def test_empty_tree_and_locator():
+    assert KDTree([]).nearest(33.5, 36.3) == (None, float("inf"))
+    assert CityLocator([]).locate(33.5, 36.3) == {
+        "city": None, "city_distance_km": float("inf"), "district": None, "district_distance_km": None,
+    }
+
+
+def test_city_without_districts():
+    locator = CityLocator([{"id": "damascus", "lat": 33.5138, "lng": 36.2765}])
+    result = locator.locate(33.52, 36.28)
+    assert result["city"]["id"] == "damascus"
+    assert result["district"] is None
+    assert locator.nearest_district("missing", 33.52, 36.28) == (None, float("inf"))
+
+
+def test_single_point():
+    tree = KDTree([(33.5138, 36.2765, "damascus")])
+    for lat, lng in [(33.5138, 36.2765), (36.2, 37.15), (-33.9, 151.2)]:
+        payload, distance = tree.nearest(lat, lng)
+        assert payload == "damascus"
+        assert distance == pytest.approx(calculate_distance(lat, lng, 33.5138, 36.2765))
+    assert tree.nearest(33.5138, 36.2765)[1] == pytest.approx(0, abs=1e-9)
+
+
+def test_districts_without_coordinates_are_skipped():
+    locator = CityLocator([{
+        "id": "c", "lat": 33.5, "lng": 36.3,
+        "districts": [{"id": "no-coords"}, {"id": "d", "lat": 33.51, "lng": 36.31}],
+    }])
+    assert locator.locate(33.5, 36.3)["district"]["id"] == "d"
+    assert locator.get_district("c", "no-coords") == {"id": "no-coords"}
+
+
+def test_position_or_centre():
+    locator = CityLocator([{"id": "damascus", "lat": 33.5138, "lng": 36.2765}])
+    assert locator.position_or_centre("damascus", 33.5, 36.3) == (33.5, 36.3)
+    assert locator.position_or_centre("damascus", None, None) == (33.5138, 36.2765)
+    assert locator.position_or_centre("damascus", 33.5, 0) == (33.5138, 36.2765)
+    assert locator.position_or_centre("missing", None, None) == (None, None)
+    assert locator.position_or_centre(None, None, 36.3) == (None, 36.3)
@@ -0,0 +1,111 @@
+"""
+Test Suite for utils.tracking
+- Snapshots are served from memory until they expire
+- update_tracking_order refreshes the order and drops the driver when it changes
+- Restaurant position falls back to the restaurant document for older orders
+- Driver position: fresh in-memory pings, otherwise a TTL-bounded read
+- The snapshot table never grows past MAX_SNAPSHOTS
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from utils import tracking
+from utils.tracking import get_tracking_snapshot, update_tracking_order
+
+
+ORDER = {
+    "id": "o1", "user_id": "u1", "restaurant_id": "r1", "driver_id": "d1", "order_status": "driver_assigned",
+    "restaurant_lat": 33.51, "restaurant_lng": 36.29,
+}
+
+
+@pytest.fixture
+def fake(monkeypatch, fake_db):
+    db = fake_db(tracking)
+    db.orders.docs = [dict(ORDER)]
+    db.users.docs = [{"id": "d1", "name": "سائق"}, {"id": "d2", "name": "سائق 2"}]
+    db.restaurants.docs = [{"id": "r1", "lat": 33.6, "lng": 36.4}]
+    state = SimpleNamespace(db=db, peek=None, reads=[])
+
+    async def get_driver_location(driver_id):
+        state.reads.append(driver_id)
+        return {"lat": 33.0, "lng": 36.0, "updated_at": datetime.utcnow()}
+
+    monkeypatch.setattr(tracking, "peek_driver_location", lambda driver_id: state.peek)
+    monkeypatch.setattr(tracking, "get_driver_location", get_driver_location)
+    tracking._snapshots.clear()
+    yield state
+    tracking._snapshots.clear()
+
+
+def snapshot(order_id="o1"):
+    return asyncio.run(get_tracking_snapshot(order_id))
+
+
+def test_snapshot_is_cached_until_ttl(fake):
+    snapshot()
+    snapshot()
+    assert fake.db.orders.reads == 1 and fake.db.users.reads == 1
+    tracking._snapshots["o1"]["built_at"] -= timedelta(seconds=tracking.TRACKING_SNAPSHOT_TTL_SECONDS + 1)
+    snapshot()
+    assert fake.db.orders.reads == 2
+    assert snapshot("missing") is None
+
+
+def test_driver_change_resets_driver(fake):
+    assert snapshot()["driver"]["name"] == "سائق"
+    update_tracking_order(dict(ORDER, driver_id="d2", order_status="picked_up"))
+    snap = tracking._snapshots["o1"]
+    assert snap["order"]["order_status"] == "picked_up"
+    assert snap["driver"] is None and snap["location"] is None
+    assert snapshot()["driver"]["name"] == "سائق 2"
+
+
+def test_restaurant_position_fallback(fake):
+    fake.db.orders.docs = [{k: v for k, v in ORDER.items() if not k.startswith("restaurant_l")}]
+    snap = snapshot()
+    assert (snap["order"]["restaurant_lat"], snap["order"]["restaurant_lng"]) == (33.6, 36.4)
+    # Refreshing from an order without the fields keeps the looked-up position
+    update_tracking_order(fake.db.orders.docs[0])
+    assert tracking._snapshots["o1"]["order"]["restaurant_lat"] == 33.6
+    tracking._snapshots["o1"]["built_at"] -= timedelta(seconds=tracking.TRACKING_SNAPSHOT_TTL_SECONDS + 1)
+    snapshot()
+    assert fake.db.restaurants.reads == 1
+
+
+def test_fresh_ping_in_memory_is_used(fake):
+    fake.peek = {"lat": 34.0, "lng": 37.0, "updated_at": datetime.utcnow()}
+    assert snapshot()["location"] == {"lat": 34.0, "lng": 37.0}
+    assert fake.reads == []
+
+
+def test_stale_ping_falls_back_to_ttl_read(fake):
+    fake.peek = {"lat": 34.0, "lng": 37.0, "updated_at": datetime.utcnow() - timedelta(minutes=10)}
+    assert snapshot()["location"] == {"lat": 33.0, "lng": 36.0}
+    snapshot()
+    assert fake.reads == ["d1"]
+    tracking._snapshots["o1"]["location_read_at"] -= timedelta(seconds=tracking.TRACKING_LOCATION_TTL_SECONDS + 1)
+    snapshot()
+    assert fake.reads == ["d1", "d1"]
+
+
+def test_snapshot_table_is_capped(fake, monkeypatch):
+    monkeypatch.setattr(tracking, "MAX_SNAPSHOTS", 3)
+    fake.db.orders.docs = [dict(ORDER, id=f"o{i}") for i in range(10)]
+    for i in range(10):
+        snapshot(f"o{i}")
+        assert len(tracking._snapshots) <= 3
+    assert "o9" in tracking._snapshots
+
+    # Expired entries are dropped first, fresh ones are kept when there is room
+    monkeypatch.setattr(tracking, "MAX_SNAPSHOTS", 2)
+    tracking._snapshots.clear()
+    snapshot("o1")
+    snapshot("o2")
+    tracking._snapshots["o1"]["built_at"] -= timedelta(seconds=tracking.TRACKING_SNAPSHOT_TTL_SECONDS + 1)
+    snapshot("o3")
+    assert set(tracking._snapshots) == {"o2", "o3"}
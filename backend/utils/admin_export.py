@@ -0,0 +1,85 @@
+"""Streaming CSV/NDJSON exports of admin collections (optionally gzip-compressed)"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+EXPORT_BATCH_SIZE = 1000
+# Rows are buffered into chunks of roughly this size before being sent (and compressed)
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Exported columns per collection; anything else (password hashes, order items, tokens) is never read
+EXPORT_COLUMNS = {
+    "orders": [
+        "id", "created_at", "city_id", "restaurant_id", "restaurant_name", "user_id", "driver_id",
+        "driver_type", "delivery_mode", "order_status", "payment_method", "payment_status",
+        "subtotal", "delivery_fee", "discount", "total", "coupon_code", "item_count",
+    ],
+    "users": ["id", "created_at", "name", "phone", "role", "city_id", "is_active"],
+    "complaints": [
+        "id", "created_at", "type", "status", "subject", "message", "user_id", "user_name",
+        "user_phone", "order_id", "restaurant_id", "driver_id", "admin_response", "updated_at",
+    ],
+}
+
+
+def export_projection(kind: str) -> dict:
+    projection = {"_id": 0, **{column: 1 for column in EXPORT_COLUMNS[kind]}}
+    if kind == "orders":
+        # item_count is derived; only the quantities are read
+        projection.pop("item_count")
+        projection["items.quantity"] = 1
+    return projection
+
+
+def export_row(kind: str, doc: dict) -> dict:
+    if kind == "orders":
+        doc["item_count"] = sum(item.get("quantity", 1) for item in doc.pop("items", None) or [])
+    return {column: doc.get(column) for column in EXPORT_COLUMNS[kind]}
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_row(columns: list, row: dict) -> str:
+    out = io.StringIO()
+    csv.writer(out).writerow(["" if row.get(c) is None else _value(row.get(c)) for c in columns])
+    return out.getvalue()
+
+
+def ndjson_row(row: dict) -> str:
+    return json.dumps({k: _value(v) for k, v in row.items()}, ensure_ascii=False, default=str) + "\n"
+
+
+async def stream_export(kind: str, cursor, fmt: str, compress: bool = False):
+    """Async generator of response chunks; holds one cursor batch and one output chunk at a time"""
+    columns = EXPORT_COLUMNS[kind]
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    buffer = []
+    size = 0
+    if fmt == "csv":
+        # BOM so spreadsheet apps open the Arabic text as UTF-8
+        buffer.append("\ufeff" + csv_row(columns, {c: c for c in columns}))
+    async for doc in cursor:
+        line = csv_row(columns, export_row(kind, doc)) if fmt == "csv" else ndjson_row(export_row(kind, doc))
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = encode("".join(buffer))
+            buffer, size = [], 0
+            if chunk:
+                yield chunk
+    chunk = encode("".join(buffer))
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,155 @@
+"""Driver breadcrumb history stored as time-bucketed point arrays with downsampling tiers"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from database import db
+
+logger = logging.getLogger("server")
+
+# Each bucket document holds the points of one driver for this many minutes
+BREADCRUMB_BUCKET_MINUTES = int(os.environ.get("BREADCRUMB_BUCKET_MINUTES", "10"))
+# Full (seconds-level) resolution is kept this long, then buckets are downsampled
+BREADCRUMB_RAW_RETENTION_HOURS = int(os.environ.get("BREADCRUMB_RAW_RETENTION_HOURS", "48"))
+# Downsampled buckets keep one point per this many seconds
+BREADCRUMB_DOWNSAMPLE_SECONDS = int(os.environ.get("BREADCRUMB_DOWNSAMPLE_SECONDS", "60"))
+# Buckets are removed by the TTL index after this many days
+BREADCRUMB_RETENTION_DAYS = int(os.environ.get("BREADCRUMB_RETENTION_DAYS", "30"))
+BREADCRUMB_FLUSH_INTERVAL_SECONDS = float(os.environ.get("BREADCRUMB_FLUSH_INTERVAL_SECONDS", "5"))
+BREADCRUMB_COMPACT_INTERVAL_SECONDS = float(os.environ.get("BREADCRUMB_COMPACT_INTERVAL_SECONDS", "3600"))
+# Hard cap on points returned by a single route query
+MAX_ROUTE_POINTS = 5000
+
+# Buckets are aligned to the Unix epoch so any bucket length (e.g. 7 or 90 minutes) floors consistently
+_EPOCH = datetime(1970, 1, 1)
+
+# Points not yet flushed: driver_id -> [(timestamp, lat, lng), ...]
+_pending = {}
+
+
+def bucket_start_for(ts: datetime) -> datetime:
+    """Floor a timestamp to the start of its bucket"""
+    size = timedelta(minutes=BREADCRUMB_BUCKET_MINUTES)
+    return _EPOCH + (ts - _EPOCH) // size * size
+
+
+def record_breadcrumb(driver_id: str, lat: float, lng: float, ts: datetime = None):
+    """Buffer one breadcrumb point for the next flush"""
+    _pending.setdefault(driver_id, []).append((ts or datetime.utcnow(), lat, lng))
+
+
+def downsample_points(points: list, interval_seconds: int) -> list:
+    """Keep the first point of every interval (points are [ts, lat, lng] sorted by ts)"""
+    result = []
+    last_slot = None
+    for point in points:
+        slot = int(point[0].timestamp()) // interval_seconds
+        if slot != last_slot:
+            result.append(point)
+            last_slot = slot
+    return result
+
+
+async def flush_breadcrumbs() -> int:
+    """Append buffered points to their bucket documents with one bulk_write"""
+    if not _pending:
+        return 0
+    pending = dict(_pending)
+    _pending.clear()
+
+    # Group points by (driver, bucket) so each bucket is one $push
+    buckets = {}
+    for driver_id, points in pending.items():
+        for ts, lat, lng in points:
+            buckets.setdefault((driver_id, bucket_start_for(ts)), []).append([ts, lat, lng])
+
+    ops = []
+    for (driver_id, bucket_start), points in buckets.items():
+        ops.append(UpdateOne(
+            {"driver_id": driver_id, "bucket_start": bucket_start},
+            {
+                "$push": {"points": {"$each": points}},
+                "$inc": {"count": len(points)},
+                "$setOnInsert": {
+                    "resolution": "raw",
+                    "expires_at": bucket_start + timedelta(days=BREADCRUMB_RETENTION_DAYS),
+                },
+            },
+            upsert=True,
+        ))
+    try:
+        await db.driver_breadcrumbs.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to flush breadcrumbs: {e}")
+        for driver_id, points in pending.items():
+            _pending.setdefault(driver_id, [])[:0] = points
+        return 0
+    return sum(len(points) for points in pending.values())
+
+
+async def compact_breadcrumbs() -> int:
+    """Downsample raw buckets that are older than the raw retention window"""
+    cutoff = datetime.utcnow() - timedelta(hours=BREADCRUMB_RAW_RETENTION_HOURS)
+    cursor = db.driver_breadcrumbs.find(
+        {"resolution": "raw", "bucket_start": {"$lt": cutoff}},
+        {"_id": 1, "points": 1},
+    ).batch_size(200)
+
+    ops = []
+    compacted = 0
+    async for bucket in cursor:
+        points = sorted(bucket.get("points", []), key=lambda p: p[0])
+        points = downsample_points(points, BREADCRUMB_DOWNSAMPLE_SECONDS)
+        ops.append(UpdateOne(
+            {"_id": bucket["_id"]},
+            {"$set": {"points": points, "count": len(points), "resolution": "downsampled"}}
+        ))
+        if len(ops) >= 500:
+            await db.driver_breadcrumbs.bulk_write(ops, ordered=False)
+            compacted += len(ops)
+            ops = []
+    if ops:
+        await db.driver_breadcrumbs.bulk_write(ops, ordered=False)
+        compacted += len(ops)
+    if compacted:
+        logger.info(f"Downsampled {compacted} breadcrumb buckets")
+    return compacted
+
+
+async def get_driver_route(driver_id: str, start: datetime, end: datetime) -> list:
+    """Breadcrumb points of a driver between start and end, oldest first"""
+    buckets = await db.driver_breadcrumbs.find(
+        {"driver_id": driver_id, "bucket_start": {"$gte": bucket_start_for(start), "$lte": end}},
+        {"_id": 0, "points": 1},
+    ).sort("bucket_start", 1).to_list(None)
+
+    points = [p for bucket in buckets for p in bucket.get("points", [])]
+    # Include points of this worker that have not been flushed yet
+    points.extend([list(p) for p in _pending.get(driver_id, [])])
+    points = [p for p in points if start <= p[0] <= end]
+    points.sort(key=lambda p: p[0])
+    if len(points) > MAX_ROUTE_POINTS:
+        step = len(points) / MAX_ROUTE_POINTS
+        points = [points[int(i * step)] for i in range(MAX_ROUTE_POINTS)]
+    return [{"t": ts.isoformat(), "lat": lat, "lng": lng} for ts, lat, lng in points]
+
+
+async def run_breadcrumb_flusher():
+    """Background loop that persists buffered breadcrumbs"""
+    while True:
+        await asyncio.sleep(BREADCRUMB_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_breadcrumbs()
+        except Exception as e:
+            logger.error(f"Breadcrumb flusher error: {e}")
+
+
+async def run_breadcrumb_compactor():
+    """Background loop that applies the downsampling tier"""
+    while True:
+        try:
+            await compact_breadcrumbs()
+        except Exception as e:
+            logger.error(f"Breadcrumb compactor error: {e}")
+        await asyncio.sleep(BREADCRUMB_COMPACT_INTERVAL_SECONDS)
@@ -0,0 +1,225 @@
+"""Coupon checks and atomic redemption shared by order placement and the coupon endpoints"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from database import db
+
+logger = logging.getLogger("server")
+
+COUPON_SWEEP_INTERVAL_SECONDS = float(os.environ.get("COUPON_SWEEP_INTERVAL_SECONDS", "300"))
+# Coupons deactivated by the sweeper are moved to coupons_archive after this many days
+COUPON_ARCHIVE_AFTER_DAYS = int(os.environ.get("COUPON_ARCHIVE_AFTER_DAYS", "30"))
+
+
+def normalize_code(code: str) -> str:
+    return (code or "").upper().strip()
+
+
+def parse_expiry(value):
+    """Admin-supplied expiry (ISO string or datetime) as a naive UTC datetime; None means never"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime):
+        exp = value
+    else:
+        try:
+            exp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="تاريخ انتهاء الصلاحية غير صالح")
+    if exp.tzinfo is not None:
+        exp = exp.astimezone(timezone.utc).replace(tzinfo=None)
+    return exp
+
+
+def serialize_coupon(coupon: dict) -> dict:
+    """API shape: expires_at keeps being returned as an ISO string"""
+    if isinstance(coupon.get("expires_at"), datetime):
+        coupon["expires_at"] = coupon["expires_at"].replace(tzinfo=timezone.utc).isoformat()
+    return coupon
+
+
+def coupon_expired(coupon: dict) -> bool:
+    expires_at = coupon.get("expires_at")
+    if not expires_at:
+        return False
+    if not isinstance(expires_at, datetime):
+        # Not yet migrated
+        try:
+            expires_at = parse_expiry(expires_at)
+        except HTTPException:
+            return False
+    return datetime.utcnow() > expires_at
+
+
+def _not_expired(now: datetime) -> dict:
+    return {"$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]}
+
+
+def _under_max_uses() -> dict:
+    return {"$or": [
+        {"max_uses": {"$in": [None, 0]}},
+        {"$expr": {"$lt": ["$used_count", "$max_uses"]}},
+    ]}
+
+
+def check_coupon(coupon: dict, subtotal: float):
+    """Raise the user-facing error if the coupon cannot be applied to this subtotal"""
+    if coupon.get("max_uses") and coupon.get("used_count", 0) >= coupon["max_uses"]:
+        raise HTTPException(status_code=400, detail="تم استنفاد عدد مرات استخدام هذا الكوبون")
+    if coupon_expired(coupon):
+        raise HTTPException(status_code=400, detail="انتهت صلاحية هذا الكوبون")
+    if coupon.get("min_order") and subtotal is not None and subtotal < coupon["min_order"]:
+        raise HTTPException(status_code=400, detail=f"الحد الأدنى للطلب {coupon['min_order']} ل.س")
+
+
+def compute_discount(coupon: dict, subtotal: float, delivery_fee: float = 0) -> float:
+    """Amount taken off the order total"""
+    subtotal = subtotal or 0
+    if coupon["discount_type"] == "percentage":
+        return int(subtotal * coupon["discount_value"] / 100)
+    if coupon["discount_type"] == "fixed":
+        return min(coupon["discount_value"], subtotal)
+    if coupon["discount_type"] == "free_delivery":
+        return delivery_fee
+    return 0
+
+
+def _usable_filter(coupon: dict) -> dict:
+    """Conditions re-checked by the $inc itself: still active, not expired and under max_uses"""
+    return {
+        "id": coupon["id"],
+        "is_active": True,
+        "$and": [_not_expired(datetime.utcnow()), _under_max_uses()],
+    }
+
+
+def _reactivate_filter(coupon_id: str, now: datetime) -> dict:
+    """A coupon the sweeper switched off as exhausted that is usable again (under max_uses, not expired)"""
+    return {
+        "id": coupon_id,
+        "is_active": False,
+        "deactivated_reason": "exhausted",
+        "$and": [_under_max_uses(), _not_expired(now)],
+    }
+
+
+async def find_usable_coupon(code: str = None, coupon_id: str = None) -> dict:
+    """Active, unexpired coupon by code or id (one indexed query); raises the matching error otherwise"""
+    query = {"id": coupon_id} if coupon_id else {"code": normalize_code(code)}
+    coupon = await db.coupons.find_one(
+        {**query, "is_active": True, **_not_expired(datetime.utcnow())}, {"_id": 0}
+    )
+    if coupon:
+        return coupon
+    # Failure path only: tell an expired coupon apart from an unknown one
+    coupon = await db.coupons.find_one(query, {"_id": 0})
+    if coupon and coupon_expired(coupon):
+        raise HTTPException(status_code=400, detail="انتهت صلاحية هذا الكوبون")
+    if coupon and coupon.get("deactivated_reason") == "exhausted":
+        raise HTTPException(status_code=400, detail="تم استنفاد عدد مرات استخدام هذا الكوبون")
+    raise HTTPException(status_code=404, detail="كود الخصم غير صالح")
+
+
+async def redeem_coupon(
+    user_id: str,
+    code: str = None,
+    coupon_id: str = None,
+    subtotal: float = None,
+    delivery_fee: float = 0,
+    order_id: str = None,
+) -> dict:
+    """Reserve one use of a coupon for a user. Returns the redemption record.
+
+    The per-user record is inserted first (unique on coupon_id + user_id), then the
+    usage counter is incremented with a single conditional update; if that fails the
+    record is removed again, so used_count can never exceed max_uses.
+    """
+    coupon = await find_usable_coupon(code=code, coupon_id=coupon_id)
+    check_coupon(coupon, subtotal)
+
+    redemption = {
+        "id": str(uuid.uuid4()),
+        "coupon_id": coupon["id"],
+        "code": coupon["code"],
+        "user_id": user_id,
+        "order_id": order_id,
+        "discount": compute_discount(coupon, subtotal, delivery_fee),
+        "created_at": datetime.utcnow(),
+    }
+    try:
+        await db.coupon_redemptions.insert_one(redemption)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="لقد استخدمت هذا الكوبون مسبقاً")
+    redemption.pop("_id", None)
+
+    result = await db.coupons.update_one(_usable_filter(coupon), {"$inc": {"used_count": 1}})
+    if result.modified_count == 0:
+        await db.coupon_redemptions.delete_one({"id": redemption["id"]})
+        raise HTTPException(status_code=400, detail="تم استنفاد عدد مرات استخدام هذا الكوبون")
+    return redemption
+
+
+async def release_coupon(redemption_id: str):
+    """Undo a redemption (order failed or was cancelled) and give the use back"""
+    redemption = await db.coupon_redemptions.find_one_and_delete({"id": redemption_id})
+    if redemption:
+        await db.coupons.update_one(
+            {"id": redemption["coupon_id"], "used_count": {"$gt": 0}},
+            {"$inc": {"used_count": -1}}
+        )
+        # The sweeper may have switched it off when it ran out; the freed use brings it back
+        await db.coupons.update_one(
+            _reactivate_filter(redemption["coupon_id"], datetime.utcnow()),
+            {"$set": {"is_active": True}, "$unset": {"deactivated_reason": "", "deactivated_at": ""}}
+        )
+        logger.info(f"Released coupon {redemption['code']} for user {redemption['user_id']}")
+
+
+async def sweep_coupons(now: datetime = None) -> dict:
+    """Deactivate expired and used-up coupons in bulk, then archive ones that have been off for a while"""
+    now = now or datetime.utcnow()
+    expired = await db.coupons.update_many(
+        {"is_active": True, "expires_at": {"$lte": now}},
+        {"$set": {"is_active": False, "deactivated_reason": "expired", "deactivated_at": now}}
+    )
+    exhausted = await db.coupons.update_many(
+        {"is_active": True, "max_uses": {"$gt": 0}, "$expr": {"$gte": ["$used_count", "$max_uses"]}},
+        {"$set": {"is_active": False, "deactivated_reason": "exhausted", "deactivated_at": now}}
+    )
+
+    # Only coupons switched off by the sweeper; ones an admin disabled stay in the list
+    archive_query = {
+        "is_active": False,
+        "deactivated_reason": {"$in": ["expired", "exhausted"]},
+        "deactivated_at": {"$lte": now - timedelta(days=COUPON_ARCHIVE_AFTER_DAYS)},
+    }
+    archived = 0
+    old = await db.coupons.find(archive_query, {"_id": 0}).to_list(1000)
+    if old:
+        # Upsert by id so a sweep interrupted before the delete can simply run again
+        await db.coupons_archive.bulk_write(
+            [ReplaceOne({"id": c["id"]}, {**c, "archived_at": now}, upsert=True) for c in old],
+            ordered=False
+        )
+        result = await db.coupons.delete_many({"id": {"$in": [c["id"] for c in old]}, **archive_query})
+        archived = result.deleted_count
+
+    counts = {"expired": expired.modified_count, "exhausted": exhausted.modified_count, "archived": archived}
+    if any(counts.values()):
+        logger.info(f"Coupon sweep: {counts}")
+    return counts
+
+
+async def run_coupon_sweeper():
+    """Background loop that keeps dead coupons out of validation and the admin list"""
+    while True:
+        try:
+            await sweep_coupons()
+        except Exception as e:
+            logger.error(f"Coupon sweep error: {e}")
+        await asyncio.sleep(COUPON_SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,254 @@
+"""Platform dispatch engine: periodically matches ready orders to available drivers per city"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from database import db
+from models.schemas import DriverOffer
+from utils.location_store import get_driver_locations
+from utils.matching import match_orders_to_drivers, orders_without_candidates
+from utils.notifications import create_notification, notify_drivers_new_order
+
+logger = logging.getLogger("server")
+
+DISPATCH_ENABLED = os.environ.get("DISPATCH_ENABLED", "1") == "1"
+DISPATCH_INTERVAL_SECONDS = float(os.environ.get("DISPATCH_INTERVAL_SECONDS", "10"))
+# How long a matched driver has to accept an offer before it moves on
+OFFER_TIMEOUT_SECONDS = int(os.environ.get("OFFER_TIMEOUT_SECONDS", "45"))
+# Maximum number of active deliveries a driver can carry
+DRIVER_MAX_LOAD = int(os.environ.get("DRIVER_MAX_LOAD", "2"))
+DISPATCH_MAX_DISTANCE_KM = float(os.environ.get("DISPATCH_MAX_DISTANCE_KM", "15"))
+# After this many unanswered offers the order is broadcast to every driver in the city
+DISPATCH_MAX_OFFERS = int(os.environ.get("DISPATCH_MAX_OFFERS", "3"))
+
+ACTIVE_DELIVERY_STATUSES = ["driver_assigned", "picked_up", "out_for_delivery"]
+UNASSIGNED = {"$or": [{"driver_id": None}, {"driver_id": ""}]}
+
+# Cities with a dispatch round currently running in this worker
+_inflight = set()
+# Scheduled rounds are referenced here so they are not garbage-collected mid-run
+_dispatch_tasks = set()
+
+
+def dispatchable_query(city_id: str = None) -> dict:
+    """Platform orders waiting for a driver and not currently offered to anyone"""
+    query = {
+        "order_status": {"$in": ["ready", "preparing"]},
+        "delivery_mode": "platform_driver",
+        "offered_driver_id": None,
+        **UNASSIGNED,
+    }
+    if city_id:
+        query["city_id"] = city_id
+    return query
+
+
+def open_to_driver(driver_id: str) -> dict:
+    """Filter clause: the order is not reserved by a live offer for a different driver"""
+    return {"$or": [
+        {"offered_driver_id": None},
+        {"offered_driver_id": driver_id},
+        {"offer_expires_at": {"$lt": datetime.utcnow()}},
+    ]}
+
+
+async def release_offer(order_id: str, offer_id: str, driver_id: str, status: str):
+    """Close an offer and make its order dispatchable again, excluding the driver"""
+    await db.driver_offers.update_one(
+        {"id": offer_id, "status": "offered"},
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+    )
+    await db.orders.update_one(
+        {"id": order_id, "offer_id": offer_id},
+        {
+            "$unset": {"offered_driver_id": "", "offer_id": "", "offer_expires_at": ""},
+            "$addToSet": {"declined_driver_ids": driver_id},
+        }
+    )
+
+
+async def expire_offers(city_id: str) -> int:
+    """Release offers that were not answered in time"""
+    now = datetime.utcnow()
+    orders = await db.orders.find(
+        {"city_id": city_id, "offer_expires_at": {"$lt": now}},
+        {"_id": 0, "id": 1, "offer_id": 1, "offered_driver_id": 1}
+    ).to_list(500)
+    if not orders:
+        return 0
+
+    await db.driver_offers.update_many(
+        {"id": {"$in": [o["offer_id"] for o in orders]}, "status": "offered"},
+        {"$set": {"status": "expired", "updated_at": now}}
+    )
+    ops = [
+        UpdateOne(
+            {"id": o["id"], "offer_id": o["offer_id"]},
+            {
+                "$unset": {"offered_driver_id": "", "offer_id": "", "offer_expires_at": ""},
+                "$addToSet": {"declined_driver_ids": o["offered_driver_id"]},
+            }
+        )
+        for o in orders
+    ]
+    await db.orders.bulk_write(ops, ordered=False)
+    return len(orders)
+
+
+async def _available_drivers(city_id: str) -> list:
+    """Online drivers of a city with a known position, their load, and no open offer"""
+    drivers = await db.users.find(
+        {"role": "driver", "is_online": True, "city_id": city_id},
+        {"_id": 0, "id": 1}
+    ).to_list(500)
+    if not drivers:
+        return []
+    driver_ids = [d["id"] for d in drivers]
+
+    load_rows = await db.orders.aggregate([
+        {"$match": {"driver_id": {"$in": driver_ids}, "order_status": {"$in": ACTIVE_DELIVERY_STATUSES}}},
+        {"$group": {"_id": "$driver_id", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    loads = {row["_id"]: row["count"] for row in load_rows}
+    offered = set(await db.driver_offers.distinct(
+        "driver_id", {"driver_id": {"$in": driver_ids}, "status": "offered"}
+    ))
+    locations = await get_driver_locations(driver_ids)
+
+    result = []
+    for driver_id in driver_ids:
+        location = locations.get(driver_id)
+        if driver_id in offered or not location:
+            continue
+        result.append({
+            "id": driver_id,
+            "lat": location["lat"],
+            "lng": location["lng"],
+            "load": loads.get(driver_id, 0),
+        })
+    return result
+
+
+async def dispatch_city(city_id: str) -> int:
+    """Run one matching round for a city. Returns the number of offers made."""
+    await expire_offers(city_id)
+
+    orders = await db.orders.find(
+        dispatchable_query(city_id),
+        {"_id": 0, "id": 1, "restaurant_name": 1, "total": 1, "restaurant_lat": 1, "restaurant_lng": 1,
+         "declined_driver_ids": 1, "offer_attempts": 1, "broadcast_at": 1}
+    ).sort("created_at", 1).to_list(200)
+    if not orders:
+        return 0
+
+    drivers = await _available_drivers(city_id)
+    matchable = [
+        {
+            "id": o["id"],
+            "lat": o["restaurant_lat"],
+            "lng": o["restaurant_lng"],
+            "excluded_driver_ids": o.get("declined_driver_ids", []),
+        }
+        for o in orders if o.get("restaurant_lat") and o.get("restaurant_lng")
+    ]
+    # Orders without a restaurant position can never be matched
+    matchable_ids = {o["id"] for o in matchable}
+    assignments = match_orders_to_drivers(
+        matchable, drivers, max_load=DRIVER_MAX_LOAD, max_distance_km=DISPATCH_MAX_DISTANCE_KM
+    )
+
+    orders_by_id = {o["id"]: o for o in orders}
+    now = datetime.utcnow()
+    offers_made = 0
+    for order_id, driver_id, distance in assignments:
+        offer = DriverOffer(
+            order_id=order_id,
+            driver_id=driver_id,
+            city_id=city_id,
+            distance_km=round(distance, 2),
+            expires_at=now + timedelta(seconds=OFFER_TIMEOUT_SECONDS),
+        )
+        await db.driver_offers.insert_one(offer.dict())
+        # Only reserve the order if nobody took or was offered it in the meantime
+        result = await db.orders.update_one(
+            {"id": order_id, **dispatchable_query()},
+            {
+                "$set": {
+                    "offered_driver_id": driver_id,
+                    "offer_id": offer.id,
+                    "offer_expires_at": offer.expires_at,
+                },
+                "$inc": {"offer_attempts": 1},
+            }
+        )
+        if result.modified_count == 0:
+            await db.driver_offers.update_one({"id": offer.id}, {"$set": {"status": "cancelled"}})
+            continue
+        offers_made += 1
+        order = orders_by_id[order_id]
+        await create_notification(
+            driver_id,
+            "🚀 طلب جديد قريب منك",
+            f"طلب من {order.get('restaurant_name', '')} على بعد {distance:.1f} كم - لديك {OFFER_TIMEOUT_SECONDS} ثانية للقبول",
+            "new_order",
+            {"order_id": order_id, "offer_id": offer.id, "restaurant_name": order.get("restaurant_name", "")}
+        )
+
+    # Orders nobody could take after several offers, or that no online driver can be offered
+    # (all out of range, declined or fully loaded), fall back to a city-wide broadcast
+    matched = {order_id for order_id, _, _ in assignments}
+    unreachable = orders_without_candidates(
+        matchable, drivers, max_load=DRIVER_MAX_LOAD, max_distance_km=DISPATCH_MAX_DISTANCE_KM
+    )
+    for order in orders:
+        if order["id"] in matched or order.get("broadcast_at"):
+            continue
+        if (
+            order.get("offer_attempts", 0) >= DISPATCH_MAX_OFFERS
+            or order["id"] in unreachable
+            or order["id"] not in matchable_ids
+        ):
+            await db.orders.update_one({"id": order["id"]}, {"$set": {"broadcast_at": now}})
+            await notify_drivers_new_order(order, city_id)
+
+    if offers_made:
+        logger.info(f"Dispatch city={city_id}: {len(orders)} orders, {len(drivers)} drivers, {offers_made} offers")
+    return offers_made
+
+
+async def _dispatch_now(city_id: str):
+    try:
+        await dispatch_city(city_id)
+    except Exception as e:
+        logger.error(f"Dispatch error for city {city_id}: {e}")
+    finally:
+        _inflight.discard(city_id)
+
+
+def request_dispatch(city_id: str):
+    """Schedule an immediate matching round for a city (no-op if one is already running)"""
+    if not DISPATCH_ENABLED or not city_id or city_id in _inflight:
+        return
+    _inflight.add(city_id)
+    task = asyncio.create_task(_dispatch_now(city_id))
+    _dispatch_tasks.add(task)
+    task.add_done_callback(_dispatch_tasks.discard)
+
+
+async def run_dispatcher():
+    """Background loop that runs a matching round for every city with waiting orders"""
+    while True:
+        await asyncio.sleep(DISPATCH_INTERVAL_SECONDS)
+        try:
+            waiting = await db.orders.distinct("city_id", {
+                "delivery_mode": "platform_driver",
+                "order_status": {"$in": ["ready", "preparing"]},
+                **UNASSIGNED,
+            })
+            for city_id in waiting:
+                if city_id and city_id not in _inflight:
+                    _inflight.add(city_id)
+                    await _dispatch_now(city_id)
+        except Exception as e:
+            logger.error(f"Dispatcher loop error: {e}")
@@ -0,0 +1,76 @@
+"""Automatic offline marking for drivers whose app stopped sending location heartbeats"""
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from database import db
+
+logger = logging.getLogger("server")
+
+# A driver with no location update for this long is marked offline
+DRIVER_OFFLINE_AFTER_SECONDS = float(os.environ.get("DRIVER_OFFLINE_AFTER_SECONDS", "600"))
+DRIVER_SWEEP_INTERVAL_SECONDS = float(os.environ.get("DRIVER_SWEEP_INTERVAL_SECONDS", "60"))
+
+# Sweeper metrics for this worker
+_sweep_stats = {"runs": 0, "swept_total": 0, "last_run_at": None, "last_swept": 0}
+_recent_sweeps = deque(maxlen=50)
+
+
+def stale_driver_query(now: datetime) -> dict:
+    """Online drivers silent since the cutoff (and not switched online after it)"""
+    cutoff = now - timedelta(seconds=DRIVER_OFFLINE_AFTER_SECONDS)
+    return {
+        "role": "driver",
+        "is_online": True,
+        "$and": [
+            {"$or": [{"location_updated_at": {"$lt": cutoff}}, {"location_updated_at": None}]},
+            {"$or": [{"went_online_at": {"$lt": cutoff}}, {"went_online_at": None}]},
+        ],
+    }
+
+
+async def sweep_offline_drivers(now: datetime = None) -> int:
+    """Mark silent drivers offline; returns how many were swept"""
+    now = now or datetime.utcnow()
+    query = stale_driver_query(now)
+    stale = await db.users.find(query, {"_id": 0, "id": 1, "city_id": 1}).to_list(None)
+    swept = 0
+    by_city = {}
+    if stale:
+        # Same conditions again so a driver who pinged in between stays online
+        result = await db.users.update_many(
+            {**query, "id": {"$in": [d["id"] for d in stale]}},
+            {"$set": {"is_online": False, "went_offline_at": now, "offline_reason": "heartbeat_timeout"}}
+        )
+        swept = result.modified_count
+        for driver in stale:
+            city = driver.get("city_id") or "unknown"
+            by_city[city] = by_city.get(city, 0) + 1
+
+    _sweep_stats["runs"] += 1
+    _sweep_stats["swept_total"] += swept
+    _sweep_stats["last_run_at"] = now
+    _sweep_stats["last_swept"] = swept
+    if swept:
+        _recent_sweeps.append({"at": now, "swept": swept, "by_city": by_city})
+        logger.info(f"Driver sweeper marked {swept} drivers offline: {by_city}")
+    return swept
+
+
+def get_sweep_stats() -> dict:
+    return {
+        **_sweep_stats,
+        "offline_after_seconds": DRIVER_OFFLINE_AFTER_SECONDS,
+        "recent": list(_recent_sweeps),
+    }
+
+
+async def run_driver_sweeper():
+    """Background loop that keeps the online driver set honest"""
+    while True:
+        await asyncio.sleep(DRIVER_SWEEP_INTERVAL_SECONDS)
+        try:
+            await sweep_offline_drivers()
+        except Exception as e:
+            logger.error(f"Driver sweeper error: {e}")
@@ -0,0 +1,184 @@
+"""ETA estimation from historical stage durations per city and hour of day"""
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from statistics import median
+from database import db
+from utils.helpers import calculate_distance, SYRIA_TZ
+
+logger = logging.getLogger("server")
+
+ETA_HISTORY_DAYS = int(os.environ.get("ETA_HISTORY_DAYS", "28"))
+ETA_REFRESH_SECONDS = float(os.environ.get("ETA_REFRESH_SECONDS", "3600"))
+# A (city, hour) bucket needs this many delivered orders before it is trusted
+ETA_MIN_SAMPLES = int(os.environ.get("ETA_MIN_SAMPLES", "20"))
+ETA_MAX_ORDERS = 50000
+
+# Used until enough history exists; speed is straight-line km per hour
+DEFAULT_STATS = {"prep_minutes": 15.0, "delivery_minutes": 20.0, "speed_kmh": 18.0}
+# Time between the driver reaching the restaurant and leaving with the order
+HANDOFF_MINUTES = 2.0
+
+# Precomputed tables, rebuilt by refresh_eta_tables()
+_tables = {"by_city_hour": {}, "by_city": {}, "global": {}, "refreshed_at": None}
+
+
+def local_hour(ts: datetime) -> int:
+    """Hour of day in Syria for a naive UTC timestamp"""
+    return ts.replace(tzinfo=timezone.utc).astimezone(SYRIA_TZ).hour
+
+
+def _summarize(samples: dict) -> dict:
+    stats = {"samples": samples["count"]}
+    for key in DEFAULT_STATS:
+        if samples[key]:
+            stats[key] = median(samples[key])
+    return stats
+
+
+def build_eta_tables(orders) -> dict:
+    """Medians of prep time, delivery time and travel speed per (city, hour), per city and overall"""
+    buckets = {}
+
+    def bucket(key):
+        return buckets.setdefault(key, {"count": 0, "prep_minutes": [], "delivery_minutes": [], "speed_kmh": []})
+
+    for order in orders:
+        stamps = order.get("stage_timestamps") or {}
+        created = stamps.get("pending")
+        if not created:
+            continue
+        city_id = order.get("city_id")
+        targets = [bucket(("city_hour", city_id, local_hour(created))), bucket(("city", city_id)), bucket(("global",))]
+        for b in targets:
+            b["count"] += 1
+
+        if stamps.get("accepted") and stamps.get("ready") and stamps["ready"] > stamps["accepted"]:
+            prep = (stamps["ready"] - stamps["accepted"]).total_seconds() / 60
+            for b in targets:
+                b["prep_minutes"].append(prep)
+
+        if stamps.get("picked_up") and stamps.get("delivered") and stamps["delivered"] > stamps["picked_up"]:
+            delivery = (stamps["delivered"] - stamps["picked_up"]).total_seconds() / 60
+            for b in targets:
+                b["delivery_minutes"].append(delivery)
+            if order.get("restaurant_lat") and order.get("delivery_lat") and delivery >= 1:
+                km = calculate_distance(order["restaurant_lat"], order["restaurant_lng"],
+                                        order["delivery_lat"], order["delivery_lng"])
+                if km >= 0.3:
+                    speed = km / (delivery / 60)
+                    for b in targets:
+                        b["speed_kmh"].append(min(max(speed, 5.0), 60.0))
+
+    tables = {"by_city_hour": {}, "by_city": {}, "global": {}, "refreshed_at": datetime.utcnow()}
+    for key, samples in buckets.items():
+        if key[0] == "city_hour":
+            tables["by_city_hour"][(key[1], key[2])] = _summarize(samples)
+        elif key[0] == "city":
+            tables["by_city"][key[1]] = _summarize(samples)
+        else:
+            tables["global"] = _summarize(samples)
+    return tables
+
+
+async def refresh_eta_tables() -> int:
+    """Rebuild the in-memory tables from recently delivered orders"""
+    since = datetime.utcnow() - timedelta(days=ETA_HISTORY_DAYS)
+    cursor = db.orders.find(
+        {"stage_timestamps.delivered": {"$gte": since}},
+        {"_id": 0, "city_id": 1, "stage_timestamps": 1, "restaurant_lat": 1, "restaurant_lng": 1,
+         "delivery_lat": 1, "delivery_lng": 1}
+    ).limit(ETA_MAX_ORDERS).batch_size(1000)
+    orders = [order async for order in cursor]
+    _tables.update(build_eta_tables(orders))
+    logger.info(f"ETA tables refreshed from {len(orders)} orders ({len(_tables['by_city_hour'])} city/hour buckets)")
+    return len(orders)
+
+
+def lookup_stat(city_id: str, hour: int, key: str) -> float:
+    """Most specific trusted value: city+hour, then city, then overall, then default"""
+    for stats in (
+        _tables["by_city_hour"].get((city_id, hour)),
+        _tables["by_city"].get(city_id),
+        _tables["global"],
+    ):
+        if stats and stats.get("samples", 0) >= ETA_MIN_SAMPLES and key in stats:
+            return stats[key]
+    return DEFAULT_STATS[key]
+
+
+def _minutes(value: float) -> int:
+    return max(1, int(math.ceil(value)))
+
+
+def estimate_eta(order: dict, driver_lat: float = None, driver_lng: float = None, now: datetime = None) -> dict:
+    """ETAs (whole minutes) and straight-line distances for a tracked order; uses memory only"""
+    now = now or datetime.utcnow()
+    status = order.get("order_status", "")
+    stamps = order.get("stage_timestamps") or {}
+    city_id = order.get("city_id")
+    hour = local_hour(now)
+    speed = lookup_stat(city_id, hour, "speed_kmh")
+
+    rest_lat, rest_lng = order.get("restaurant_lat"), order.get("restaurant_lng")
+    dest_lat, dest_lng = order.get("delivery_lat"), order.get("delivery_lng")
+    has_driver = driver_lat is not None and driver_lng is not None
+    has_rest = rest_lat is not None and rest_lng is not None
+    has_dest = dest_lat is not None and dest_lng is not None
+
+    def travel(km):
+        return km / speed * 60
+
+    result = {
+        "distance_to_restaurant_km": None,
+        "distance_to_customer_km": None,
+        "eta_to_restaurant_min": None,
+        "eta_to_customer_min": None,
+    }
+    if status in ["delivered", "cancelled"]:
+        return result
+
+    if status in ["picked_up", "out_for_delivery"]:
+        if has_driver and has_dest:
+            km = calculate_distance(driver_lat, driver_lng, dest_lat, dest_lng)
+            result["distance_to_customer_km"] = round(km, 1)
+            result["eta_to_customer_min"] = _minutes(travel(km))
+        else:
+            picked_up = stamps.get("picked_up") or now
+            elapsed = (now - picked_up).total_seconds() / 60
+            result["eta_to_customer_min"] = _minutes(lookup_stat(city_id, hour, "delivery_minutes") - elapsed)
+        return result
+
+    # Before pickup: the order leaves the restaurant once both the food and the driver are there
+    to_restaurant = 0.0
+    if has_driver and has_rest:
+        km = calculate_distance(driver_lat, driver_lng, rest_lat, rest_lng)
+        result["distance_to_restaurant_km"] = round(km, 1)
+        to_restaurant = travel(km)
+        result["eta_to_restaurant_min"] = _minutes(to_restaurant)
+
+    ready_in = 0.0
+    if status != "ready" and not stamps.get("ready"):
+        prep_started = stamps.get("accepted") or stamps.get("pending") or now
+        expected_ready = prep_started + timedelta(minutes=lookup_stat(city_id, hour, "prep_minutes"))
+        ready_in = max(0.0, (expected_ready - now).total_seconds() / 60)
+
+    leg = lookup_stat(city_id, hour, "delivery_minutes")
+    if has_rest and has_dest:
+        km = calculate_distance(rest_lat, rest_lng, dest_lat, dest_lng)
+        result["distance_to_customer_km"] = round(km, 1)
+        leg = travel(km)
+    result["eta_to_customer_min"] = _minutes(max(to_restaurant, ready_in) + HANDOFF_MINUTES + leg)
+    return result
+
+
+async def run_eta_refresher():
+    """Background loop that keeps the ETA tables current"""
+    while True:
+        try:
+            await refresh_eta_tables()
+        except Exception as e:
+            logger.error(f"ETA refresh error: {e}")
+        await asyncio.sleep(ETA_REFRESH_SECONDS)
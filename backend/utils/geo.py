@@ -0,0 +1,82 @@
+"""Vectorized great-circle distances: many-to-many matrices and k-nearest queries"""
+import heapq
+from utils.helpers import calculate_distance
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is in requirements.txt
+    np = None
+
+EARTH_RADIUS_KM = 6371
+HAS_NUMPY = np is not None
+# Below this many points the array conversion costs more than the plain loop
+VECTORIZE_MIN_POINTS = 32
+
+
+def _split(points):
+    """(lat, lng) pairs -> two float arrays"""
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return arr[:, 0], arr[:, 1]
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    """Haversine on broadcastable arrays of degrees (same formula as calculate_distance)"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def distances_from(lat: float, lng: float, points: list) -> list:
+    """Distance in km from one coordinate to every (lat, lng) in points"""
+    if not points:
+        return []
+    if not HAS_NUMPY or len(points) < VECTORIZE_MIN_POINTS:
+        return [calculate_distance(lat, lng, p_lat, p_lng) for p_lat, p_lng in points]
+    lats, lngs = _split(points)
+    return _haversine(lat, lng, lats, lngs).tolist()
+
+
+def distance_matrix(sources: list, targets: list):
+    """Distance in km from every source (rows) to every target (columns).
+
+    Returns a 2-D NumPy array, or nested lists when NumPy is unavailable;
+    both support matrix[i][j].
+    """
+    if not HAS_NUMPY:
+        return [[calculate_distance(s_lat, s_lng, t_lat, t_lng) for t_lat, t_lng in targets]
+                for s_lat, s_lng in sources]
+    if not sources or not targets:
+        return np.zeros((len(sources), len(targets)))
+    s_lat, s_lng = _split(sources)
+    t_lat, t_lng = _split(targets)
+    return _haversine(s_lat[:, None], s_lng[:, None], t_lat[None, :], t_lng[None, :])
+
+
+def k_nearest(lat: float, lng: float, points: list, k: int = None, max_distance_km: float = None) -> list:
+    """Indices of the k points closest to (lat, lng) as [(index, distance_km)], nearest first.
+
+    k=None returns every point (optionally limited by max_distance_km).
+    """
+    if not points:
+        return []
+    k = len(points) if k is None else min(k, len(points))
+    if k <= 0:
+        return []
+
+    if not HAS_NUMPY or len(points) < VECTORIZE_MIN_POINTS:
+        distances = distances_from(lat, lng, points)
+        candidates = [(d, i) for i, d in enumerate(distances)
+                      if max_distance_km is None or d <= max_distance_km]
+        return [(i, d) for d, i in heapq.nsmallest(k, candidates)]
+
+    lats, lngs = _split(points)
+    distances = _haversine(lat, lng, lats, lngs)
+    indices = np.arange(len(distances))
+    if max_distance_km is not None:
+        indices = indices[distances <= max_distance_km]
+    if k < len(indices):
+        # Partial selection is O(n); only the k winners get sorted
+        indices = indices[np.argpartition(distances[indices], k - 1)[:k]]
+    indices = indices[np.argsort(distances[indices], kind="stable")]
+    return [(int(i), float(distances[i])) for i in indices]
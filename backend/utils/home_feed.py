@@ -0,0 +1,68 @@
+"""Cached home-feed sections: shared sections plus one restaurant list per city, each with a content version"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger("server")
+
+# Upper bound on how stale a section can be on a worker that did not see the change itself
+HOME_FEED_TTL_SECONDS = float(os.environ.get("HOME_FEED_TTL_SECONDS", "30"))
+
+# (section, city_id or None) -> {"version", "data", "built_at"}
+_sections = {}
+_locks = {}
+
+
+def section_version(data) -> str:
+    """Short content hash; identical data always gets the same version on every worker"""
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()[:12]
+
+
+def invalidate_home_section(section: str):
+    """Drop a section (for every city) so the next feed request rebuilds it"""
+    for key in [key for key in _sections if key[0] == section]:
+        _sections.pop(key, None)
+
+
+def _fresh(entry) -> bool:
+    return entry is not None and (datetime.utcnow() - entry["built_at"]).total_seconds() < HOME_FEED_TTL_SECONDS
+
+
+async def get_section(section: str, builder, city_id: str = None) -> dict:
+    """Cached section entry; concurrent misses for the same key share one build"""
+    key = (section, city_id)
+    entry = _sections.get(key)
+    if _fresh(entry):
+        return entry
+    async with _locks.setdefault(key, asyncio.Lock()):
+        entry = _sections.get(key)
+        if _fresh(entry):
+            return entry
+        data = jsonable_encoder(await builder())
+        entry = {"version": section_version(data), "data": data, "built_at": datetime.utcnow()}
+        _sections[key] = entry
+        return entry
+
+
+def parse_known_versions(value: str) -> dict:
+    """"cities:ab12,settings:cd34" -> {"cities": "ab12", "settings": "cd34"}"""
+    known = {}
+    for part in (value or "").split(","):
+        name, _, version = part.strip().partition(":")
+        if name and version:
+            known[name] = version
+    return known
+
+
+def compact_feed(entries: dict, known: dict) -> dict:
+    """Sections the client already has at the current version are sent without their data"""
+    return {
+        name: {"version": entry["version"]} if known.get(name) == entry["version"]
+        else {"version": entry["version"], "data": entry["data"]}
+        for name, entry in entries.items()
+    }
@@ -0,0 +1,138 @@
+"""Idempotency-Key support: replay the first response of a retried POST instead of executing it again"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+from database import db
+
+logger = logging.getLogger("server")
+
+# Stored responses are replayed for this long (TTL index on expires_at)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a concurrent duplicate waits for the first request to finish
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "15"))
+# An in-progress key not refreshed for this long is assumed abandoned (worker crashed) and taken over;
+# a running handler refreshes its lock every third of this, however long it takes
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+MAX_KEY_LENGTH = 200
+
+
+def request_fingerprint(payload) -> str:
+    """Stable hash of a request body, to reject a reused key with a different payload"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+async def _acquire(user_id: str, key: str, scope: str, fingerprint: str, lock_id: str):
+    """Insert the in-progress marker. Returns None if acquired, else the existing record."""
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            "user_id": user_id,
+            "key": key,
+            "scope": scope,
+            "fingerprint": fingerprint,
+            "status": "in_progress",
+            "lock_id": lock_id,
+            "locked_at": now,
+            "created_at": now,
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # Take over a marker left behind by a crashed request, but only for the same payload;
+    # a different one falls through to the fingerprint check of the caller
+    taken = await db.idempotency_keys.find_one_and_update(
+        {"user_id": user_id, "key": key, "scope": scope, "status": "in_progress", "fingerprint": fingerprint,
+         "locked_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+        {"$set": {"locked_at": now, "lock_id": lock_id}}
+    )
+    if taken:
+        return None
+    record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key, "scope": scope}, {"_id": 0})
+    # Deleted in between by a failed first attempt: the caller tries to acquire again
+    return record or {"status": "released"}
+
+
+async def _keep_locked(user_id: str, key: str, scope: str, lock_id: str):
+    """Refresh locked_at while the handler runs so a slow request is never taken over"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        try:
+            await db.idempotency_keys.update_one(
+                {"user_id": user_id, "key": key, "scope": scope, "status": "in_progress", "lock_id": lock_id},
+                {"$set": {"locked_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to refresh idempotency lock for {scope}: {e}")
+
+
+async def _wait_for_result(user_id: str, key: str, scope: str) -> dict:
+    """Poll until the in-flight request finishes; returns its record, {"status": "released"} or None on timeout"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while loop.time() < deadline:
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+        record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key, "scope": scope}, {"_id": 0})
+        if not record:
+            return {"status": "released"}
+        if record.get("status") == "done":
+            return record
+    return None
+
+
+async def run_idempotent(user_id: str, key, scope: str, handler, fingerprint: str = None):
+    """Run handler() once per (user, key, scope); retries get the stored response.
+
+    Without a key the handler simply runs. A failed handler releases the key so the
+    client can retry; only successful responses are stored and replayed.
+    """
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="مفتاح Idempotency-Key طويل جداً")
+
+    lock_id = str(uuid.uuid4())
+    for _ in range(3):
+        record = await _acquire(user_id, key, scope, fingerprint, lock_id)
+        if record is None:
+            break
+        if fingerprint and record.get("fingerprint") and record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="تم استخدام مفتاح Idempotency-Key لطلب مختلف")
+        if record.get("status") == "in_progress":
+            record = await _wait_for_result(user_id, key, scope)
+            if record is None:
+                raise HTTPException(status_code=409, detail="الطلب قيد المعالجة، يرجى المحاولة بعد قليل")
+        if record.get("status") == "done":
+            return record["response"]
+        # The first attempt failed and released the key: try to execute this one
+    else:
+        raise HTTPException(status_code=409, detail="الطلب قيد المعالجة، يرجى المحاولة بعد قليل")
+
+    owned = {"user_id": user_id, "key": key, "scope": scope, "status": "in_progress", "lock_id": lock_id}
+    heartbeat = asyncio.create_task(_keep_locked(user_id, key, scope, lock_id))
+    try:
+        result = await handler()
+    except BaseException:
+        await db.idempotency_keys.delete_one(owned)
+        raise
+    finally:
+        heartbeat.cancel()
+
+    try:
+        await db.idempotency_keys.update_one(
+            owned,
+            {"$set": {"status": "done", "response": jsonable_encoder(result), "completed_at": datetime.utcnow()}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to store idempotent response for {scope}: {e}")
+    return result
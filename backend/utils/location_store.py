@@ -0,0 +1,200 @@
+"""Driver location store: in-memory latest positions with throttled write-behind to Mongo"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from pymongo import UpdateOne
+from database import db
+from utils.helpers import calculate_distance
+
+logger = logging.getLogger("server")
+
+# Pings closer than this to the last accepted position are not persisted again
+LOCATION_MIN_MOVE_METERS = float(os.environ.get("LOCATION_MIN_MOVE_METERS", "25"))
+# A stationary driver is still persisted at least this often so the heartbeat stays fresh
+LOCATION_MAX_SILENCE_SECONDS = float(os.environ.get("LOCATION_MAX_SILENCE_SECONDS", "60"))
+# How often buffered positions are written to the driver_locations collection
+LOCATION_FLUSH_INTERVAL_SECONDS = float(os.environ.get("LOCATION_FLUSH_INTERVAL_SECONDS", "5"))
+# How often the legacy users.current_location / location_updated_at mirror is refreshed
+USER_LOCATION_MIRROR_SECONDS = float(os.environ.get("USER_LOCATION_MIRROR_SECONDS", "60"))
+# Entries not updated for this long are dropped from the in-memory table
+LOCATION_EVICT_SECONDS = float(os.environ.get("LOCATION_EVICT_SECONDS", "3600"))
+
+# Latest known position per driver in this worker: driver_id -> entry dict
+_latest = {}
+# Drivers whose accepted position has not been flushed yet
+_dirty = set()
+
+
+def record_driver_location(driver_id: str, lat: float, lng: float) -> bool:
+    """Record a GPS ping in memory. Returns True if the ping will be persisted."""
+    now = datetime.utcnow()
+    entry = _latest.get(driver_id)
+    if entry is None:
+        entry = {"accepted_at": None, "mirrored_at": None, "city_id": None}
+        _latest[driver_id] = entry
+    entry["lat"] = lat
+    entry["lng"] = lng
+    entry["updated_at"] = now
+
+    accepted_at = entry["accepted_at"]
+    if accepted_at is not None:
+        moved_m = calculate_distance(entry["accepted_lat"], entry["accepted_lng"], lat, lng) * 1000
+        silent_for = (now - accepted_at).total_seconds()
+        if moved_m < LOCATION_MIN_MOVE_METERS and silent_for < LOCATION_MAX_SILENCE_SECONDS:
+            return False
+
+    entry["accepted_lat"] = lat
+    entry["accepted_lng"] = lng
+    entry["accepted_at"] = now
+    _dirty.add(driver_id)
+    return True
+
+
+def set_driver_city(driver_id: str, city_id: str, district_id: str = None, area: str = None):
+    """Attach the detected city and district to the driver's in-memory entry"""
+    entry = _latest.get(driver_id)
+    if entry is not None:
+        entry["city_id"] = city_id
+        entry["district_id"] = district_id
+        entry["area"] = area
+
+
+def _entry_to_location(entry: dict) -> dict:
+    return {
+        "lat": entry["lat"],
+        "lng": entry["lng"],
+        "city_id": entry.get("city_id"),
+        "district_id": entry.get("district_id"),
+        "area": entry.get("area"),
+        "updated_at": entry["updated_at"],
+    }
+
+
+def peek_driver_location(driver_id: str):
+    """Latest position held in this worker's memory, without touching Mongo"""
+    entry = _latest.get(driver_id)
+    return _entry_to_location(entry) if entry is not None else None
+
+
+def _fresh_entry(driver_id: str, now: datetime):
+    """This worker's entry, only while it is recent enough that no other worker can hold a newer ping"""
+    entry = _latest.get(driver_id)
+    if entry is not None and (now - entry["updated_at"]).total_seconds() <= LOCATION_MAX_SILENCE_SECONDS:
+        return entry
+    return None
+
+
+def _newer(entry, doc):
+    """The more recent of a (stale) in-memory entry and the persisted document"""
+    if entry is None:
+        return doc
+    if doc is None or doc.get("updated_at") is None or doc["updated_at"] < entry["updated_at"]:
+        return _entry_to_location(entry)
+    return doc
+
+
+async def get_driver_location(driver_id: str):
+    """Latest position of a driver: this worker's memory while fresh, otherwise the newer of memory and driver_locations"""
+    entry = _fresh_entry(driver_id, datetime.utcnow())
+    if entry is not None:
+        return _entry_to_location(entry)
+    doc = await db.driver_locations.find_one({"driver_id": driver_id}, {"_id": 0})
+    return _newer(_latest.get(driver_id), doc)
+
+
+async def get_driver_locations(driver_ids: list) -> dict:
+    """Latest positions for many drivers with at most one query for the ones not fresh in memory"""
+    now = datetime.utcnow()
+    result = {}
+    missing = []
+    for driver_id in driver_ids:
+        entry = _fresh_entry(driver_id, now)
+        if entry is not None:
+            result[driver_id] = _entry_to_location(entry)
+        else:
+            missing.append(driver_id)
+    if missing:
+        docs = await db.driver_locations.find(
+            {"driver_id": {"$in": missing}}, {"_id": 0}
+        ).to_list(len(missing))
+        persisted = {doc["driver_id"]: doc for doc in docs}
+        for driver_id in missing:
+            location = _newer(_latest.get(driver_id), persisted.get(driver_id))
+            if location is not None:
+                result[driver_id] = location
+    return result
+
+
+async def flush_driver_locations() -> int:
+    """Write all pending positions with one bulk_write (plus a coarse users mirror)"""
+    if not _dirty:
+        return 0
+    driver_ids = list(_dirty)
+    _dirty.clear()
+
+    location_ops = []
+    mirror_ops = []
+    mirrored = []
+    for driver_id in driver_ids:
+        entry = _latest.get(driver_id)
+        if entry is None:
+            continue
+        doc = {
+            "driver_id": driver_id,
+            "lat": entry["accepted_lat"],
+            "lng": entry["accepted_lng"],
+            "updated_at": entry["accepted_at"],
+        }
+        if entry.get("city_id"):
+            doc["city_id"] = entry["city_id"]
+            doc["district_id"] = entry.get("district_id")
+            doc["area"] = entry.get("area")
+        location_ops.append(UpdateOne({"driver_id": driver_id}, {"$set": doc}, upsert=True))
+
+        mirrored_at = entry["mirrored_at"]
+        if mirrored_at is None or (entry["accepted_at"] - mirrored_at).total_seconds() >= USER_LOCATION_MIRROR_SECONDS:
+            mirror_ops.append(UpdateOne(
+                {"id": driver_id},
+                {"$set": {
+                    "current_location": {"lat": doc["lat"], "lng": doc["lng"]},
+                    "location_updated_at": doc["updated_at"],
+                }}
+            ))
+            mirrored.append((entry, entry["accepted_at"]))
+
+    try:
+        if location_ops:
+            await db.driver_locations.bulk_write(location_ops, ordered=False)
+        if mirror_ops:
+            await db.users.bulk_write(mirror_ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to flush driver locations: {e}")
+        # Retry on the next tick; the entries still hold the latest positions
+        _dirty.update(driver_ids)
+        return 0
+    # Only once both writes landed; a failed mirror is retried on the next flush
+    for entry, accepted_at in mirrored:
+        entry["mirrored_at"] = accepted_at
+    return len(location_ops)
+
+
+def _evict_stale_entries():
+    now = datetime.utcnow()
+    stale = [
+        driver_id for driver_id, entry in _latest.items()
+        if driver_id not in _dirty and (now - entry["updated_at"]).total_seconds() > LOCATION_EVICT_SECONDS
+    ]
+    for driver_id in stale:
+        _latest.pop(driver_id, None)
+
+
+async def run_location_flusher():
+    """Background loop that periodically persists buffered driver positions"""
+    while True:
+        await asyncio.sleep(LOCATION_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_driver_locations()
+            _evict_stale_entries()
+        except Exception as e:
+            logger.error(f"Driver location flusher error: {e}")
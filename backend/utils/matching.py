@@ -0,0 +1,74 @@
+"""Driver-order assignment for platform dispatch (pure functions, no database access)"""
+from utils import geo
+
+# Each order already carried by a driver costs as much as this many extra km
+LOAD_PENALTY_KM = 2.0
+
+
+def distance_matrix(orders: list, drivers: list) -> list:
+    """Distance in km from every order's restaurant (rows) to every driver (columns)"""
+    return geo.distance_matrix(
+        [(o["lat"], o["lng"]) for o in orders],
+        [(d["lat"], d["lng"]) for d in drivers],
+    )
+
+
+def _candidates(orders: list, drivers: list, capacity: list, max_distance_km: float, load_penalty_km: float) -> list:
+    """(cost, distance, order index, driver index) for every driver allowed to take each order"""
+    matrix = distance_matrix(orders, drivers)
+    candidates = []
+    for i, order in enumerate(orders):
+        excluded = set(order.get("excluded_driver_ids") or [])
+        for j, driver in enumerate(drivers):
+            if capacity[j] == 0 or driver["id"] in excluded:
+                continue
+            distance = float(matrix[i][j])
+            if max_distance_km is not None and distance > max_distance_km:
+                continue
+            cost = distance + load_penalty_km * driver.get("load", 0)
+            candidates.append((cost, distance, i, j))
+    return candidates
+
+
+def orders_without_candidates(orders: list, drivers: list, max_load: int = 2, max_distance_km: float = None) -> set:
+    """Ids of orders that no driver can take at all: all out of range, declined or fully loaded"""
+    if not orders or not drivers:
+        return {o["id"] for o in orders}
+    capacity = [max(0, max_load - d.get("load", 0)) for d in drivers]
+    reachable = {i for _, _, i, _ in _candidates(orders, drivers, capacity, max_distance_km, 0)}
+    return {o["id"] for i, o in enumerate(orders) if i not in reachable}
+
+
+def match_orders_to_drivers(
+    orders: list,
+    drivers: list,
+    max_load: int = 2,
+    max_distance_km: float = None,
+    load_penalty_km: float = LOAD_PENALTY_KM,
+    max_new_per_driver: int = 1,
+) -> list:
+    """Greedy min-cost assignment of orders to drivers.
+
+    orders:  [{"id", "lat", "lng", "excluded_driver_ids"?}]
+    drivers: [{"id", "lat", "lng", "load"}]
+    Returns [(order_id, driver_id, distance_km)]; every order gets at most one driver,
+    no driver gets more than max_new_per_driver orders and none goes above max_load.
+    """
+    if not orders or not drivers:
+        return []
+
+    capacity = [min(max_new_per_driver, max(0, max_load - d.get("load", 0))) for d in drivers]
+    candidates = _candidates(orders, drivers, capacity, max_distance_km, load_penalty_km)
+    candidates.sort()
+
+    assigned_orders = set()
+    assignments = []
+    for _, distance, i, j in candidates:
+        if i in assigned_orders or capacity[j] == 0:
+            continue
+        assigned_orders.add(i)
+        capacity[j] -= 1
+        assignments.append((orders[i]["id"], drivers[j]["id"], distance))
+        if len(assigned_orders) == len(orders):
+            break
+    return assignments
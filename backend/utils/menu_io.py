@@ -0,0 +1,191 @@
+"""Menu import/export: row parsing, validation and serialization for CSV and JSON menus"""
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+from pydantic import ValidationError
+from models.schemas import MenuItemCreate, AddOnGroupCreate, AddOnGroup, AddOnOption
+
+CSV_COLUMNS = ["id", "name", "name_en", "description", "price", "image", "category", "is_available", "addons"]
+ITEM_FIELDS = ["name", "name_en", "description", "price", "image", "category", "is_available"]
+# A JSON array has to be parsed in one piece; NDJSON and CSV are parsed line by line
+MAX_JSON_ARRAY_BYTES = 10 * 1024 * 1024
+MAX_REPORTED_ERRORS = 200
+
+
+class MenuImportError(ValueError):
+    """The file as a whole cannot be read (bad encoding, broken JSON array, missing columns)"""
+
+
+async def _lines(chunks):
+    """Decode an async byte stream into text lines without loading it whole"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        try:
+            buffer += decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise MenuImportError("الملف ليس بترميز UTF-8")
+        *complete, buffer = buffer.split("\n")
+        for line in complete:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_csv_rows(chunks):
+    """(row number, dict) per CSV data row; add-on groups come as a JSON array in the addons column"""
+    lines = _lines(chunks)
+    pending = []
+    header = None
+    row_number = 0
+    async for line in lines:
+        # csv.reader needs whole records; quoted fields may span lines
+        pending.append(line)
+        text = "".join(pending)
+        if text.count('"') % 2:
+            continue
+        pending = []
+        records = list(csv.reader(io.StringIO(text)))
+        if not records or not any(records[0]):
+            continue
+        if header is None:
+            header = [h.strip() for h in records[0]]
+            missing = {"name", "price", "category"} - set(header)
+            if missing:
+                raise MenuImportError(f"أعمدة مفقودة: {', '.join(sorted(missing))}")
+            continue
+        row_number += 1
+        row = {key: value for key, value in zip(header, records[0]) if value != ""}
+        if "addons" in row:
+            try:
+                row["addons"] = json.loads(row["addons"])
+            except ValueError:
+                row["addons"] = "invalid"
+        if "is_available" in row:
+            row["is_available"] = row["is_available"].strip().lower() in ["1", "true", "yes", "نعم"]
+        yield row_number, row
+    if pending:
+        raise MenuImportError("الملف ينتهي داخل حقل بين علامتي تنصيص")
+
+
+async def iter_json_rows(chunks):
+    """(row number, dict) from NDJSON, or from a JSON array (loaded whole, size-capped)"""
+    lines = _lines(chunks)
+    first = None
+    async for line in lines:
+        if line.strip():
+            first = line
+            break
+    if first is None:
+        return
+
+    if first.lstrip().startswith("["):
+        parts = [first]
+        size = len(first)
+        async for line in lines:
+            parts.append(line)
+            size += len(line)
+            if size > MAX_JSON_ARRAY_BYTES:
+                raise MenuImportError("ملف JSON كبير جداً، استخدم NDJSON (صنف في كل سطر)")
+        try:
+            rows = json.loads("".join(parts))
+        except ValueError as e:
+            raise MenuImportError(f"JSON غير صالح: {e}")
+        for row_number, row in enumerate(rows, start=1):
+            yield row_number, row
+        return
+
+    def parse(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return "invalid"
+
+    row_number = 1
+    yield row_number, parse(first)
+    async for line in lines:
+        if line.strip():
+            row_number += 1
+            yield row_number, parse(line)
+
+
+def validate_row(row) -> tuple:
+    """(item fields, add-on groups or None, errors) for one imported row"""
+    if not isinstance(row, dict):
+        return None, None, ["صف غير صالح"]
+    errors = []
+    try:
+        item = MenuItemCreate(**{k: row[k] for k in ITEM_FIELDS if k in row}).dict()
+    except ValidationError as e:
+        item = None
+        errors.extend(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+    groups = None
+    if "addons" in row:
+        groups = []
+        if not isinstance(row["addons"], list):
+            errors.append("addons: يجب أن تكون قائمة JSON")
+        else:
+            for index, group in enumerate(row["addons"]):
+                try:
+                    groups.append(AddOnGroupCreate(**group))
+                except (ValidationError, TypeError) as e:
+                    details = e.errors() if isinstance(e, ValidationError) else [{"loc": (), "msg": str(e)}]
+                    errors.extend(
+                        f"addons.{index}.{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in details
+                    )
+    return item, groups, errors
+
+
+def build_addon_documents(groups: list, menu_item_id: str, restaurant_id: str) -> list:
+    return [
+        AddOnGroup(
+            menu_item_id=menu_item_id,
+            restaurant_id=restaurant_id,
+            name=group.name,
+            is_required=group.is_required,
+            max_selections=group.max_selections,
+            options=[AddOnOption(name=opt.name, price=opt.price) for opt in group.options],
+        ).dict()
+        for group in groups
+    ]
+
+
+def export_row(item: dict, groups: list) -> dict:
+    """Exported form of an item; the same shape is accepted by the import"""
+    row = {"id": item["id"], **{k: item.get(k) for k in ITEM_FIELDS}}
+    row["addons"] = [
+        {
+            "name": g["name"],
+            "is_required": g.get("is_required", False),
+            "max_selections": g.get("max_selections", 1),
+            "options": [{"name": o["name"], "price": o.get("price", 0)} for o in g.get("options", [])],
+        }
+        for g in groups
+    ]
+    return row
+
+
+def csv_line(values: list) -> str:
+    out = io.StringIO()
+    csv.writer(out).writerow(values)
+    return out.getvalue()
+
+
+def export_csv_row(row: dict) -> str:
+    values = []
+    for column in CSV_COLUMNS:
+        value = row.get(column)
+        if column == "addons":
+            value = json.dumps(value, ensure_ascii=False) if value is not None else ""
+        elif value is None:
+            value = ""
+        values.append(value)
+    return csv_line(values)
+
+
+def export_json_row(row: dict) -> str:
+    return json.dumps(row, ensure_ascii=False, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v))
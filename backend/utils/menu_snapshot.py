@@ -0,0 +1,120 @@
+"""Versioned, pre-serialized menu snapshots (items grouped by category with add-on groups embedded)"""
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db
+from models.schemas import MenuItem, AddOnGroup
+
+logger = logging.getLogger("server")
+
+# How often a worker re-reads restaurants.menu_version to notice edits made through other workers
+MENU_VERSION_CHECK_SECONDS = float(os.environ.get("MENU_VERSION_CHECK_SECONDS", "5"))
+MAX_CACHED_MENUS = 2000
+
+# restaurant_id -> {"version", "etag", "body", "checked_at"}
+_cache = {}
+
+
+async def invalidate_menu(restaurant_id: str):
+    """Call after any change to a restaurant's items or add-ons: bumps the version and rebuilds the snapshot"""
+    _cache.pop(restaurant_id, None)
+    restaurant = await db.restaurants.find_one_and_update(
+        {"id": restaurant_id},
+        {"$inc": {"menu_version": 1}},
+        projection={"_id": 0, "menu_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not restaurant:
+        return
+    try:
+        await _build_snapshot(restaurant_id, restaurant["menu_version"])
+    except Exception as e:
+        # The next read rebuilds it
+        logger.error(f"Menu snapshot rebuild error for {restaurant_id}: {e}")
+
+
+async def drop_menu_snapshots(restaurant_ids: list):
+    """Remove snapshots of deleted or re-seeded restaurants"""
+    for restaurant_id in restaurant_ids:
+        _cache.pop(restaurant_id, None)
+    await db.menu_snapshots.delete_many({"restaurant_id": {"$in": list(restaurant_ids)}})
+
+
+def build_menu_document(restaurant_id: str, version: int, items: list, groups: list) -> dict:
+    """Snapshot content: categories (alphabetical) with their items and each item's add-on groups"""
+    groups_by_item = {}
+    for group in groups:
+        groups_by_item.setdefault(group["menu_item_id"], []).append(AddOnGroup(**group).dict())
+
+    categories = {}
+    for item in items:
+        entry = MenuItem(**item).dict()
+        entry["addon_groups"] = groups_by_item.get(entry["id"], [])
+        categories.setdefault(entry["category"], []).append(entry)
+
+    return {
+        "restaurant_id": restaurant_id,
+        "version": version,
+        "built_at": datetime.utcnow(),
+        "item_count": len(items),
+        "categories": [
+            {"name": name, "items": sorted(entries, key=lambda e: e["name"])}
+            for name, entries in sorted(categories.items())
+        ],
+    }
+
+
+def serialize_menu(document: dict) -> tuple:
+    """(body bytes, etag)"""
+    body = json.dumps(jsonable_encoder(document), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, f'"{document["version"]}-{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+async def _build_snapshot(restaurant_id: str, version: int) -> dict:
+    items = await db.menu_items.find({"restaurant_id": restaurant_id}, {"_id": 0}).to_list(None)
+    groups = await db.addon_groups.find({"restaurant_id": restaurant_id}, {"_id": 0}).to_list(None)
+    body, etag = serialize_menu(build_menu_document(restaurant_id, version, items, groups))
+    snapshot = {"restaurant_id": restaurant_id, "version": version, "etag": etag, "body": body,
+                "built_at": datetime.utcnow()}
+    try:
+        # Never overwrite a snapshot built for a newer version by a concurrent request
+        await db.menu_snapshots.update_one(
+            {"restaurant_id": restaurant_id, "version": {"$lte": version}},
+            {"$set": snapshot},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    logger.info(f"Built menu snapshot for {restaurant_id} v{version}: {len(items)} items, {len(body)} bytes")
+    return snapshot
+
+
+async def get_menu_snapshot(restaurant_id: str):
+    """{"version", "etag", "body"} for a restaurant's menu, or None if the restaurant does not exist"""
+    now = datetime.utcnow()
+    cached = _cache.get(restaurant_id)
+    if cached and (now - cached["checked_at"]).total_seconds() < MENU_VERSION_CHECK_SECONDS:
+        return cached
+
+    restaurant = await db.restaurants.find_one({"id": restaurant_id}, {"_id": 0, "menu_version": 1})
+    if not restaurant:
+        return None
+    version = restaurant.get("menu_version", 0)
+    if cached and cached["version"] == version:
+        cached["checked_at"] = now
+        return cached
+
+    snapshot = await db.menu_snapshots.find_one({"restaurant_id": restaurant_id, "version": version}, {"_id": 0})
+    if not snapshot:
+        snapshot = await _build_snapshot(restaurant_id, version)
+
+    if len(_cache) >= MAX_CACHED_MENUS:
+        _cache.clear()
+    entry = {"version": version, "etag": snapshot["etag"], "body": bytes(snapshot["body"]), "checked_at": now}
+    _cache[restaurant_id] = entry
+    return entry
@@ -0,0 +1,81 @@
+"""Idempotent data migrations run at startup"""
+import logging
+from datetime import datetime, timedelta
+from pymongo import UpdateMany, UpdateOne
+from database import db
+from routes.cities import CITY_LOCATOR
+from utils.coupons import parse_expiry
+from utils.notifications import NOTIFICATION_UNREAD_TTL_DAYS, NOTIFICATION_READ_TTL_DAYS
+
+logger = logging.getLogger("server")
+
+
+async def backfill_order_city_ids():
+    """Stamp city_id and restaurant coordinates on open orders created before they were denormalized"""
+    missing = {"city_id": {"$exists": False}, "order_status": {"$nin": ["delivered", "cancelled"]}}
+    restaurant_ids = await db.orders.distinct("restaurant_id", missing)
+    if not restaurant_ids:
+        return 0
+    restaurants = await db.restaurants.find(
+        {"id": {"$in": restaurant_ids}},
+        {"_id": 0, "id": 1, "city_id": 1, "address": 1, "lat": 1, "lng": 1}
+    ).to_list(len(restaurant_ids))
+
+    ops = []
+    for r in restaurants:
+        # Same fallback as create_order for restaurants without a position
+        lat, lng = CITY_LOCATOR.position_or_centre(r.get("city_id"), r.get("lat"), r.get("lng"))
+        ops.append(UpdateMany(
+            {"restaurant_id": r["id"], **missing},
+            {"$set": {
+                "city_id": r.get("city_id"),
+                "restaurant_address": r.get("address", ""),
+                "restaurant_lat": lat,
+                "restaurant_lng": lng,
+            }}
+        ))
+    if not ops:
+        return 0
+    result = await db.orders.bulk_write(ops, ordered=False)
+    logger.info(f"Backfilled city_id on {result.modified_count} orders")
+    return result.modified_count
+
+
+async def migrate_coupon_expiry():
+    """Convert coupon expires_at from ISO strings to datetimes so expiry can be queried and indexed"""
+    coupons = await db.coupons.find(
+        {"expires_at": {"$type": "string"}}, {"_id": 0, "id": 1, "expires_at": 1}
+    ).to_list(None)
+    ops = []
+    for coupon in coupons:
+        try:
+            expires_at = parse_expiry(coupon["expires_at"])
+        except Exception:
+            logger.warning(f"Coupon {coupon['id']} has an unreadable expires_at, clearing it: {coupon['expires_at']!r}")
+            expires_at = None
+        ops.append(UpdateOne({"id": coupon["id"]}, {"$set": {"expires_at": expires_at}}))
+    if not ops:
+        return 0
+    result = await db.coupons.bulk_write(ops, ordered=False)
+    logger.info(f"Converted expires_at to datetime on {result.modified_count} coupons")
+    return result.modified_count
+
+
+async def backfill_notification_expiry():
+    """Give notifications created before retention existed an expires_at so the TTL index can remove them"""
+    unread = await db.notifications.update_many(
+        {"expires_at": {"$exists": False}, "is_read": False},
+        [{"$set": {"expires_at": {"$add": [
+            {"$ifNull": ["$created_at", datetime.utcnow()]},
+            NOTIFICATION_UNREAD_TTL_DAYS * 86400 * 1000,
+        ]}}}]
+    )
+    # Read time is unknown for these: count it from now
+    read = await db.notifications.update_many(
+        {"expires_at": {"$exists": False}},
+        {"$set": {"expires_at": datetime.utcnow() + timedelta(days=NOTIFICATION_READ_TTL_DAYS)}}
+    )
+    total = unread.modified_count + read.modified_count
+    if total:
+        logger.info(f"Set expires_at on {total} notifications")
+    return total
@@ -0,0 +1,76 @@
+"""Optional archival of notifications to gzipped NDJSON files before the TTL index removes them"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from database import db
+
+logger = logging.getLogger("server")
+
+# Archival is off unless a directory is configured
+NOTIFICATION_ARCHIVE_DIR = os.environ.get("NOTIFICATION_ARCHIVE_DIR", "")
+NOTIFICATION_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("NOTIFICATION_ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Notifications expiring within this window are archived (must exceed the interval above)
+NOTIFICATION_ARCHIVE_LEAD_HOURS = int(os.environ.get("NOTIFICATION_ARCHIVE_LEAD_HOURS", "24"))
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def _encode(doc: dict) -> str:
+    return json.dumps(doc, ensure_ascii=False, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v))
+
+
+def _write_lines(path: Path, lines: list):
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+async def archive_notifications(archive_dir: str = None, now: datetime = None) -> int:
+    """Append notifications that are about to expire to <dir>/notifications-YYYYMMDD.ndjson.gz"""
+    archive_dir = archive_dir or NOTIFICATION_ARCHIVE_DIR
+    if not archive_dir:
+        return 0
+    now = now or datetime.utcnow()
+    directory = Path(archive_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"notifications-{now:%Y%m%d}.ndjson.gz"
+
+    query = {
+        "expires_at": {"$lte": now + timedelta(hours=NOTIFICATION_ARCHIVE_LEAD_HOURS)},
+        "archived_at": {"$exists": False},
+    }
+    cursor = db.notifications.find(query, {"_id": 0}).batch_size(ARCHIVE_BATCH_SIZE)
+    archived = 0
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= ARCHIVE_BATCH_SIZE:
+            archived += await _flush(path, batch, now)
+            batch = []
+    if batch:
+        archived += await _flush(path, batch, now)
+    if archived:
+        logger.info(f"Archived {archived} notifications to {path}")
+    return archived
+
+
+async def _flush(path: Path, batch: list, now: datetime) -> int:
+    # Written before marking, so a crash in between re-archives rather than loses documents
+    await asyncio.to_thread(_write_lines, path, [_encode(doc) for doc in batch])
+    await db.notifications.update_many(
+        {"id": {"$in": [doc["id"] for doc in batch]}},
+        {"$set": {"archived_at": now}}
+    )
+    return len(batch)
+
+
+async def run_notification_archiver():
+    """Background loop; only started when NOTIFICATION_ARCHIVE_DIR is set"""
+    while True:
+        try:
+            await archive_notifications()
+        except Exception as e:
+            logger.error(f"Notification archive error: {e}")
+        await asyncio.sleep(NOTIFICATION_ARCHIVE_INTERVAL_SECONDS)
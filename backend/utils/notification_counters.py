@@ -0,0 +1,110 @@
+"""Per-user unread notification counters, kept in step with notification writes"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReturnDocument
+from database import db
+
+logger = logging.getLogger("server")
+
+# How long a worker serves a user's count from memory before re-reading the counter
+UNREAD_COUNT_CACHE_SECONDS = float(os.environ.get("UNREAD_COUNT_CACHE_SECONDS", "5"))
+UNREAD_RECONCILE_INTERVAL_SECONDS = float(os.environ.get("UNREAD_RECONCILE_INTERVAL_SECONDS", "3600"))
+MAX_CACHED_USERS = 50000
+
+# user_id -> (count, cached_at)
+_cache = {}
+
+
+def _remember(user_id: str, count: int):
+    if len(_cache) >= MAX_CACHED_USERS:
+        _cache.clear()
+    _cache[user_id] = (count, datetime.utcnow())
+
+
+async def adjust_unread(user_id: str, delta: int):
+    """Add delta to a user's counter (never going below zero)"""
+    if not delta:
+        return
+    counter = await db.notification_counters.find_one_and_update(
+        {"user_id": user_id},
+        [{"$set": {
+            "unread": {"$max": [0, {"$add": [{"$ifNull": ["$unread", 0]}, delta]}]},
+            "updated_at": "$$NOW",
+        }}],
+        upsert=True,
+        projection={"_id": 0, "unread": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    _remember(user_id, counter["unread"])
+
+
+async def increment_unread_many(user_ids: list):
+    """+1 for each user in one bulk write (bulk notification fan-out)"""
+    if not user_ids:
+        return
+    now = datetime.utcnow()
+    await db.notification_counters.bulk_write(
+        [UpdateOne({"user_id": uid}, {"$inc": {"unread": 1}, "$set": {"updated_at": now}}, upsert=True)
+         for uid in user_ids],
+        ordered=False
+    )
+    for uid in user_ids:
+        _cache.pop(uid, None)
+
+
+async def get_unread(user_id: str) -> int:
+    cached = _cache.get(user_id)
+    if cached and (datetime.utcnow() - cached[1]).total_seconds() < UNREAD_COUNT_CACHE_SECONDS:
+        return cached[0]
+    counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0, "unread": 1})
+    count = counter["unread"] if counter else 0
+    _remember(user_id, count)
+    return count
+
+
+async def reconcile_unread_counters(window_start: datetime) -> int:
+    """Recount unread notifications and repair counters that drifted (expired notifications, crashes)"""
+    actual = {}
+    pipeline = [
+        {"$match": {"is_read": False, "created_at": {"$gte": window_start}}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+    ]
+    async for row in db.notifications.aggregate(pipeline):
+        actual[row["_id"]] = row["count"]
+
+    ops = []
+    seen = set()
+    async for counter in db.notification_counters.find({}, {"_id": 0, "user_id": 1, "unread": 1}):
+        seen.add(counter["user_id"])
+        expected = actual.get(counter["user_id"], 0)
+        if counter.get("unread") != expected:
+            ops.append(UpdateOne(
+                {"user_id": counter["user_id"], "unread": counter.get("unread")},
+                {"$set": {"unread": expected, "updated_at": datetime.utcnow()}}
+            ))
+    for user_id, count in actual.items():
+        if user_id not in seen:
+            ops.append(UpdateOne(
+                {"user_id": user_id},
+                {"$setOnInsert": {"unread": count, "updated_at": datetime.utcnow()}},
+                upsert=True
+            ))
+    if not ops:
+        return 0
+    result = await db.notification_counters.bulk_write(ops, ordered=False)
+    repaired = result.modified_count + result.upserted_count
+    if repaired:
+        logger.info(f"Repaired {repaired} unread notification counters")
+    return repaired
+
+
+async def run_unread_reconciler(window_days: int):
+    """Background loop that keeps the counters honest"""
+    while True:
+        try:
+            await reconcile_unread_counters(datetime.utcnow() - timedelta(days=window_days))
+        except Exception as e:
+            logger.error(f"Unread counter reconcile error: {e}")
+        await asyncio.sleep(UNREAD_RECONCILE_INTERVAL_SECONDS)
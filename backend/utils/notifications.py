@@ -1,17 +1,61 @@
 """Push notification and in-app notification utilities"""
+import asyncio
 import logging
+import os
 import httpx
-from datetime import datetime
+from datetime import datetime, timedelta
 from database import db
 from models.schemas import Notification
+from utils.notification_counters import adjust_unread, increment_unread_many
+from utils.push_receipts import record_push_tickets
 
 logger = logging.getLogger("server")
 
-EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+EXPO_PUSH_URL = os.environ.get("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+# Expo accepts at most 100 messages per request
+EXPO_BATCH_SIZE = 100
 
+# Retention: notifications are removed by the TTL index on expires_at.
+# Unread ones live this long after creation...
+NOTIFICATION_UNREAD_TTL_DAYS = int(os.environ.get("NOTIFICATION_UNREAD_TTL_DAYS", "90"))
+# ...and read ones this long after being read
+NOTIFICATION_READ_TTL_DAYS = int(os.environ.get("NOTIFICATION_READ_TTL_DAYS", "14"))
+# Listing and unread counts only look at notifications newer than this
+NOTIFICATION_WINDOW_DAYS = int(os.environ.get("NOTIFICATION_WINDOW_DAYS", "30"))
+# Updates about the same order within this many seconds are merged (stored and pushed once)
+NOTIFICATION_COALESCE_SECONDS = float(os.environ.get("NOTIFICATION_COALESCE_SECONDS", "20"))
+COALESCE_TYPES = {"order_update", "order_status"}
+MAX_PUSH_WINDOWS = 10000
 
-async def create_notification(user_id: str, title: str, body: str, notif_type: str, data: dict = None):
-    """Create a notification for a user AND send push notification"""
+# Push coalescing state per (user, type, order): {"sent_at": loop time, "pending": args of the trailing push}
+_push_windows = {}
+_push_tasks = set()
+
+
+def read_expiry(now: datetime = None) -> datetime:
+    """expires_at for a notification being marked read now"""
+    return (now or datetime.utcnow()) + timedelta(days=NOTIFICATION_READ_TTL_DAYS)
+
+
+def notification_window_start(now: datetime = None) -> datetime:
+    return (now or datetime.utcnow()) - timedelta(days=NOTIFICATION_WINDOW_DAYS)
+
+
+def coalesce_key(notif_type: str, data: dict = None):
+    """(type, order) key for notifications that supersede each other, or None"""
+    if notif_type not in COALESCE_TYPES or not data:
+        return None
+    order_id = data.get("order_id") or data.get("orderId")
+    return f"{notif_type}:{order_id}" if order_id else None
+
+
+async def store_notification(user_id: str, title: str, body: str, notif_type: str, data: dict = None):
+    """Persist an in-app notification (no push).
+
+    An update for the same order arriving within the coalescing window replaces the
+    user's still-unread notification instead of adding another one; an exact repeat
+    (same status) is dropped and None is returned.
+    """
     notification = Notification(
         user_id=user_id,
         title=title,
@@ -19,94 +63,219 @@ async def create_notification(user_id: str, title: str, body: str, notif_type: s
         type=notif_type,
         data=data
     )
-    await db.notifications.insert_one(notification.dict())
+    doc = notification.dict()
+    doc["expires_at"] = notification.created_at + timedelta(days=NOTIFICATION_UNREAD_TTL_DAYS)
+
+    key = coalesce_key(notif_type, data)
+    if key:
+        doc["coalesce_key"] = key
+        recent = {
+            "user_id": user_id,
+            "coalesce_key": key,
+            "is_read": False,
+            "created_at": {"$gte": notification.created_at - timedelta(seconds=NOTIFICATION_COALESCE_SECONDS)},
+        }
+        status = (data or {}).get("status")
+        if status and await db.notifications.find_one({**recent, "data.status": status}, {"_id": 1}):
+            return None
+        merged = await db.notifications.find_one_and_update(
+            recent,
+            {"$set": {"title": title, "body": body, "data": data,
+                      "created_at": notification.created_at, "expires_at": doc["expires_at"]},
+             "$inc": {"coalesced_count": 1}},
+            projection={"_id": 0, "id": 1},
+        )
+        if merged:
+            notification.id = merged["id"]
+            return notification
 
-    channel_id = "default"
+    await db.notifications.insert_one(doc)
+    await adjust_unread(user_id, 1)
+    return notification
+
+
+def _push_data(notif_type: str, data: dict = None) -> dict:
+    """Push payload: the notification data plus the screen the app should open"""
+    push_data = data or {}
+    if notif_type == "new_order":
+        push_data["screen"] = "RestaurantOrders"
+    elif notif_type == "order_ready":
+        push_data["screen"] = "MyOrders"
+    elif notif_type == "order_status":
+        push_data["screen"] = "Orders"
+    return push_data
+
+
+def _push_channel(notif_type: str) -> str:
     if notif_type in ["new_order", "order_ready"]:
-        channel_id = "new-orders"
-    elif notif_type in ["order_status", "order_update", "complaint_update"]:
-        channel_id = "order-updates"
+        return "new-orders"
+    if notif_type in ["order_status", "order_update", "complaint_update"]:
+        return "order-updates"
+    return "default"
+
+
+async def _send_coalesced_push(key: str, user_id: str, title: str, body: str, data: dict, channel_id: str):
+    """First push for a key goes out at once; later ones inside the window collapse into one trailing push"""
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    state = _push_windows.get(key)
+    if state is None or now - state["sent_at"] >= NOTIFICATION_COALESCE_SECONDS:
+        if len(_push_windows) >= MAX_PUSH_WINDOWS:
+            for stale in [k for k, v in _push_windows.items()
+                          if now - v["sent_at"] >= NOTIFICATION_COALESCE_SECONDS and not v["pending"]]:
+                _push_windows.pop(stale, None)
+        _push_windows[key] = {"sent_at": now, "pending": None}
+        await send_push_to_user(user_id, title, body, data, channel_id)
+        return
+
+    schedule = state["pending"] is None
+    # The latest update wins
+    state["pending"] = (user_id, title, body, data, channel_id)
+    if schedule:
+        task = asyncio.create_task(_flush_push_window(key, state["sent_at"] + NOTIFICATION_COALESCE_SECONDS - now))
+        _push_tasks.add(task)
+        task.add_done_callback(_push_tasks.discard)
 
+
+async def _flush_push_window(key: str, delay: float):
+    await asyncio.sleep(delay)
+    state = _push_windows.get(key)
+    if not state or not state["pending"]:
+        return
+    pending, state["pending"] = state["pending"], None
+    state["sent_at"] = asyncio.get_running_loop().time()
     try:
-        push_data = data or {}
-        if notif_type == "new_order":
-            push_data["screen"] = "RestaurantOrders"
-        elif notif_type == "order_ready":
-            push_data["screen"] = "MyOrders"
-        elif notif_type == "order_status":
-            push_data["screen"] = "Orders"
-
-        await send_push_to_user(user_id, title, body, push_data, channel_id)
+        await send_push_to_user(*pending)
+    except Exception as e:
+        logger.error(f"Failed to send coalesced push: {e}")
+
+
+async def create_notification(user_id: str, title: str, body: str, notif_type: str, data: dict = None):
+    """Create a notification for a user AND send push notification"""
+    notification = await store_notification(user_id, title, body, notif_type, data)
+    if notification is None:
+        # Same update already delivered moments ago
+        return None
+
+    try:
+        push_data = _push_data(notif_type, data)
+        key = coalesce_key(notif_type, data)
+        if key:
+            await _send_coalesced_push(f"{user_id}:{key}", user_id, title, body, push_data, _push_channel(notif_type))
+        else:
+            await send_push_to_user(user_id, title, body, push_data, _push_channel(notif_type))
     except Exception as e:
         logger.error(f"Failed to send push for notification: {e}")
 
     return notification
 
 
-async def send_push_notification(token: str, title: str, body: str, data: dict = None, channel_id: str = "default"):
-    """Send a push notification via Expo Push Service"""
+async def create_notifications_bulk(user_ids: list, title: str, body: str, notif_type: str, data: dict = None) -> int:
+    """Same notification for many users: one insert_many, one counter bulk_write and batched pushes"""
+    user_ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+    if not user_ids:
+        return 0
+    now = datetime.utcnow()
+    docs = []
+    for user_id in user_ids:
+        doc = Notification(user_id=user_id, title=title, body=body, type=notif_type, data=data, created_at=now).dict()
+        doc["expires_at"] = now + timedelta(days=NOTIFICATION_UNREAD_TTL_DAYS)
+        docs.append(doc)
+    await db.notifications.insert_many(docs, ordered=False)
+    await increment_unread_many(user_ids)
+
     try:
-        notification_payload = {
-            "to": token,
-            "title": title,
-            "body": body,
-            "sound": "default",
-            "priority": "high",
-            "channelId": channel_id,
-        }
-        if data:
-            notification_payload["data"] = data
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                EXPO_PUSH_URL,
-                headers={
-                    "Accept": "application/json",
-                    "Accept-Encoding": "gzip, deflate",
-                    "Content-Type": "application/json",
-                },
-                json=notification_payload,
-                timeout=30.0,
-            )
-            result = response.json()
-            logger.info(f"Push notification sent: {result}")
-            return result
+        await send_push_to_users(user_ids, title, body, _push_data(notif_type, dict(data or {})), _push_channel(notif_type))
     except Exception as e:
-        logger.error(f"Error sending push notification: {e}")
-        return None
+        logger.error(f"Failed to send bulk push for notification: {e}")
+    return len(docs)
+
+
+def _push_message(token: str, title: str, body: str, data: dict = None, channel_id: str = "default") -> dict:
+    message = {
+        "to": token,
+        "title": title,
+        "body": body,
+        "sound": "default",
+        "priority": "high",
+        "channelId": channel_id,
+    }
+    if data:
+        message["data"] = data
+    return message
+
+
+async def send_push_batch(messages: list) -> list:
+    """Send push messages to Expo in chunks of EXPO_BATCH_SIZE; returns the tickets in message order"""
+    tickets = []
+    if not messages:
+        return tickets
+    async with httpx.AsyncClient() as client:
+        for i in range(0, len(messages), EXPO_BATCH_SIZE):
+            chunk = messages[i:i + EXPO_BATCH_SIZE]
+            try:
+                response = await client.post(
+                    EXPO_PUSH_URL,
+                    headers={
+                        "Accept": "application/json",
+                        "Accept-Encoding": "gzip, deflate",
+                        "Content-Type": "application/json",
+                    },
+                    json=chunk,
+                    timeout=30.0,
+                )
+                chunk_tickets = response.json().get("data") or []
+            except Exception as e:
+                logger.error(f"Error sending push batch: {e}")
+                chunk_tickets = []
+            # Keep tickets aligned with messages even if Expo rejected the whole request
+            chunk_tickets = list(chunk_tickets) + [None] * (len(chunk) - len(chunk_tickets))
+            tickets.extend(chunk_tickets[:len(chunk)])
+    logger.info(f"Push batch sent: {len(messages)} messages")
+    try:
+        await record_push_tickets(messages, tickets)
+    except Exception as e:
+        logger.error(f"Failed to record push tickets: {e}")
+    return tickets
+
+
+async def send_push_notification(token: str, title: str, body: str, data: dict = None, channel_id: str = "default"):
+    """Send a push notification via Expo Push Service"""
+    tickets = await send_push_batch([_push_message(token, title, body, data, channel_id)])
+    return tickets[0] if tickets else None
+
+
+async def send_push_to_users(user_ids: list, title: str, body: str, data: dict = None, channel_id: str = "default"):
+    """Send one push to all active devices of the given users, batched"""
+    tokens = await db.push_tokens.find(
+        {"user_id": {"$in": list(user_ids)}, "is_active": True}, {"_id": 1, "token": 1}
+    ).to_list(None)
+    if not tokens:
+        return []
+    tickets = await send_push_batch([_push_message(t["token"], title, body, data, channel_id) for t in tokens])
+    await db.push_tokens.update_many(
+        {"_id": {"$in": [t["_id"] for t in tokens]}},
+        {"$set": {"last_used": datetime.utcnow()}}
+    )
+    return tickets
 
 
 async def send_push_to_user(user_id: str, title: str, body: str, data: dict = None, channel_id: str = "default"):
     """Send push notification to all devices of a user"""
-    tokens = await db.push_tokens.find({"user_id": user_id, "is_active": True}).to_list(length=10)
-
-    results = []
-    for token_doc in tokens:
-        result = await send_push_notification(token_doc["token"], title, body, data, channel_id)
-        results.append(result)
-        await db.push_tokens.update_one(
-            {"_id": token_doc["_id"]},
-            {"$set": {"last_used": datetime.utcnow()}}
-        )
+    return await send_push_to_users([user_id], title, body, data, channel_id)
 
-    return results
+
+async def online_driver_ids(city_id: str = None) -> list:
+    query = {"role": "driver", "is_online": True}
+    if city_id:
+        query["city_id"] = city_id
+    drivers = await db.users.find(query, {"_id": 0, "id": 1}).to_list(None)
+    return [d["id"] for d in drivers]
 
 
 async def send_push_to_drivers_in_city(city_id: str, title: str, body: str, data: dict = None):
     """Send push notification to all online drivers in a city"""
-    drivers = await db.users.find({
-        "role": "driver",
-        "is_online": True,
-    }).to_list(length=100)
-
-    results = []
-    for driver in drivers:
-        driver_results = await send_push_to_user(
-            driver["id"], title, body, data, channel_id="new-orders"
-        )
-        results.extend(driver_results)
-
-    return results
+    return await send_push_to_users(await online_driver_ids(city_id), title, body, data, channel_id="new-orders")
 
 
 async def notify_customer_order_status(order: dict, new_status: str):
@@ -129,6 +298,7 @@ async def notify_customer_order_status(order: dict, new_status: str):
     data = {
         "screen": "Orders",
         "orderId": order["id"],
+        "order_id": order["id"],
         "type": "order_update",
         "status": new_status
     }
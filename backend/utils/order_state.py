@@ -0,0 +1,154 @@
+"""Order state machine: allowed status transitions applied as single compare-and-set updates"""
+from datetime import datetime
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from database import db
+from utils.tracking import update_tracking_order
+from utils.coupons import release_coupon
+
+# target status -> statuses an order may be in to move there
+ALLOWED_FROM = {
+    "accepted": {"pending"},
+    "preparing": {"pending", "accepted", "driver_assigned"},
+    "ready": {"pending", "accepted", "preparing", "driver_assigned"},
+    "driver_assigned": {"pending", "accepted", "preparing", "ready"},
+    "picked_up": {"driver_assigned", "ready"},
+    "out_for_delivery": {"driver_assigned", "ready", "picked_up"},
+    "delivered": {"picked_up", "out_for_delivery"},
+    "cancelled": {"pending", "accepted", "preparing", "ready", "driver_assigned"},
+}
+
+# Each order keeps only its most recent events embedded
+STATUS_HISTORY_LIMIT = 50
+
+# Measured stages: (name, start status, end status)
+ORDER_STAGES = [
+    ("accept", "pending", "accepted"),
+    ("prep", "accepted", "ready"),
+    ("driver_assign", "ready", "driver_assigned"),
+    ("pickup", "driver_assigned", "picked_up"),
+    ("delivery", "picked_up", "delivered"),
+    ("total", "pending", "delivered"),
+]
+
+STATUS_LABELS = {
+    "pending": "بانتظار القبول",
+    "accepted": "مقبول",
+    "preparing": "قيد التحضير",
+    "ready": "جاهز",
+    "driver_assigned": "تم تعيين سائق",
+    "picked_up": "تم الاستلام",
+    "out_for_delivery": "في الطريق",
+    "delivered": "تم التوصيل",
+    "cancelled": "ملغي",
+}
+
+
+def order_event(status: str, actor: dict = None, location: dict = None, at: datetime = None) -> dict:
+    """One entry of an order's status_history"""
+    event = {
+        "status": status,
+        "at": at or datetime.utcnow(),
+        "actor_id": actor.get("id") if actor else None,
+        "actor_role": actor.get("role") if actor else None,
+    }
+    if location and location.get("lat") is not None and location.get("lng") is not None:
+        event["lat"] = location["lat"]
+        event["lng"] = location["lng"]
+    return event
+
+
+def stage_durations(stage_timestamps: dict) -> dict:
+    """Seconds spent in each measured stage (stages with missing or out-of-order stamps are skipped)"""
+    result = {}
+    for name, start, end in ORDER_STAGES:
+        started = stage_timestamps.get(start)
+        ended = stage_timestamps.get(end)
+        if started and ended and ended >= started:
+            result[name] = (ended - started).total_seconds()
+    return result
+
+
+def stage_duration_fields() -> dict:
+    """$project expressions giving each stage's duration in minutes, null like stage_durations skips it"""
+    fields = {}
+    for name, start, end in ORDER_STAGES:
+        started = f"$stage_timestamps.{start}"
+        ended = f"$stage_timestamps.{end}"
+        fields[name] = {"$cond": [
+            {"$and": [started, ended, {"$gte": [ended, started]}]},
+            {"$divide": [{"$subtract": [ended, started]}, 60000]},
+            None,
+        ]}
+    return fields
+
+
+async def transition_order(
+    order_id: str,
+    to_status: str,
+    match: dict = None,
+    conditions: dict = None,
+    from_statuses=None,
+    set_fields: dict = None,
+    unset_fields: dict = None,
+    add_to_set: dict = None,
+    allow_same: bool = False,
+    conflict_detail: str = None,
+    actor: dict = None,
+    location: dict = None,
+) -> dict:
+    """Move an order to to_status in one conditional find_one_and_update.
+
+    match:         ownership filter (e.g. restaurant_id / user_id); no match -> 404
+    conditions:    extra guards that may lose a race (e.g. driver still unassigned); no match -> 409
+    from_statuses: further restricts ALLOWED_FROM for this caller
+    actor/location: recorded in the status_history event written by the same update
+    Returns the updated order document (without _id).
+    """
+    if to_status not in ALLOWED_FROM:
+        raise HTTPException(status_code=400, detail="حالة غير صالحة")
+
+    allowed = set(ALLOWED_FROM[to_status])
+    if from_statuses is not None:
+        allowed &= set(from_statuses)
+    if allow_same:
+        allowed.add(to_status)
+
+    query = {"id": order_id, **(match or {}), **(conditions or {}), "order_status": {"$in": sorted(allowed)}}
+    now = datetime.utcnow()
+    update = {
+        "$set": {**(set_fields or {}), "order_status": to_status, "updated_at": now},
+        # First time the order reached each status; the full sequence is in status_history
+        "$min": {f"stage_timestamps.{to_status}": now},
+        "$push": {"status_history": {
+            "$each": [order_event(to_status, actor, location, now)],
+            "$slice": -STATUS_HISTORY_LIMIT,
+        }},
+    }
+    if unset_fields:
+        update["$unset"] = unset_fields
+    if add_to_set:
+        update["$addToSet"] = add_to_set
+
+    order = await db.orders.find_one_and_update(
+        query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if order:
+        # Live tracking polls see the new status immediately
+        update_tracking_order(order)
+        if to_status == "cancelled" and order.get("coupon_redemption_id"):
+            # A cancelled order gives its coupon use back
+            await release_coupon(order["coupon_redemption_id"])
+        return order
+
+    # Failure path only: tell a missing order apart from a lost race / invalid transition
+    current = await db.orders.find_one({"id": order_id, **(match or {})}, {"_id": 0, "order_status": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="الطلب غير موجود")
+    if conflict_detail is None:
+        current_status = current.get("order_status")
+        conflict_detail = (
+            f"لا يمكن نقل الطلب من حالة \"{STATUS_LABELS.get(current_status, current_status)}\" "
+            f"إلى \"{STATUS_LABELS.get(to_status, to_status)}\""
+        )
+    raise HTTPException(status_code=409, detail=conflict_detail)
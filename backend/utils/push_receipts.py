@@ -0,0 +1,200 @@
+"""Expo push tickets and receipts: delivery stats per channel and pruning of dead device tokens"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+import httpx
+from pymongo import UpdateOne
+from database import db
+
+logger = logging.getLogger("server")
+
+EXPO_RECEIPTS_URL = os.environ.get("EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts")
+# Expo makes receipts available some time after sending; they are kept for about a day
+PUSH_RECEIPT_DELAY_MINUTES = int(os.environ.get("PUSH_RECEIPT_DELAY_MINUTES", "15"))
+PUSH_RECEIPT_INTERVAL_SECONDS = float(os.environ.get("PUSH_RECEIPT_INTERVAL_SECONDS", "300"))
+# A batch claimed by a worker is left to it for this long; tickets still waiting for a receipt
+# stay claimed until then, so each run moves on to newer tickets instead of re-reading them
+PUSH_RECEIPT_CLAIM_SECONDS = float(os.environ.get("PUSH_RECEIPT_CLAIM_SECONDS", str(PUSH_RECEIPT_INTERVAL_SECONDS)))
+# Tickets whose receipt never showed up are dropped by the TTL index after this long
+PUSH_TICKET_TTL_HOURS = 24
+# Expo accepts at most 1000 receipt ids per request
+RECEIPT_BATCH_SIZE = 1000
+
+DEAD_TOKEN_ERRORS = {"DeviceNotRegistered"}
+
+
+def _stats_update(channel_id: str, day: str, field: str, count: int) -> UpdateOne:
+    return UpdateOne(
+        {"day": day, "channel_id": channel_id},
+        {"$inc": {field: count}},
+        upsert=True
+    )
+
+
+async def deactivate_tokens(tokens: set, reason: str) -> int:
+    if not tokens:
+        return 0
+    result = await db.push_tokens.update_many(
+        {"token": {"$in": list(tokens)}, "is_active": True},
+        {"$set": {"is_active": False, "deactivated_reason": reason, "deactivated_at": datetime.utcnow()}}
+    )
+    if result.modified_count:
+        logger.info(f"Deactivated {result.modified_count} push tokens ({reason})")
+    return result.modified_count
+
+
+async def record_push_tickets(messages: list, tickets: list):
+    """Store ok tickets for the receipt poller; tickets that already failed are counted (and dead tokens pruned) now"""
+    now = datetime.utcnow()
+    day = now.strftime("%Y-%m-%d")
+    pending = []
+    counts = {}
+    dead = set()
+    for message, ticket in zip(messages, tickets):
+        channel_id = message.get("channelId", "default")
+        channel = counts.setdefault(channel_id, {"sent": 0, "ticket_errors": 0})
+        channel["sent"] += 1
+        if ticket and ticket.get("status") == "ok" and ticket.get("id"):
+            pending.append({
+                "ticket_id": ticket["id"],
+                "token": message["to"],
+                "channel_id": channel_id,
+                "created_at": now,
+                "expires_at": now + timedelta(hours=PUSH_TICKET_TTL_HOURS),
+            })
+        else:
+            channel["ticket_errors"] += 1
+            error = ((ticket or {}).get("details") or {}).get("error")
+            if error in DEAD_TOKEN_ERRORS:
+                dead.add(message["to"])
+
+    if pending:
+        await db.push_tickets.insert_many(pending, ordered=False)
+    ops = [
+        _stats_update(channel_id, day, field, count)
+        for channel_id, fields in counts.items()
+        for field, count in fields.items() if count
+    ]
+    if ops:
+        await db.push_delivery_stats.bulk_write(ops, ordered=False)
+    await deactivate_tokens(dead, "DeviceNotRegistered")
+
+
+async def _fetch_receipts(client: httpx.AsyncClient, ticket_ids: list) -> dict:
+    response = await client.post(
+        EXPO_RECEIPTS_URL,
+        headers={"Accept": "application/json", "Content-Type": "application/json"},
+        json={"ids": ticket_ids},
+        timeout=30.0,
+    )
+    return response.json().get("data") or {}
+
+
+def classify_receipts(tickets: list, receipts: dict, now: datetime):
+    """Split fetched receipts into finished ticket ids, per-channel delivered/failed counts and dead tokens"""
+    done = []
+    counts = {}
+    dead = set()
+    for ticket in tickets:
+        receipt = receipts.get(ticket["ticket_id"])
+        if receipt is None:
+            # Not available yet; given up on once it is almost as old as Expo keeps receipts
+            if ticket["created_at"] <= now - timedelta(hours=PUSH_TICKET_TTL_HOURS - 1):
+                done.append(ticket["ticket_id"])
+            continue
+        done.append(ticket["ticket_id"])
+        channel = counts.setdefault(ticket["channel_id"], {"delivered": 0, "failed": 0})
+        if receipt.get("status") == "ok":
+            channel["delivered"] += 1
+            continue
+        channel["failed"] += 1
+        error = (receipt.get("details") or {}).get("error")
+        if error in DEAD_TOKEN_ERRORS:
+            dead.add(ticket["token"])
+        else:
+            logger.warning(f"Push receipt error for ticket {ticket['ticket_id']}: {receipt.get('message')}")
+    return done, counts, dead
+
+
+async def _claim_tickets(cutoff: datetime, now: datetime) -> list:
+    """Claim the oldest unclaimed batch for this worker
+
+    Returns the tickets it actually won (possibly none if another worker was faster), or None
+    when nothing is left to claim.
+    """
+    claimable = {
+        "created_at": {"$lte": cutoff},
+        "$or": [
+            {"claimed_at": None},
+            {"claimed_at": {"$lte": now - timedelta(seconds=PUSH_RECEIPT_CLAIM_SECONDS)}},
+        ],
+    }
+    candidates = await db.push_tickets.find(
+        claimable, {"_id": 0, "ticket_id": 1}
+    ).sort("created_at", 1).limit(RECEIPT_BATCH_SIZE).to_list(RECEIPT_BATCH_SIZE)
+    if not candidates:
+        return None
+    claim = str(uuid.uuid4())
+    ids = [t["ticket_id"] for t in candidates]
+    # Another worker may have claimed some of them in the meantime; the filter leaves those alone
+    await db.push_tickets.update_many(
+        {"ticket_id": {"$in": ids}, **claimable},
+        {"$set": {"claimed_at": now, "claimed_by": claim}}
+    )
+    return await db.push_tickets.find(
+        {"ticket_id": {"$in": ids}, "claimed_by": claim}, {"_id": 0}
+    ).to_list(RECEIPT_BATCH_SIZE)
+
+
+async def process_push_receipts(now: datetime = None) -> dict:
+    """Fetch receipts for tickets old enough to have one, update stats and deactivate dead tokens
+
+    Each batch is claimed first, so with several workers every ticket is fetched and counted once.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(minutes=PUSH_RECEIPT_DELAY_MINUTES)
+    summary = {"checked": 0, "ok": 0, "errors": 0, "deactivated": 0}
+
+    async with httpx.AsyncClient() as client:
+        while True:
+            tickets = await _claim_tickets(cutoff, now)
+            if tickets is None:
+                break
+            if not tickets:
+                continue
+            receipts = await _fetch_receipts(client, [t["ticket_id"] for t in tickets])
+
+            done, counts, dead = classify_receipts(tickets, receipts, now)
+            for fields in counts.values():
+                summary["ok"] += fields["delivered"]
+                summary["errors"] += fields["failed"]
+            summary["checked"] += len(done)
+
+            day = now.strftime("%Y-%m-%d")
+            ops = [
+                _stats_update(channel_id, day, field, count)
+                for channel_id, fields in counts.items()
+                for field, count in fields.items() if count
+            ]
+            if ops:
+                await db.push_delivery_stats.bulk_write(ops, ordered=False)
+            summary["deactivated"] += await deactivate_tokens(dead, "DeviceNotRegistered")
+            if done:
+                await db.push_tickets.delete_many({"ticket_id": {"$in": done}})
+            # The rest wait for their receipts under this claim and are retried once it expires
+
+    if summary["checked"]:
+        logger.info(f"Push receipts processed: {summary}")
+    return summary
+
+
+async def run_push_receipt_poller():
+    """Background loop that processes Expo push receipts"""
+    while True:
+        await asyncio.sleep(PUSH_RECEIPT_INTERVAL_SECONDS)
+        try:
+            await process_push_receipts()
+        except Exception as e:
+            logger.error(f"Push receipt processing error: {e}")
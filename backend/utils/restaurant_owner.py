@@ -0,0 +1,46 @@
+"""The restaurant owned by the current user, cached per worker for the polling restaurant panel"""
+import copy
+import logging
+import os
+from datetime import datetime
+from fastapi import Depends, HTTPException
+from database import db
+from utils.auth import get_current_user
+
+logger = logging.getLogger("server")
+
+# Changes made through another worker (or by admins) are picked up after at most this long
+RESTAURANT_CACHE_SECONDS = float(os.environ.get("RESTAURANT_CACHE_SECONDS", "15"))
+MAX_CACHED_RESTAURANTS = 5000
+
+# owner_id -> (restaurant, cached_at)
+_cache = {}
+
+
+def invalidate_restaurant(restaurant_id: str = None, owner_id: str = None):
+    """Forget a cached restaurant after it was changed, by restaurant id or by owner"""
+    if owner_id:
+        _cache.pop(owner_id, None)
+    if restaurant_id:
+        for key in [key for key, (r, _) in _cache.items() if r["id"] == restaurant_id]:
+            _cache.pop(key, None)
+
+
+async def get_current_restaurant(current_user: dict = Depends(get_current_user)) -> dict:
+    """Dependency for restaurant panel routes: the caller must be a restaurant owner with a restaurant"""
+    if current_user.get("role") != "restaurant":
+        raise HTTPException(status_code=403, detail="غير مصرح")
+
+    cached = _cache.get(current_user["id"])
+    if cached and (datetime.utcnow() - cached[1]).total_seconds() < RESTAURANT_CACHE_SECONDS:
+        restaurant = cached[0]
+    else:
+        restaurant = await db.restaurants.find_one({"owner_id": current_user["id"]}, {"_id": 0})
+        if not restaurant:
+            _cache.pop(current_user["id"], None)
+            raise HTTPException(status_code=404, detail="لا يوجد مطعم مرتبط بحسابك")
+        if len(_cache) >= MAX_CACHED_RESTAURANTS:
+            _cache.clear()
+        _cache[current_user["id"]] = (restaurant, datetime.utcnow())
+    # Handlers may modify what they get; the cached document must stay intact
+    return copy.deepcopy(restaurant)
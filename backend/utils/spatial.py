@@ -0,0 +1,118 @@
+"""Precomputed spatial lookup for resolving coordinates to cities and districts"""
+import math
+from utils.helpers import calculate_distance
+
+# Districts farther than this from the GPS point are not reported
+DISTRICT_MAX_DISTANCE_KM = 6.0
+
+
+def _to_unit_vector(lat: float, lng: float) -> tuple:
+    """Project lat/lng onto the unit sphere; chord length is monotonic in great-circle distance"""
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+class KDTree:
+    """Static 3-d tree over points on the unit sphere for exact nearest-neighbour queries"""
+
+    def __init__(self, entries: list):
+        # entries: list of (lat, lng, payload)
+        nodes = [(_to_unit_vector(lat, lng), lat, lng, payload) for lat, lng, payload in entries]
+        self.root = self._build(nodes, 0)
+
+    def _build(self, nodes: list, depth: int):
+        if not nodes:
+            return None
+        axis = depth % 3
+        nodes.sort(key=lambda n: n[0][axis])
+        mid = len(nodes) // 2
+        return {
+            "node": nodes[mid],
+            "axis": axis,
+            "left": self._build(nodes[:mid], depth + 1),
+            "right": self._build(nodes[mid + 1:], depth + 1),
+        }
+
+    def nearest(self, lat: float, lng: float):
+        """Return (payload, distance_km) of the closest point, or (None, inf) when empty"""
+        if self.root is None:
+            return None, float("inf")
+        target = _to_unit_vector(lat, lng)
+        best = [None, float("inf")]
+
+        def search(branch):
+            if branch is None:
+                return
+            vec, _, _, _ = branch["node"]
+            dist_sq = (vec[0] - target[0]) ** 2 + (vec[1] - target[1]) ** 2 + (vec[2] - target[2]) ** 2
+            if dist_sq < best[1]:
+                best[0], best[1] = branch["node"], dist_sq
+            diff = target[branch["axis"]] - vec[branch["axis"]]
+            near, far = (branch["left"], branch["right"]) if diff < 0 else (branch["right"], branch["left"])
+            search(near)
+            if diff * diff < best[1]:
+                search(far)
+
+        search(self.root)
+        _, node_lat, node_lng, payload = best[0]
+        return payload, calculate_distance(lat, lng, node_lat, node_lng)
+
+
+class CityLocator:
+    """Resolves a coordinate to its nearest city and district using prebuilt k-d trees"""
+
+    def __init__(self, cities: list):
+        self.cities_by_id = {city["id"]: city for city in cities}
+        self.city_tree = KDTree([(c["lat"], c["lng"], c) for c in cities])
+        self.district_trees = {
+            city["id"]: KDTree([
+                (d["lat"], d["lng"], d) for d in city.get("districts", [])
+                if d.get("lat") is not None and d.get("lng") is not None
+            ])
+            for city in cities
+        }
+
+    def get_city(self, city_id: str):
+        return self.cities_by_id.get(city_id)
+
+    def get_district(self, city_id: str, district_id: str):
+        city = self.cities_by_id.get(city_id)
+        if not city:
+            return None
+        return next((d for d in city.get("districts", []) if d["id"] == district_id), None)
+
+    def position_or_centre(self, city_id: str, lat: float, lng: float) -> tuple:
+        """Return (lat, lng), falling back to the city centre when the position is missing"""
+        if (not lat or not lng) and city_id:
+            city = self.cities_by_id.get(city_id)
+            if city:
+                return city["lat"], city["lng"]
+        return lat, lng
+
+    def nearest_city(self, lat: float, lng: float):
+        """Return (city, distance_km) of the closest city"""
+        return self.city_tree.nearest(lat, lng)
+
+    def nearest_district(self, city_id: str, lat: float, lng: float, max_distance_km: float = DISTRICT_MAX_DISTANCE_KM):
+        """Return (district, distance_km) within a city, or (None, distance) if too far"""
+        tree = self.district_trees.get(city_id)
+        if tree is None:
+            return None, float("inf")
+        district, distance = tree.nearest(lat, lng)
+        if distance > max_distance_km:
+            return None, distance
+        return district, distance
+
+    def locate(self, lat: float, lng: float) -> dict:
+        """Resolve a coordinate to city and district"""
+        city, city_distance = self.nearest_city(lat, lng)
+        district, district_distance = (None, float("inf"))
+        if city:
+            district, district_distance = self.nearest_district(city["id"], lat, lng)
+        return {
+            "city": city,
+            "city_distance_km": city_distance,
+            "district": district,
+            "district_distance_km": district_distance if district else None,
+        }
@@ -0,0 +1,114 @@
+"""In-memory order tracking snapshots so live tracking polls do not hit Mongo"""
+import logging
+import os
+from datetime import datetime
+from database import db
+from utils.location_store import peek_driver_location, get_driver_location
+
+logger = logging.getLogger("server")
+
+# A snapshot is re-read from Mongo after this long (catches changes made by other workers)
+TRACKING_SNAPSHOT_TTL_SECONDS = float(os.environ.get("TRACKING_SNAPSHOT_TTL_SECONDS", "15"))
+# Driver position is re-read after this long unless this worker received a ping within that time
+TRACKING_LOCATION_TTL_SECONDS = float(os.environ.get("TRACKING_LOCATION_TTL_SECONDS", "5"))
+MAX_SNAPSHOTS = 20000
+
+ORDER_FIELDS = [
+    "id", "user_id", "restaurant_id", "restaurant_name", "driver_id", "order_status", "city_id",
+    "restaurant_lat", "restaurant_lng", "delivery_lat", "delivery_lng", "stage_timestamps",
+]
+
+# order_id -> {"order", "driver", "location", "location_updated_at", "location_read_at", "built_at"}
+_snapshots = {}
+
+
+def _evict_expired():
+    now = datetime.utcnow()
+    expired = [
+        order_id for order_id, snap in _snapshots.items()
+        if (now - snap["built_at"]).total_seconds() > TRACKING_SNAPSHOT_TTL_SECONDS
+    ]
+    for order_id in expired:
+        _snapshots.pop(order_id, None)
+
+
+def update_tracking_order(order: dict):
+    """Refresh the order part of an existing snapshot from an already-loaded order document"""
+    snap = _snapshots.get(order.get("id"))
+    if snap is None:
+        return
+    old = snap["order"]
+    snap["order"] = {key: order.get(key) for key in ORDER_FIELDS}
+    if not _has_restaurant_position(snap["order"]):
+        # Older orders lack the denormalized restaurant position; keep the one looked up at build time
+        snap["order"]["restaurant_lat"] = old.get("restaurant_lat")
+        snap["order"]["restaurant_lng"] = old.get("restaurant_lng")
+    old_driver_id = old.get("driver_id")
+    if order.get("driver_id") != old_driver_id:
+        # Driver changed: drop the cached driver and position so the next poll reloads them
+        _reset_driver(snap)
+
+
+def _has_restaurant_position(order: dict) -> bool:
+    return order.get("restaurant_lat") is not None and order.get("restaurant_lng") is not None
+
+
+def _reset_driver(snap: dict):
+    snap["driver"] = None
+    snap["location"] = None
+    snap["location_updated_at"] = None
+    snap["location_read_at"] = None
+
+
+async def get_tracking_snapshot(order_id: str):
+    """Tracking data for an order: memory first, Mongo only when missing or expired"""
+    now = datetime.utcnow()
+    snap = _snapshots.get(order_id)
+    if snap is None or (now - snap["built_at"]).total_seconds() > TRACKING_SNAPSHOT_TTL_SECONDS:
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0, **{key: 1 for key in ORDER_FIELDS}})
+        if not order:
+            return None
+        if not _has_restaurant_position(order) and not (snap and _has_restaurant_position(snap["order"])):
+            restaurant = await db.restaurants.find_one(
+                {"id": order.get("restaurant_id")}, {"_id": 0, "lat": 1, "lng": 1}
+            )
+            if restaurant:
+                order["restaurant_lat"], order["restaurant_lng"] = restaurant.get("lat"), restaurant.get("lng")
+        if snap is None:
+            if len(_snapshots) >= MAX_SNAPSHOTS:
+                _evict_expired()
+                # Every entry still fresh: start over rather than grow past the cap
+                if len(_snapshots) >= MAX_SNAPSHOTS:
+                    _snapshots.clear()
+            snap = {"order": {}, "built_at": now}
+            _reset_driver(snap)
+            _snapshots[order_id] = snap
+        update_tracking_order(order)
+        snap["built_at"] = now
+
+    driver_id = snap["order"].get("driver_id")
+    if driver_id and snap["driver"] is None:
+        driver = await db.users.find_one(
+            {"id": driver_id},
+            {"_id": 0, "name": 1, "phone": 1, "current_location": 1, "location_updated_at": 1}
+        )
+        snap["driver"] = driver or {}
+
+    if driver_id:
+        # A position pinged to this worker is used while recent; after that the driver may be
+        # reporting to another worker, so fall back to the TTL-bounded read below
+        latest = peek_driver_location(driver_id)
+        if latest is not None and (now - latest["updated_at"]).total_seconds() <= TRACKING_LOCATION_TTL_SECONDS:
+            snap["location"] = {"lat": latest["lat"], "lng": latest["lng"]}
+            snap["location_updated_at"] = latest["updated_at"]
+            snap["location_read_at"] = now
+        elif snap["location_read_at"] is None or (now - snap["location_read_at"]).total_seconds() > TRACKING_LOCATION_TTL_SECONDS:
+            latest = await get_driver_location(driver_id)
+            if latest:
+                snap["location"] = {"lat": latest["lat"], "lng": latest["lng"]}
+                snap["location_updated_at"] = latest.get("updated_at")
+            elif snap["driver"]:
+                snap["location"] = snap["driver"].get("current_location")
+                snap["location_updated_at"] = snap["driver"].get("location_updated_at")
+            snap["location_read_at"] = now
+    return snap